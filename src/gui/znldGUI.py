@@ -15,12 +15,15 @@ except:
 import json
 import shutil
 import datetime
+import time
 
 
 LARGE_FONT = ("Verdana", 16)
 MIDDLE_FONT = ("Verdana", 12)
 LAMP_NAME = ['灯具1', '灯具2', '灯具3']
 LAMP_MAX_NUM = 512
+# environment data shown by PageTwo, (state field, title)
+ENV_METRICS = (('pm2_5', 'PM2.5'), ('pm10', 'PM10'), ('temperature', '温度'), ('humidity', '湿度'))
 
 
 class Led(tk.Canvas):
@@ -69,7 +72,7 @@ class SimpleTable(tk.Frame):
 class Application(tk.Tk):
     """多页面演示程序"""
 
-    def __init__(self, stations):
+    def __init__(self, stations, telemetry=None):
         try:
             super().__init__()
         except TypeError:
@@ -80,6 +83,7 @@ class Application(tk.Tk):
 
         self.time = datetime.datetime.now().strftime("%H:%M:%S %D")
         self._stations = stations
+        self._telemetry = telemetry
 
         try:
             if "nt" == os.name:
@@ -129,6 +133,11 @@ class Application(tk.Tk):
         '''灯具全部关'''
         pass
 
+    def on_zone_lamps_button_click(self, zone, status):
+        """区域灯具开关"""
+        print("Zone #" + str(zone) + " status = " + str(status))
+        pass
+
     def on_lamp_status_query_button_click(self, lamp_num):
         """灯具状态查询"""
         print("Lamp #" + str(lamp_num) + " status query on-going")
@@ -149,6 +158,10 @@ class Application(tk.Tk):
         print("Lamp #" + str(lamp_num) + " checkbotton status = " + str(status))
         pass
 
+    def on_stations_reloaded(self, added, removed, changed):
+        """站点列表重新加载, called from any thread: the pages take the new stations on their next update"""
+        self.frames[PageOne].layout_due = True
+
     def on_lamp_indicator_update(self, lamp_num, status):
         """状态查询更新灯具状态"""
         self.frames[PageOne].leds[lamp_num-1].update(status)
@@ -190,7 +203,8 @@ class StartPage(tk.Frame):
         button4 = ttk.Button(self, text="节能模式一", style="BIG.TButton", state="disabled")
         button5 = ttk.Button(self, text="节能模式二", style="BIG.TButton", state="disabled")
         button6 = ttk.Button(self, text="节能模式三", style="BIG.TButton", state="disabled")
-        button7 = ttk.Button(self, text="环境数据检测", style="BIG.TButton", state="disabled",
+        button7 = ttk.Button(self, text="环境数据检测", style="BIG.TButton",
+                             state="enabled" if root._telemetry is not None else "disabled",
                              command=lambda: root.show_frame(PageTwo))
         button8 = ttk.Button(self, text="系统网络设定", style="BIG.TButton", command=lambda: root.show_frame(PageFour))
         button9 = ttk.Button(self, text="维修模式", style="BIG.TButton", command=lambda: root.show_frame(PageThree))
@@ -219,6 +233,20 @@ class PageOne(tk.Frame):
 
         self.leds = {}
         self.stations = root._stations
+        self._root = root
+        self._button_back = None
+        self.layout_due = False # set by a reload of the station list, the LEDs are laid out again on update()
+        self.layout()
+        self.update()
+
+    def layout(self):
+        ''' one LED per station, on the Tk thread only '''
+        for led in self.leds.itervalues():
+            led.destroy()
+        self.leds = {}
+        if self._button_back is not None:
+            self._button_back.destroy()
+        root = self._root
 
         # calculation the lamps layout from the max_diameter down to the min_diameter
         max_x = 600
@@ -264,16 +292,21 @@ class PageOne(tk.Frame):
 
         button_back = ttk.Button(self, text="回到主页", style="BIG.TButton", command=lambda: root.show_frame(StartPage))
         button_back.grid(row=row+1, columnspan=max_nx, padx=300, pady=10)
-        self.update()
+        self._button_back = button_back
 
     def update(self):
-        for id in self.stations.iterkeys():
-            if self.stations[id]['lamp_ctrl_status']:
+        if self.layout_due:
+            self.layout_due = False
+            self.layout()
+        # lamp_ctrl_status is kept current by the status reports and ACKs of the stations
+        for id in self.leds.iterkeys():
+            if id not in self.stations:
+                # removed by a reload of the station list
+                self.leds[id].update(status='off')
+            elif self.stations[id]['lamp_ctrl_status']:
                 self.leds[id].update(status='on')
-                self.stations[id]['lamp_ctrl_status'] = 0
             else:
                 self.leds[id].update(status='off')
-                self.stations[id]['lamp_ctrl_status'] = 0x3
         self.after(3000, self.update)  # run itself again after 3000 ms
 
 
@@ -286,15 +319,30 @@ class PageTwo(tk.Frame):
         except TypeError:
             tk.Frame.__init__(self)
 
-        self.buttons = []
+        self.stations = root._stations
+        self.telemetry = root._telemetry
 
-        for n in range(len(LAMP_NAME)):
-            # create buttons for each lamps
-            self.buttons.append(ttk.Button(self, text=LAMP_NAME[n], style="Lamp.TButton"))
-            self.buttons[n].grid(row=n, column=0, padx=10, pady=10)
+        # the average of every station now, and the min. and max. of the last 24 hours
+        self.table = SimpleTable(self, rows=len(ENV_METRICS) + 1, columns=4)
+        self.table.grid(row=0, column=0, padx=40, pady=10)
+        for (column, title) in enumerate(('', '当前平均', '24小时最低', '24小时最高')):
+            self.table.set(0, column, title)
+        for (row, (metric, title)) in enumerate(ENV_METRICS):
+            self.table.set(row + 1, 0, title)
 
         button0 = ttk.Button(self, text="回到主页", style="BIG.TButton", command=lambda: root.show_frame(StartPage))\
             .place(x=300, y=350)
+        self.update()
+
+    def update(self):
+        now = time.time()
+        for (row, (metric, title)) in enumerate(ENV_METRICS):
+            current = self.stations.total(metric) / len(self.stations) if len(self.stations) else None
+            summary = self.telemetry.summary(metric, now - 86400, now) if self.telemetry is not None else None
+            self.table.set(row + 1, 1, '-' if current is None else '%.1f' % current)
+            self.table.set(row + 1, 2, '-' if summary is None else '%.1f' % summary[1])
+            self.table.set(row + 1, 3, '-' if summary is None else '%.1f' % summary[2])
+        self.after(60000, self.update)  # run itself again after 60 s
 
 
 class PageThree(tk.Frame):
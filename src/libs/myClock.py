@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import os
+import time
+import ctypes, ctypes.util
+
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _wall_clock():
+    return time.time()
+
+try:
+    from time import monotonic
+except ImportError:
+    # python 2 has no time.monotonic(), so call clock_gettime() directly on linux (RPi)
+    monotonic = _wall_clock
+    if os.name == 'posix':
+        try:
+            _librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+            _clock_gettime = _librt.clock_gettime
+            _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+        except (OSError, AttributeError, TypeError):
+            pass
+        else:
+            def monotonic():
+                ''' seconds (float, nanosecond resolution) from an arbitrary point, never goes backwards '''
+                t = _timespec()
+                if _clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno))
+                return t.tv_sec + t.tv_nsec * 1e-9
+
+
+def deadline(seconds):
+    '''
+    :param seconds: relative timeout in seconds, 0 or None means no deadline
+    :return: absolute deadline on the monotonic clock, or None
+    '''
+    if seconds:
+        return monotonic() + seconds
+    return None
+
+
+def remaining(a_deadline):
+    '''
+    :param a_deadline: absolute deadline returned by deadline()
+    :return: seconds left (never negative), or None if there is no deadline
+    '''
+    if a_deadline is None:
+        return None
+    return max(0.0, a_deadline - monotonic())
+
+
+class SystemClock(object):
+    """
+    the real clock. protocol objects take a clock with monotonic(), sleep() and wait(),
+    so that a simulator can run them on virtual time instead.
+    """
+    def monotonic(self):
+        return monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        '''
+        :param event: threading.Event
+        :param timeout: seconds, None for waiting forever
+        :return: True if event is set
+        '''
+        event.wait(timeout)
+        return event.isSet()
+
+SYSTEM_CLOCK = SystemClock()
+
+
+if __name__ == "__main__":
+    t0 = monotonic()
+    time.sleep(0.01)
+    print '%.3f ms' % ((monotonic() - t0) * 1000)
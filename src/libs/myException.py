@@ -17,5 +17,8 @@ class RxTimeOut(Exception):
 class RxUnexpectedTag(Exception):
     pass
 
+class RxCancelled(Exception):
+    pass
+
 if __name__ == "__main__":
     print RxTimeOutError('abcd',10,5)
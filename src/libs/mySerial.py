@@ -5,8 +5,11 @@ __author__ = 'Wei'
 
 import serial
 import binascii
-from time import sleep
-from myException import RxTimeOutError
+import os
+import select
+import threading
+from myException import RxTimeOutError, RxCancelled
+from myClock import deadline, remaining
 import logging
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
@@ -22,6 +25,13 @@ class aSerial(object):
         self.inHex = inHex
         self.rx_cnt = 0
         self.tx_cnt = 0
+        # fallback polling interval (in seconds) when the port has no selectable file descriptor
+        self.poll_interval = 0.01
+        # receive() cancellation: event is sticky until the pending/next receive() sees it,
+        # the pipe wakes up select() immediately
+        self._cancel = threading.Event()
+        self._cancel_r = None
+        self._cancel_w = None
 
         # serial related parameters
         self.sp = None
@@ -53,6 +63,8 @@ class aSerial(object):
                 logger.debug("%s is opened", self.port)
                 self.isOpen = True
                 self._reset()
+                if self._fileno() is not None and self._cancel_r is None:
+                    self._cancel_r, self._cancel_w = os.pipe()
             return True
         else:
             logger.error("Serial port is NULL")
@@ -63,6 +75,50 @@ class aSerial(object):
         if self.sp:
             self.sp.close()
             logger.debug("%s is closed", self.port)
+        if self._cancel_r is not None:
+            os.close(self._cancel_r)
+            os.close(self._cancel_w)
+            self._cancel_r = None
+            self._cancel_w = None
+
+    def cancel(self):
+        ''' make the pending (or the next) receive() raise RxCancelled, safe to call from another thread '''
+        self._cancel.set()
+        if self._cancel_w is not None:
+            try:
+                os.write(self._cancel_w, '\x00')
+            except OSError:
+                pass
+
+    def _fileno(self):
+        try:
+            return self.sp.fileno()
+        except (AttributeError, serial.SerialException, ValueError):
+            # e.g. windows serial ports can't be select()ed
+            return None
+
+    def _check_cancel(self):
+        if self._cancel.isSet():
+            self._cancel.clear()
+            if self._cancel_r is not None:
+                # drain all wake-up bytes of this cancellation
+                while select.select([self._cancel_r], [], [], 0)[0]:
+                    os.read(self._cancel_r, 64)
+            raise RxCancelled
+
+    def _wait_readable(self, timeout):
+        '''
+        block until some bytes are available, timeout expires or receive is cancelled
+        :param timeout: in seconds, None for waiting forever
+        '''
+        fd = self._fileno()
+        if fd is None:
+            if timeout is None or timeout > self.poll_interval:
+                timeout = self.poll_interval
+            self._cancel.wait(timeout)
+        else:
+            select.select([fd, self._cancel_r], [], [], timeout)
+        self._check_cancel()
 
     def _reset(self):
         self.tx_cnt = 0
@@ -73,33 +129,31 @@ class aSerial(object):
 
     def receive(self, n=0, s=0):
         '''
+        blocks on the port until bytes arrive instead of polling, so it returns as soon as n bytes are received.
         :param n: n bytes to be received, if n=-1, return whatever are received, if n=0, return nothing.
-        :param s: s in seconds for timeout, if s=0, no timeout
+        :param s: s in seconds (float, millisecond resolution) for timeout on the monotonic clock, if s=0, no timeout
         :return: the string received
         '''
         aStr = ''
         rxStr = ''
         rx_cnt = 0
-        timeout = 0
         if self.isOpen == True and n != 0:
             try:
                 if n == -1:
                     rxStr = self.sp.read(self.sp.inWaiting())
                 else:
+                    self._check_cancel()
+                    end = deadline(s)
                     while rx_cnt < n:
                         rxn = self.sp.inWaiting()
-                        left = n - rxn - rx_cnt
-                        if left >= 0:
-                            rxStr = rxStr + self.sp.read(rxn)
-                            rx_cnt = rx_cnt + rxn
-                            if s != 0:
-                                timeout += 1
-                                if timeout > s:
-                                    raise RxTimeOutError(rxStr, n, s)
+                        if rxn > 0:
+                            rxStr = rxStr + self.sp.read(min(rxn, n - rx_cnt))
+                            rx_cnt = len(rxStr)
                         else:
-                            rxStr = rxStr + self.sp.read(n - rx_cnt)
-                            rx_cnt = n
-                        sleep(1)
+                            timeout = remaining(end)
+                            if timeout == 0:
+                                raise RxTimeOutError(rxStr, n, s)
+                            self._wait_readable(timeout)
             except (serial.SerialTimeoutException, serial.SerialException)as e:
                 logger.error("serial read error!")
                 logger.error(e)
@@ -112,6 +166,44 @@ class aSerial(object):
                 #logger.debug("RX (%d/%d bytes): %s", len(rxStr), self.rx_cnt, aStr)
         return aStr
 
+    def receive_into(self, rx_buf, s=0):
+        '''
+        wait for some bytes and read all available ones straight into rx_buf, no intermediate string is built.
+        :param rx_buf: the RxBuffer to be filled
+        :param s: s in seconds for timeout, if s=0, no timeout
+        :return: number of bytes received
+        '''
+        rxn = 0
+        if self.isOpen == True:
+            try:
+                self._check_cancel()
+                end = deadline(s)
+                rxn = self.sp.inWaiting()
+                while rxn == 0:
+                    timeout = remaining(end)
+                    if timeout == 0:
+                        raise RxTimeOutError('', 1, s)
+                    self._wait_readable(timeout)
+                    rxn = self.sp.inWaiting()
+                # no more than the free space, the rest waits in the UART instead of pushing unparsed bytes
+                # (a partial frame) out of rx_buf
+                free = rx_buf.writable()
+                free = free[0:min(rxn, len(free))]
+                if hasattr(self.sp, 'readinto'):
+                    rxn = self.sp.readinto(free)
+                else:
+                    data = self.sp.read(len(free))
+                    rxn = len(data)
+                    free[0:rxn] = data
+                rx_buf.commit(rxn)
+            except (serial.SerialTimeoutException, serial.SerialException)as e:
+                logger.error("serial read error!")
+                logger.error(e)
+                rxn = 0
+            else:
+                self.rx_cnt += rxn
+        return rxn
+
     def transmit(self, aStr):
         tx_cnt = len(aStr)
         if self.isOpen == True:
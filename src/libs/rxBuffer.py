@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class RxBuffer(object):
+    """
+    preallocated bytearray ring buffer for serial RX.
+    unread data lives in [head, tail). Instead of wrapping around, the unread bytes are moved back to
+    the beginning (one memmove of at most a frame or so) when the free space at the end runs out,
+    so that a frame is always contiguous and can be handed out as a memoryview slice without copying.
+    """
+    def __init__(self, size=1024):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._size = size
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0 # bytes thrown away on overflow
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def __getitem__(self, index):
+        ''' zero-copy access to the unread data, slices are memoryviews '''
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._tail - self._head)
+            return self._view[self._head + start : self._head + stop : step]
+        if index < 0:
+            index += self._tail - self._head
+        return self._view[self._head + index]
+
+    def clear(self):
+        self._head = 0
+        self._tail = 0
+
+    def _compact(self):
+        length = self._tail - self._head
+        if self._head > 0:
+            if length > 0:
+                self._buf[0:length] = self._view[self._head:self._tail]
+            self._head = 0
+            self._tail = length
+
+    def writable(self, n=None):
+        '''
+        :param n: bytes expected to be written, the oldest unread bytes are dropped to make room for them;
+                  None for whatever space is left, nothing is dropped
+        :return: memoryview of the free space at the end, commit() the bytes actually written into it
+        '''
+        if n is None:
+            self._compact()
+            return self._view[self._tail:]
+        if n > self._size:
+            n = self._size
+        if self._size - self._tail < n:
+            self._compact()
+            overflow = n - (self._size - self._tail)
+            if overflow > 0:
+                # no room even after compacting, throw away the oldest bytes
+                logger.error('RX buffer overflow, %d bytes dropped', overflow)
+                self.dropped += overflow
+                self._head += overflow
+                self._compact()
+        return self._view[self._tail:]
+
+    def commit(self, n):
+        self._tail += n
+
+    def write(self, data):
+        ''' copy data into the buffer, return the number of bytes written '''
+        n = len(data)
+        if n > self._size:
+            self.dropped += n - self._size
+            data = data[n - self._size:]
+            n = self._size
+        self.writable(n)[0:n] = data
+        self.commit(n)
+        return n
+
+    def find(self, sub, start=0):
+        ''' :return: offset of sub in the unread data, or -1 '''
+        index = self._buf.find(sub, self._head + start, self._tail)
+        if index == -1:
+            return -1
+        return index - self._head
+
+    def consume(self, n):
+        ''' drop n unread bytes '''
+        self._head = min(self._head + n, self._tail)
+        if self._head == self._tail:
+            self._head = 0
+            self._tail = 0
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from znldFrame import Frame, BROADCAST_ADDR, short_id
+
+RC_ADDR = 0 # short address of the RC, station addresses are 1 .. BROADCAST_ADDR-1
+
+
+class AddressBook(object):
+    """
+    short addresses of the nodes, for compact frames. the 6 bytes ID stays the name of a node everywhere
+    else: a compact frame is sent to a node only once it has confirmed its short address (enable()), and
+    the short addresses of a received one are turned back into IDs by resolve().
+    RC knows every station from node_config.json, a STA knows RC and itself from TAG_ADDR_SET.
+    a node which fails to respond to compact frames max_failures times in a row, e.g. behind a legacy RELAY which
+    drops them, stays with legacy frames until it is enabled again.
+    """
+    def __init__(self, max_failures=2):
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._addrs = {} # node ID -> short address
+        self._ids = {} # short_id(addr) -> node ID
+        self._compact = set() # IDs of the nodes which take compact frames
+        self._failures = {} # node ID -> compact frames it failed to respond to since it was enabled
+        # statistics
+        self.conflicts = 0
+        self.fallbacks = 0
+
+    def assign(self, node_id, addr, replace=False):
+        '''
+        :param replace: True to take addr from the node which has it, e.g. on a new assignment from RC
+        :return: False if addr is out of range or already taken by another node, which keeps its address
+        '''
+        if not 0 <= addr < BROADCAST_ADDR:
+            return False
+        with self._lock:
+            owner = self._ids.get(short_id(addr))
+            if owner is not None and owner != node_id and replace:
+                del self._addrs[owner]
+                self._compact.discard(owner)
+                self._failures.pop(owner, None)
+            elif owner is not None and owner != node_id:
+                self.conflicts += 1
+                logger.error('short address %d of %s is taken by %s' %
+                             (addr, binascii.b2a_hex(node_id), binascii.b2a_hex(owner)))
+                return False
+            old = self._addrs.get(node_id)
+            if old is not None and old != addr:
+                del self._ids[short_id(old)]
+                self._compact.discard(node_id)
+                self._failures.pop(node_id, None)
+            self._addrs[node_id] = addr
+            self._ids[short_id(addr)] = node_id
+            return True
+
+    def release(self, node_id):
+        ''' forget the short address of node_id, e.g. a station removed from the network '''
+        with self._lock:
+            addr = self._addrs.pop(node_id, None)
+            if addr is not None:
+                del self._ids[short_id(addr)]
+            self._compact.discard(node_id)
+            self._failures.pop(node_id, None)
+
+    def addr_of(self, node_id):
+        ''' :return: short address of node_id, None if it has none '''
+        return self._addrs.get(node_id)
+
+    def enable(self, node_id):
+        ''' node_id takes compact frames from now on, e.g. it confirmed its address or sent a compact frame '''
+        with self._lock:
+            if node_id in self._addrs:
+                self._compact.add(node_id)
+                self._failures[node_id] = 0
+
+    def disable(self, node_id):
+        ''' back to legacy frames, e.g. node_id didn't respond as it may have lost its short address '''
+        with self._lock:
+            if node_id in self._compact:
+                self._compact.discard(node_id)
+                self.fallbacks += 1
+                if node_id in self._failures:
+                    self._failures[node_id] += 1
+
+    def retry(self, node_id):
+        '''
+        compact frames to node_id again after it responded in the legacy format, unless it was enabled
+        never, or it failed max_failures times since
+        '''
+        with self._lock:
+            if self._failures.get(node_id, self.max_failures) < self.max_failures:
+                self._compact.add(node_id)
+
+    def compact(self, src_id, dest_id):
+        '''
+        :return: (source addr, destination addr) if a frame from src_id to dest_id can be compact, else None
+        '''
+        if dest_id not in self._compact:
+            return None
+        src_addr = self._addrs.get(src_id)
+        if src_addr is None:
+            return None
+        return (src_addr, self._addrs[dest_id])
+
+    def resolve(self, frame):
+        '''
+        :param frame: received Frame
+        :return: frame with the IDs of the known short addresses, the same one if it isn't compact
+        '''
+        if not frame.is_compact():
+            return frame
+        src_id = self._ids.get(frame.src_id, frame.src_id)
+        dest_id = self._ids.get(frame.dest_id, frame.dest_id)
+        if src_id is frame.src_id and dest_id is frame.dest_id:
+            return frame
+        return Frame(src_id, dest_id, frame.sn, frame.tag, frame.value, frame.raw)
+
+    def stats(self):
+        return dict(addresses=len(self._addrs), compact=len(self._compact), conflicts=self.conflicts,
+                    fallbacks=self.fallbacks)
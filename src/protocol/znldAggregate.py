@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import struct
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from znldBitmap import MAX_ADDR, chunk_addrs
+from znldSeq import sn_add
+
+
+class AckAggregator(object):
+    """
+    RELAY side ACK aggregation of a multicast request (broadcast or group lamp ctrl which asks for ACKs):
+    while the window of the request is open, the ACKs of the downstream STAs which this RELAY would forward
+    are taken in here instead, and sent upstream at the end as one ACK bitmap of their addr.
+    a window is (RC ID, request SN), the ACKs come with request SN + 1.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {} # (rc_id, sn) -> set of addr
+        # statistics
+        self.windows = 0
+        self.absorbed = 0
+
+    def open(self, rc_id, sn):
+        ''' :return: True if the window is new, i.e. its closing is to be scheduled '''
+        with self._lock:
+            if (rc_id, sn) in self._windows:
+                return False
+            self._windows[(rc_id, sn)] = set()
+            self.windows += 1
+            return True
+
+    def absorb(self, rc_id, ack_sn, addr):
+        '''
+        :param ack_sn: SN of the ACK
+        :return: True if the ACK is taken into an open window, False to handle it as usual
+        '''
+        if not 0 <= addr < MAX_ADDR:
+            return False
+        with self._lock:
+            window = self._windows.get((rc_id, sn_add(ack_sn, -1)))
+            if window is None:
+                return False
+            window.add(addr)
+            self.absorbed += 1
+            return True
+
+    def close(self, rc_id, sn):
+        ''' :return: sorted addr of every ACK taken in the window '''
+        with self._lock:
+            return sorted(self._windows.pop((rc_id, sn), ()))
+
+    def stats(self):
+        return dict(open=len(self._windows), windows=self.windows, absorbed=self.absorbed)
+
+
+class AckCollector(object):
+    """
+    RC side of a multicast request asking for ACKs: which stations applied it, from the ACK bitmaps of
+    the RELAYs and the ACKs of the stations which RC hears directly.
+    """
+    def __init__(self, rc_id, sn, keys, tag_ack, tag_ack_bitmap):
+        '''
+        :param sn: SN of the request
+        :param keys: dict of addr (the ACK slot key of a station): station ID
+        '''
+        self.rc_id = rc_id
+        self.ack_sn = sn_add(sn, 1)
+        self._keys = keys
+        self._tag_ack = tag_ack
+        self._tag_ack_bitmap = tag_ack_bitmap
+        self.acked = set() # station IDs
+        self.done = threading.Event() # every station ACKed
+        # statistics
+        self.acks = 0
+        self.bitmaps = 0
+
+    def feed(self, rx_frame):
+        '''
+        :param rx_frame: a Frame received by RC
+        :return: True if it is an ACK of the request, which is then taken here
+        '''
+        if rx_frame.sn != self.ack_sn:
+            return False
+        if rx_frame.tag == self._tag_ack_bitmap:
+            self.bitmaps += 1
+            addrs = chunk_addrs(rx_frame.dest_id, rx_frame.value)
+        elif rx_frame.tag == self._tag_ack and rx_frame.dest_id == self.rc_id:
+            addr = struct.unpack('>H', rx_frame.value[0:2])[0]
+            if self._keys.get(addr) != rx_frame.src_id:
+                # an ACK of some other request
+                return False
+            self.acks += 1
+            addrs = [addr]
+        else:
+            return False
+        for addr in addrs:
+            id = self._keys.get(addr)
+            if id is not None:
+                self.acked.add(id)
+        if len(self.acked) == len(self._keys):
+            self.done.set()
+        return True
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from znldFrame import ID_LEN
+
+# lamp states of a whole network in one bitmap, bit (addr % 8) of byte (addr / 8) is on/off of lamp `addr`.
+# a bitmap frame has no destination, so its dest field carries 6 bitmap bytes and the value 3 more after the
+# chunk index: 9 bytes i.e. 72 lamps per frame, 8 frames for 512 lamps.
+BITMAP_LAMPS = 512
+CHUNK_BYTES = ID_LEN + 3
+CHUNK_LAMPS = CHUNK_BYTES * 8
+MAX_ADDR = 256 * CHUNK_LAMPS # the chunk index is one byte
+
+
+def make_bitmap(lamps_on, lamps=BITMAP_LAMPS):
+    '''
+    :param lamps_on: iterable of the addr of every lamp to be on, the others are off
+    :param lamps: number of lamps (addr 0 .. lamps-1) covered by the bitmap
+    :return: bytearray of (lamps + 7) / 8 bytes
+    '''
+    bitmap = bytearray((lamps + 7) // 8)
+    for addr in lamps_on:
+        assert 0 <= addr < lamps, 'lamp addr out of range'
+        bitmap[addr >> 3] |= 1 << (addr & 7)
+    return bitmap
+
+
+def chunks(bitmap, skip_empty=False):
+    '''
+    split a bitmap into as few frames as it takes, the last one is padded with lamps off
+    :param bitmap: bytearray or str
+    :param skip_empty: True to leave out the chunks without any bit set
+    :return: list of (dest field, value) of each frame
+    '''
+    bitmap = bytearray(bitmap)
+    frames = []
+    for index in range(0, (len(bitmap) + CHUNK_BYTES - 1) // CHUNK_BYTES):
+        chunk = bitmap[index * CHUNK_BYTES:(index + 1) * CHUNK_BYTES]
+        if skip_empty and not any(chunk):
+            continue
+        chunk += bytearray(CHUNK_BYTES - len(chunk))
+        frames.append((str(chunk[:ID_LEN]), chr(index) + str(chunk[ID_LEN:])))
+    return frames
+
+
+def chunk_addrs(dest_id, value):
+    ''' :return: addr of every bit set in a received bitmap frame '''
+    base = ord(value[0]) * CHUNK_LAMPS
+    return [base + (index << 3) + bit for (index, byte) in enumerate(bytearray(dest_id + value[1:]))
+            if byte for bit in range(8) if byte & (1 << bit)]
+
+
+def lamp_state(dest_id, value, addr):
+    '''
+    pick the bit of one lamp out of a received bitmap frame
+    :param dest_id: dest field of the frame
+    :param value: value of the frame, the chunk index and 3 bitmap bytes
+    :return: True (on) or False (off), None if the lamp isn't in this chunk
+    '''
+    if addr is None:
+        return None
+    offset = addr - ord(value[0]) * CHUNK_LAMPS
+    if not 0 <= offset < CHUNK_LAMPS:
+        return None
+    chunk = dest_id + value[1:]
+    return bool(ord(chunk[offset >> 3]) & (1 << (offset & 7)))
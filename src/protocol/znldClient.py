@@ -0,0 +1,237 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import socket
+import binascii
+import itertools
+import threading
+from collections import Mapping
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myException import RxNack, RxTimeOut, RxUnexpectedTag, RxCancelled
+from znldRpc import RPC_SOCKET, RpcError, LineReader, encode, request
+
+ERRORS = dict((e.__name__, e) for e in (RxNack, RxTimeOut, RxUnexpectedTag, RxCancelled))
+
+
+class RcClient(object):
+    """
+    a client of the RC daemon (see znldDaemon), with the RC_* methods of the RC Protocol the GUI and the scripts
+    use, so that they share the daemon's radio and its warm network session instead of opening the E32.
+    """
+    def __init__(self, path=RPC_SOCKET, timeout=None):
+        '''
+        :param timeout: default seconds to wait for a response, None for ever
+        :raise socket.error: when no daemon serves on path
+        '''
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {} # request id: [Event, response]
+        self._listeners = [] # callback(method, params) of the notifications
+        self._closed = False
+        self._reader = threading.Thread(target=self._read, name='Thread RC client')
+        self._reader.setDaemon(True)
+        self._reader.start()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+
+    def call(self, method, params=None, priority=None, timeout=None):
+        '''
+        :param priority: of the request in the queue of the daemon, lower first, the default one by method
+        :return: result of the request
+        :raise RpcError: on an error response, or when the daemon is gone
+        '''
+        id = next(self._ids)
+        waiter = [threading.Event(), None]
+        with self._lock:
+            if self._closed:
+                raise RpcError(-1, 'not connected to RC daemon')
+            self._pending[id] = waiter
+            self._sock.sendall(encode(request(id, method, params, priority)))
+        waiter[0].wait(timeout or self.timeout)
+        with self._lock:
+            self._pending.pop(id, None)
+        response = waiter[1]
+        if response is None:
+            raise RpcError(-1, '%s got no response from RC daemon' % method)
+        if 'error' in response:
+            raise RpcError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def subscribe(self, callback, fields=None):
+        '''
+        :param callback: callback(method, params) is called by the reader thread on each notification,
+                         'state' {id, field, value} and 'stations' {added, removed, changed}
+        :param fields: state fields to be notified of, every one but last_seen by default
+        '''
+        self._listeners.append(callback)
+        self.call('subscribe', {'fields': fields} if fields is not None else None)
+
+    def _read(self):
+        reader = LineReader(self._sock)
+        while True:
+            try:
+                message = reader.next()
+            except ValueError:
+                logger.error('RC daemon sent a line which isn\'t JSON')
+                continue
+            except socket.error:
+                break
+            if message is None:
+                break
+            if 'id' not in message:
+                for callback in list(self._listeners):
+                    callback(message.get('method'), message.get('params'))
+                continue
+            with self._lock:
+                waiter = self._pending.get(message['id'])
+            if waiter is not None:
+                waiter[1] = message
+                waiter[0].set()
+        if not self._closed:
+            logger.error('RC daemon closed the connection')
+        with self._lock:
+            self._closed = True
+            pending = self._pending.values()
+        for waiter in pending:
+            waiter[0].set()
+
+    # the RC methods of Protocol, with station IDs and values in bytes
+
+    def RC_lamp_ctrl(self, dest_id, value):
+        return self.call('lamp_ctrl', {'id': binascii.b2a_hex(dest_id), 'value': binascii.b2a_hex(value)})
+
+    def RC_lamp_ctrl_multi(self, dest_ids, value):
+        return _bin_keys(self.call('lamp_ctrl_multi', {'ids': [binascii.b2a_hex(id) for id in dest_ids],
+                                                       'value': binascii.b2a_hex(value)}))
+
+    def RC_lamp_ctrl_group(self, group, value, ack=False):
+        return _bin_keys(self.call('lamp_ctrl_group', {'group': group, 'value': binascii.b2a_hex(value),
+                                                       'ack': ack}))
+
+    def RC_lamp_ctrl_broadcast(self, value, ack=True):
+        return _bin_keys(self.call('lamp_ctrl_broadcast', {'value': binascii.b2a_hex(value), 'ack': ack}))
+
+    def RC_reliable_broadcast(self, value, rounds=3):
+        return _bin_keys(self.call('reliable_broadcast', {'value': binascii.b2a_hex(value), 'rounds': rounds}))
+
+    def RC_lamp_bitmap(self, lamps_on, lamps=None):
+        return self.call('lamp_bitmap', {'lamps_on': list(lamps_on), 'lamps': lamps})
+
+    def RC_unicast_poll_multi(self, dest_ids, expected):
+        ''' :return: dict of dest_id: None on success, or the exception (RxTimeOut, RxNack) on failure '''
+        errors = self.call('poll', {'ids': [binascii.b2a_hex(id) for id in dest_ids],
+                                    'expected': None if expected is None else binascii.b2a_hex(expected)})
+        return dict((binascii.a2b_hex(id), None if name is None else ERRORS.get(name, RxTimeOut)())
+                    for (id, name) in errors.iteritems())
+
+    def RC_read_telemetry(self, dest_ids=None, fields=None):
+        params = {'fields': list(fields) if fields is not None else None}
+        if dest_ids is not None:
+            params['ids'] = [binascii.b2a_hex(id) for id in dest_ids]
+        return _bin_keys(self.call('read_telemetry', params))
+
+    def RC_out_of_sync(self):
+        return [binascii.a2b_hex(id) for id in self.call('out_of_sync')]
+
+
+def _bin_keys(results):
+    return dict((binascii.a2b_hex(id), value) for (id, value) in results.iteritems())
+
+
+class RemoteStations(Mapping):
+    """
+    read only copy of the StationStore of the RC daemon, kept current by its state notifications, for the GUI:
+    stations[id] is a dict of the config and state fields of a station.
+    """
+    def __init__(self, client, fields=None):
+        '''
+        :param fields: state fields to keep current, every one but last_seen by default
+        '''
+        self._client = client
+        self._lock = threading.Lock()
+        self._stations = {}
+        self._addrs = {} # addr -> station ID
+        self.on_reload = None # on_reload(added, removed, changed) is called by a thread of its own after a reload
+        client.subscribe(self._notified, fields)
+        self.refresh()
+
+    def refresh(self):
+        stations = self._client.call('stations')
+        addrs = dict((station['addr'], id) for (id, station) in stations.iteritems() if 'addr' in station)
+        with self._lock:
+            self._stations = stations
+            self._addrs = addrs
+
+    def _notified(self, method, params):
+        if method == 'stations':
+            removed = set(params['removed'])
+            with self._lock:
+                # the addrs of the removed stations are gone right away, the new ones come with the refresh
+                self._addrs = dict((addr, id) for (addr, id) in self._addrs.iteritems() if id not in removed)
+            # the reader thread mustn't wait for a response it reads itself
+            thread = threading.Thread(target=self._reloaded, args=(params,), name='Thread RC stations')
+            thread.setDaemon(True)
+            thread.start()
+        elif method == 'state':
+            with self._lock:
+                station = self._stations.get(params['id'])
+                if station is not None:
+                    station[params['field']] = params['value']
+
+    def _reloaded(self, params):
+        self.refresh()
+        if self.on_reload is not None:
+            self.on_reload(params['added'], params['removed'], params['changed'])
+
+    def __getitem__(self, id):
+        return self._stations[id]
+
+    def __iter__(self):
+        return iter(list(self._stations))
+
+    def __len__(self):
+        return len(self._stations)
+
+    def by_addr(self, addr):
+        ''' :return: ID of the station with addr, None if there is none '''
+        return self._addrs.get(addr)
+
+    def bin_of(self, id):
+        ''' :return: ID bytes of the station with ID id '''
+        return binascii.a2b_hex(id)
+
+    def total(self, name):
+        ''' sum of a state field over every station, e.g. total('power') '''
+        return sum(station.get(name) or 0 for station in self._stations.values())
+
+
+class RemoteTelemetry(object):
+    """ the queries of the TelemetryStore of the RC daemon """
+    def __init__(self, client):
+        self._client = client
+
+    def query(self, metric, start, stop, addr=None, step=None, resolution=None):
+        return [tuple(row) for row in self._client.call('telemetry_query', {
+            'metric': metric, 'start': start, 'stop': stop, 'addr': addr, 'step': step, 'resolution': resolution})]
+
+    def summary(self, metric, start, stop, addr=None):
+        summary = self._client.call('telemetry_summary', {'metric': metric, 'start': start, 'stop': stop,
+                                                          'addr': addr})
+        return None if summary is None else tuple(summary)
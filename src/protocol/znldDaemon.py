@@ -0,0 +1,606 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import os
+import math
+import time
+import heapq
+import socket
+import binascii
+import itertools
+import threading
+import types
+import Queue
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from znldProtocol import Protocol
+from znldFrame import ID_LEN
+from znldRegistry import StationFile, config_path
+from znldStore import STATE_FIELDS
+from znldSeries import TelemetryStore
+from znldTelemetry import TELEMETRY_NAMES
+from znldRpc import RPC_SOCKET, PRIORITY_CONTROL, PRIORITY_POLL, PRIORITY_BACKGROUND, PARSE_ERROR, INVALID_REQUEST, \
+    METHOD_NOT_FOUND, INVALID_PARAMS, INTERNAL_ERROR, LineReader, encode, notification, result, error
+
+# RPC method: priority of its request in the queue, None for the methods answered right away without the radio
+METHODS = {'lamp_ctrl': PRIORITY_CONTROL, 'lamp_ctrl_multi': PRIORITY_CONTROL, 'lamp_ctrl_group': PRIORITY_CONTROL,
+           'lamp_ctrl_broadcast': PRIORITY_CONTROL, 'reliable_broadcast': PRIORITY_CONTROL,
+           'lamp_bitmap': PRIORITY_CONTROL, 'poll': PRIORITY_POLL, 'read_telemetry': PRIORITY_POLL,
+           'stations': None, 'out_of_sync': None, 'telemetry_query': None, 'telemetry_summary': None, 'stats': None,
+           'subscribe': None, 'unsubscribe': None}
+
+
+class _Request(object):
+    """ a request in the RequestQueue """
+    def __init__(self, func, args, callback):
+        self._func = func
+        self._args = args
+        self._callback = callback
+        self._steps = None # the generator of a request which runs in steps
+        self._result = None
+        self.done = False
+
+    def step(self):
+        ''' run the request, or its next step '''
+        try:
+            if self._steps is None:
+                value = self._func(*self._args)
+                if not isinstance(value, types.GeneratorType):
+                    self._finish(value, None)
+                    return
+                self._steps = value
+            self._result = next(self._steps)
+        except StopIteration:
+            self._finish(self._result, None)
+        except (TypeError, ValueError, KeyError) as e:
+            # bad params of a client
+            logger.warning('request failed: %s' % e)
+            self._finish(None, e)
+        except Exception as e:
+            logger.exception('request failed')
+            self._finish(None, e)
+
+    def _finish(self, value, e):
+        self.done = True
+        if self._callback is not None:
+            self._callback(value, e)
+
+
+class RequestQueue(object):
+    """
+    the requests which use the radio, run one at a time by one thread in priority order (lower first, FIFO within
+    a priority). a request which returns a generator runs up to its next yield at a time and then goes back to its
+    place in the queue, so that a long sweep lets the urgent requests in between its steps; its result is the
+    value of its last yield.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = [] # (priority, order, _Request)
+        self._order = itertools.count()
+        self._thread = None
+        self._stop = False
+        # statistics
+        self.requests = 0
+        self.steps = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='Thread RC request queue')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, priority, func, args=(), callback=None):
+        '''
+        :param callback: callback(result, exception) is called by the queue thread when the request is done
+        '''
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._order), _Request(func, args, callback)))
+            self.requests += 1
+            self._cond.notify()
+
+    def call(self, priority, func, *args):
+        ''' submit a request and wait for it, :return: its result, :raise: its exception '''
+        done = threading.Event()
+        outcome = []
+        self.submit(priority, func, args, lambda value, e: (outcome.extend((value, e)), done.set()))
+        done.wait()
+        if outcome[1] is not None:
+            raise outcome[1]
+        return outcome[0]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                (priority, order, request) = heapq.heappop(self._heap)
+            request.step()
+            self.steps += 1
+            if not request.done:
+                with self._cond:
+                    heapq.heappush(self._heap, (priority, order, request))
+
+    def stats(self):
+        with self._cond:
+            return dict(queued=len(self._heap), requests=self.requests, steps=self.steps)
+
+
+class _Connection(object):
+    """ a client of the RC daemon, its messages out go through a queue so that a slow client never blocks RC """
+    def __init__(self, sock, server, backlog=1024):
+        self.sock = sock
+        self._server = server
+        self._out = Queue.Queue(maxsize=backlog)
+        self.fields = None # state fields subscribed to, None without a subscription
+        self.closed = False
+        self._reader = threading.Thread(target=self._read, name='Thread RC client')
+        self._reader.setDaemon(True)
+        self._writer = threading.Thread(target=self._write, name='Thread RC client out')
+        self._writer.setDaemon(True)
+
+    def start(self):
+        self._reader.start()
+        self._writer.start()
+
+    def send(self, message):
+        if self.closed:
+            return
+        try:
+            self._out.put_nowait(message)
+        except Queue.Full:
+            logger.warning('RC client doesn\'t keep up, dropped')
+            self.close()
+
+    def close(self):
+        '''
+        never blocks, as send() calls it from the state callbacks of the StationStore on the RC threads: the
+        shutdown breaks a sendall() of the writer to a client which stopped reading, and the messages still
+        queued make room for the one which stops the writer
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        while True:
+            try:
+                self._out.put_nowait(None)
+                break
+            except Queue.Full:
+                try:
+                    self._out.get_nowait()
+                except Queue.Empty:
+                    pass
+        self._server._closed(self)
+
+    def _read(self):
+        reader = LineReader(self.sock)
+        while not self.closed:
+            try:
+                message = reader.next()
+            except ValueError:
+                self.send(error(None, PARSE_ERROR, 'parse error'))
+                continue
+            except socket.error:
+                break
+            if message is None:
+                break
+            self._server.handle(self, message)
+        self.close()
+
+    def _write(self):
+        while True:
+            message = self._out.get()
+            if message is None or self.closed:
+                break
+            try:
+                self.sock.sendall(encode(message))
+            except socket.error:
+                break
+        self.sock.close()
+
+
+class RcDaemon(object):
+    """
+    headless RC: it owns the E32 (the RC Protocol), the station list and the telemetry store, and serves the RC
+    API of znldRpc on a Unix socket of this host only. the requests of every client and of the housekeeping go
+    through one priority queue, so the GUI, test scripts and cron jobs share one network session.
+    """
+    def __init__(self, node_config, config_file='node_config.json', rc=None, telemetry=None):
+        '''
+        :param node_config: the RC node_config.json
+        :param config_file: file of node_config, the station list if it has no 'station_file'
+        :param rc: RC Protocol to serve instead of one on the E32, e.g. on a simulated radio
+        :param telemetry: TelemetryStore instead of the one in node_config 'telemetry_dir'
+        '''
+        self.path = node_config.get('rpc_socket', RPC_SOCKET)
+        # the station list is 'stations' of node_config.json, or the JSON/CSV file given as 'station_file',
+        # which is reloaded whenever it is modified
+        self.station_file = StationFile(config_path(config_file, node_config.get('station_file', config_file)))
+        if rc is None:
+            rc = Protocol(id=binascii.a2b_hex(node_config['id'].strip()), role='RC', hop=node_config['hop'],
+                          baudrate=node_config['e32']['baudrate'], testing=node_config['testing'].strip().upper(),
+                          timeout=node_config['timeout'], e32_delay=node_config['e32_delay'],
+                          relay_delay=node_config['relay_delay'],
+                          relay_random_backoff=node_config['relay_random_backoff'],
+                          window=node_config.get('window', 1), slots=node_config.get('slots', 8),
+                          slot_guard=node_config.get('slot_guard', 0.05), stations=self.station_file.load())
+            rc.setName('Thread RC receiving')
+            rc.setDaemon(True)
+        self.rc = rc
+        self.stations = rc.get_stas_dict()
+        # telemetry_fields of the stations read every telemetry_interval seconds, kept for telemetry_retention
+        # ('raw', '1m', '1h' seconds) in telemetry_dir
+        if telemetry is None:
+            telemetry = TelemetryStore(config_path(config_file, node_config.get('telemetry_dir', 'telemetry')),
+                                       retention=node_config.get('telemetry_retention'))
+        self.telemetry = telemetry
+        self.telemetry_interval = node_config.get('telemetry_interval', 300)
+        self.telemetry_fields = node_config.get('telemetry_fields', TELEMETRY_NAMES)
+        # seconds without hearing from a station before it is polled
+        self.liveness_interval = node_config.get('liveness_interval', 300)
+        # stations per step of a sweep, a lamp ctrl waits for one step at most
+        self.sweep_chunk = node_config.get('sweep_chunk', 16)
+        self.queue = RequestQueue()
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._sweeps = set() # names of the housekeeping sweeps in the queue
+        self._listener = None
+        self._stopped = False
+
+    # life cycle
+
+    def start(self):
+        ''' start RC and serve its API, the slot, short address and group maps are sent before any request '''
+        self.rc.telemetry = self.telemetry
+        self.stations.on_change = self._on_change
+        if not self.rc.isAlive():
+            self.rc.start()
+        self.queue.start()
+        self.queue.submit(PRIORITY_CONTROL, self._setup)
+        self._listen()
+        for (target, name) in ((self._accept, 'Thread RC daemon'), (self._housekeeping, 'Thread RC housekeeping')):
+            thread = threading.Thread(target=target, name=name)
+            thread.setDaemon(True)
+            thread.start()
+        logger.info('RC daemon serves on %s' % self.path)
+
+    def stop(self):
+        self._stopped = True
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        self.queue.stop()
+        self.rc.stop()
+        self.rc.join()
+        self.telemetry.close()
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while self.rc.isAlive():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.debug('Stopping RC daemon by Ctrl-C')
+        finally:
+            self.stop()
+
+    def _setup(self):
+        self.rc.RC_send_slot_map()
+        self.rc.RC_send_address_map()
+        self.rc.RC_send_group_map()
+
+    def _listen(self):
+        ''' a Unix socket for the users of this host only, a stale one of a daemon which died is taken over '''
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.unlink(self.path)
+            else:
+                raise RuntimeError('an RC daemon is running on %s' % self.path)
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        os.chmod(self.path, 0660)
+        listener.listen(8)
+        self._listener = listener
+
+    def _accept(self):
+        while not self._stopped:
+            try:
+                (sock, address) = self._listener.accept()
+            except (socket.error, AttributeError):
+                break
+            client = _Connection(sock, self)
+            with self._lock:
+                self._clients.add(client)
+            logger.info('RC client connected, %d clients' % len(self._clients))
+            client.start()
+
+    def _closed(self, client):
+        with self._lock:
+            self._clients.discard(client)
+        logger.info('RC client disconnected, %d clients' % len(self._clients))
+
+    def _housekeeping(self):
+        ''' reload the station list when its file is modified, read the telemetry of the stations (right away for
+            those which reported a change), and poll the stations which went silent (the others report their
+            status changes). the sweeps run in the queue while this thread goes on '''
+        checked = compacted = time.time()
+        read = 0
+        while not self._stopped and self.rc.isAlive():
+            time.sleep(5)
+            stations = self.station_file.changed()
+            if stations is not None:
+                try:
+                    (added, removed, changed) = self.queue.call(PRIORITY_POLL, self.rc.RC_reload_stations, stations)
+                except ValueError as e:
+                    self.station_file.errors += 1
+                    logger.error('%s is not reloaded: %s' % (self.station_file.path, e))
+                else:
+                    self.notify('stations', dict(added=added, removed=removed, changed=changed))
+            # RC records the values read into self.telemetry
+            if time.time() - read >= self.telemetry_interval:
+                read = time.time()
+                self._start_sweep('telemetry', PRIORITY_BACKGROUND, self.rc.RC_read_telemetry,
+                                  self.stations.bin_ids, (self.telemetry_fields,), self._telemetry_read)
+            self._start_sweep('telemetry due', PRIORITY_POLL, self.rc.RC_read_telemetry, self.rc.RC_telemetry_due,
+                              (self.telemetry_fields,), self._telemetry_read)
+            if self.telemetry.due():
+                self.telemetry.flush()
+            if time.time() - compacted >= 3600:
+                compacted = time.time()
+                self.telemetry.compact()
+            if time.time() - checked < self.liveness_interval:
+                continue
+            checked = time.time()
+            self._start_sweep('liveness', PRIORITY_BACKGROUND, self.rc.RC_unicast_poll_multi,
+                              lambda: self.rc.RC_silent(self.liveness_interval), (None,), self._liveness_checked)
+
+    def _start_sweep(self, name, priority, request, dest_ids, args, done):
+        '''
+        submit a sweep without waiting for it, unless the last one of the same name is still in the queue
+        :param dest_ids: dest_ids() gives the stations to sweep, taken only when the sweep is submitted
+        :param done: done(results) is called by the queue thread when the sweep is done
+        '''
+        with self._lock:
+            if name in self._sweeps:
+                logger.debug('%s sweep is still in the queue' % name)
+                return
+            ids = dest_ids()
+            if not ids:
+                return
+            self._sweeps.add(name)
+
+        def finished(results, e):
+            with self._lock:
+                self._sweeps.discard(name)
+            if e is None:
+                done(results)
+        self.queue.submit(priority, self._sweep, (request, ids, args), finished)
+
+    def _telemetry_read(self, values):
+        missing = [id for id in values.keys() if not values[id]]
+        if missing:
+            logger.warning('no telemetry from %d STAs' % len(missing))
+
+    def _liveness_checked(self, errors):
+        missing = [id for id in errors.keys() if errors[id] is not None]
+        if missing:
+            logger.warning('no response from %d STAs: %s' %
+                           (len(missing), ', '.join(binascii.b2a_hex(id) for id in missing)))
+
+    def _sweep(self, request, dest_ids, args, convert=None):
+        '''
+        a queue request which runs request(dest_ids, *args) on sweep_chunk stations per step
+        :param convert: convert(results) gives the result of the whole sweep
+        '''
+        results = {}
+        for start in range(0, len(dest_ids), self.sweep_chunk):
+            if start:
+                # let the urgent requests in
+                yield None
+            results.update(request(dest_ids[start:start + self.sweep_chunk], *args))
+        yield results if convert is None else convert(results)
+
+    # requests of the clients
+
+    def handle(self, client, message):
+        ''' a message from a client, answered by the queue thread for the methods which use the radio '''
+        if not isinstance(message, dict) or not isinstance(message.get('method'), basestring):
+            client.send(error(None, INVALID_REQUEST, 'invalid request'))
+            return
+        id = message.get('id')
+        method = message['method']
+        params = message.get('params') or {}
+        if method not in METHODS or not isinstance(params, dict):
+            client.send(error(id, METHOD_NOT_FOUND if method not in METHODS else INVALID_PARAMS,
+                              'unknown method %s' % method if method not in METHODS else 'params is not an object'))
+            return
+        params = dict((str(key), value) for (key, value) in params.iteritems())
+        handler = getattr(self, 'rpc_' + method, None)
+        respond = lambda value, e: self._respond(client, id, method, value, e)
+        if METHODS[method] is None:
+            try:
+                value = handler(**params) if handler is not None else self._subscribe(client, method, **params)
+            except Exception as e:
+                respond(None, e)
+            else:
+                respond(value, None)
+            return
+        priority = message.get('priority', METHODS[method])
+        if not isinstance(priority, (int, long)):
+            client.send(error(id, INVALID_REQUEST, 'priority is not an integer'))
+            return
+        self.queue.submit(priority, lambda: handler(**params), (), respond)
+
+    def _respond(self, client, id, method, value, e):
+        if id is None:
+            # a notification from the client wants no response
+            return
+        if e is None:
+            client.send(result(id, value))
+        elif isinstance(e, (TypeError, ValueError, KeyError)):
+            client.send(error(id, INVALID_PARAMS, '%s: %s' % (method, e)))
+        else:
+            client.send(error(id, INTERNAL_ERROR, '%s: %s' % (method, e.__class__.__name__)))
+
+    def _subscribe(self, client, method, fields=None):
+        '''
+        subscribe a client to the changes of state fields, every one but last_seen by default, and to the
+        reloads of the station list, or unsubscribe it
+        '''
+        names = set(name for (name, typecode, default) in STATE_FIELDS)
+        if method == 'unsubscribe':
+            client.fields = None
+        elif fields is None:
+            client.fields = names - set(['last_seen'])
+        elif set(fields) - names:
+            raise ValueError('unknown state fields %s' % ', '.join(sorted(set(fields) - names)))
+        else:
+            client.fields = set(fields)
+        return True
+
+    def _on_change(self, id, field, value):
+        ''' a state field of a station changed, tell the clients which subscribed to it '''
+        with self._lock:
+            clients = [client for client in self._clients if client.fields is not None and field in client.fields]
+        if clients:
+            message = notification('state', dict(id=id, field=field, value=_json_value(value)))
+            for client in clients:
+                client.send(message)
+
+    def notify(self, method, params):
+        ''' tell every subscribed client, e.g. of a reload of the station list '''
+        with self._lock:
+            clients = [client for client in self._clients if client.fields is not None]
+        message = notification(method, params)
+        for client in clients:
+            client.send(message)
+
+    # RPC methods, see METHODS
+
+    def rpc_lamp_ctrl(self, id, value):
+        ''' :param id: station ID, or '000000000000' to broadcast '''
+        return self.rc.RC_lamp_ctrl(_bin_id(id), _lamp_value(value))
+
+    def rpc_lamp_ctrl_multi(self, ids, value):
+        return _hex_keys(self.rc.RC_lamp_ctrl_multi([_bin_id(id) for id in ids], _lamp_value(value)))
+
+    def rpc_lamp_ctrl_group(self, group, value, ack=False):
+        return _hex_keys(self.rc.RC_lamp_ctrl_group(int(group), _lamp_value(value), ack=bool(ack)))
+
+    def rpc_lamp_ctrl_broadcast(self, value, ack=True):
+        return _hex_keys(self.rc.RC_lamp_ctrl_broadcast(_lamp_value(value), ack=bool(ack)))
+
+    def rpc_reliable_broadcast(self, value, rounds=3):
+        return _hex_keys(self.rc.RC_reliable_broadcast(_lamp_value(value), rounds=int(rounds)))
+
+    def rpc_lamp_bitmap(self, lamps_on, lamps=None):
+        if lamps is None:
+            return self.rc.RC_lamp_bitmap([int(addr) for addr in lamps_on])
+        return self.rc.RC_lamp_bitmap([int(addr) for addr in lamps_on], int(lamps))
+
+    def rpc_poll(self, ids=None, expected=None):
+        '''
+        :param expected: hex of the lamp status byte expected, None for any
+        :return: dict of station ID: None on success, the name of the error on failure
+        '''
+        expected = None if expected is None else _hex(expected, 1)
+        convert = lambda errors: dict((binascii.b2a_hex(id), None if e is None else e.__class__.__name__)
+                                      for (id, e) in errors.iteritems())
+        return self._sweep(self.rc.RC_unicast_poll_multi, self._dest_ids(ids), (expected,), convert)
+
+    def rpc_read_telemetry(self, ids=None, fields=None):
+        return self._sweep(self.rc.RC_read_telemetry, self._dest_ids(ids), (fields or self.telemetry_fields,),
+                           _hex_keys)
+
+    def rpc_stations(self, fields=None):
+        ''' :return: dict of station ID: dict of its config and state fields, or only of `fields` '''
+        stations = {}
+        for id in self.stations.keys():
+            station = self.stations.get(id)
+            if station is None:
+                continue
+            stations[id] = dict((key, _json_value(value)) for (key, value) in station.iteritems()
+                                if fields is None or key in fields)
+        return stations
+
+    def rpc_out_of_sync(self):
+        return [binascii.b2a_hex(id) for id in self.rc.RC_out_of_sync()]
+
+    def rpc_telemetry_query(self, metric, start, stop, addr=None, step=None, resolution=None):
+        ''' :return: list of [t, count, min, max, mean] '''
+        return [[int(t), int(count), float(low), float(high), float(mean)] for (t, count, low, high, mean) in
+                self.telemetry.query(metric, start, stop, addr=addr, step=step, resolution=resolution)]
+
+    def rpc_telemetry_summary(self, metric, start, stop, addr=None):
+        ''' :return: [count, min, max, mean], None without samples '''
+        summary = self.telemetry.summary(metric, start, stop, addr=addr)
+        return None if summary is None else [int(summary[0])] + [float(value) for value in summary[1:]]
+
+    def rpc_stats(self):
+        with self._lock:
+            clients = len(self._clients)
+        return dict(clients=clients, queue=self.queue.stats(), tx=self.rc.get_tx_stats(),
+                    dispatch=self.rc.get_dispatch_stats(), reports=self.rc.get_report_stats(),
+                    reliable=self.rc.get_reliable_stats(), addresses=self.rc.get_address_stats(),
+                    telemetry=self.telemetry.stats())
+
+    def _dest_ids(self, ids):
+        return self.stations.bin_ids() if ids is None else [_bin_id(id) for id in ids]
+
+
+def _hex(value, length):
+    try:
+        data = binascii.a2b_hex(value)
+    except TypeError:
+        raise ValueError('%s is not hex' % value)
+    if len(data) != length:
+        raise ValueError('%s is not %d bytes' % (value, length))
+    return data
+
+
+def _bin_id(id):
+    return _hex(id, ID_LEN)
+
+
+def _lamp_value(value):
+    return _hex(value, Protocol.LampControl.MESG_LENGTH - 1)
+
+
+def _hex_keys(results):
+    return dict((binascii.b2a_hex(id), value) for (id, value) in results.iteritems())
+
+
+def _json_value(value):
+    ''' JSON has no infinity or NaN, e.g. last_seen of a station never heard from '''
+    if isinstance(value, float) and (math.isinf(value) or math.isnan(value)):
+        return None
+    return value
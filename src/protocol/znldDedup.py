@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myClock import SYSTEM_CLOCK
+
+
+class DedupCache(object):
+    """
+    bounded cache of recently seen frame keys, e.g. (src_id, dest_id, sn, tag), in LRU order.
+    an entry is evicted when it is older than ttl seconds or when the cache is full, so that a key
+    coming back after its SN wrapped around is taken as a new frame.
+    """
+    def __init__(self, size=256, ttl=10.0, clock=SYSTEM_CLOCK):
+        self._clock = clock
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache = OrderedDict() # key -> last seen time
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expire(self, now):
+        while self._cache:
+            key, seen_at = next(self._cache.iteritems())
+            if now - seen_at < self.ttl:
+                break
+            del self._cache[key]
+            self.evictions += 1
+
+    def seen(self, key):
+        '''
+        :return: True if key is seen within ttl (a duplicate), otherwise False and key is remembered
+        '''
+        now = self._clock.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._cache:
+                # refresh it so that it is the last one to be evicted
+                del self._cache[key]
+                self._cache[key] = now
+                self.hits += 1
+                return True
+            self._cache[key] = now
+            self.misses += 1
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+            return False
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self._cache))
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import threading
+from collections import deque
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myClock import SYSTEM_CLOCK
+
+LATE_TTL = 10.0 # seconds a late frame is kept unless the Dispatcher is given late_ttl
+
+
+def frame_key(rx_frame):
+    ''' :return: (source ID, TAG, SN) of a received Frame '''
+    return (rx_frame.src_id, rx_frame.tag, rx_frame.sn)
+
+
+class Pending(object):
+    """a response being waited for, it works like a future: wait() for it or get a callback"""
+    def __init__(self, keys, callback=None, clock=SYSTEM_CLOCK):
+        self.keys = keys
+        self.frame = None
+        self.claimed = False # the frame was taken from the late-frame buffer, it tells nothing of the RTT
+        self._callback = callback
+        self._clock = clock
+        self._event = threading.Event()
+
+    def _set(self, rx_frame):
+        self.frame = rx_frame
+        self._event.set()
+        if self._callback:
+            self._callback(self, rx_frame)
+
+    def done(self):
+        return self._event.isSet()
+
+    def wait(self, timeout=None):
+        '''
+        :param timeout: seconds, None for waiting forever
+        :return: the response frame, or None on timeout
+        '''
+        self._clock.wait(self._event, timeout)
+        return self.frame
+
+
+class Dispatcher(object):
+    """
+    routes every frame received by RC to whoever waits for it, by (source ID, TAG, SN).
+    frames nobody waits for are kept in a bounded late-frame buffer for about one RTO of their source, so that
+    a response which arrives right after the request but before expect() is still there to be claimed.
+    a frame received before the request was sent is never claimed: with the 8 bits SN wrapping around, it is
+    the response to an earlier request.
+    """
+    def __init__(self, late_size=32, late_ttl=None, clock=SYSTEM_CLOCK):
+        '''
+        :param late_ttl: late_ttl(src_id) returns the seconds a late frame from src_id is kept, e.g. its RTO,
+                         None to keep every one LATE_TTL seconds
+        '''
+        self._clock = clock
+        self._late_ttl = late_ttl or (lambda src_id: LATE_TTL)
+        self._lock = threading.Lock()
+        self._waiting = {} # (src_id, tag, sn) -> Pending, sn is None for any SN
+        self._late = deque(maxlen=late_size) # (rx_frame, received at)
+        # statistics
+        self.matched = 0 # frames delivered to a waiter right away
+        self.late = 0 # frames put into the late-frame buffer
+        self.claimed = 0 # late frames claimed by a later expect()
+        self.evicted = 0 # late frames pushed out of the buffer unclaimed
+        self.expired = 0 # late frames dropped unclaimed after their ttl
+
+    def _expire(self, now):
+        for entry in [entry for entry in self._late if now - entry[1] >= self._late_ttl(entry[0].src_id)]:
+            self._late.remove(entry)
+            self.expired += 1
+
+    def _match_late(self, keys, since):
+        self._expire(self._clock.monotonic())
+        for entry in self._late:
+            (rx_frame, received_at) = entry
+            if since is not None and received_at < since:
+                continue
+            src_id, tag, sn = frame_key(rx_frame)
+            if (src_id, tag, sn) in keys or (src_id, tag, None) in keys:
+                self._late.remove(entry)
+                return rx_frame
+        return None
+
+    def expect(self, src_id, tags, sn=None, callback=None, since=None):
+        '''
+        wait for a response, register it before or right after sending the request.
+        :param src_id: station ID the response comes from
+        :param tags: list of acceptable TAGs, e.g. the expected TAG and TAG_NACK
+        :param sn: SN of the response, None for any SN
+        :param callback: callback(pending, rx_frame) which is called by RX thread
+        :param since: when the request was sent, a late frame received before it is not taken
+        :return: Pending
+        '''
+        keys = [(src_id, tag, sn) for tag in tags]
+        pending = Pending(keys, callback, self._clock)
+        with self._lock:
+            rx_frame = self._match_late(keys, since)
+            if rx_frame is None:
+                for key in keys:
+                    self._waiting[key] = pending
+            else:
+                self.claimed += 1
+        if rx_frame is not None:
+            pending.claimed = True
+            pending._set(rx_frame)
+        return pending
+
+    def cancel(self, pending):
+        with self._lock:
+            for key in pending.keys:
+                if self._waiting.get(key) is pending:
+                    del self._waiting[key]
+
+    def dispatch(self, rx_frame):
+        '''
+        :param rx_frame: a received frame
+        :return: True if it is delivered to a waiter, False if it goes to the late-frame buffer
+        '''
+        src_id, tag, sn = frame_key(rx_frame)
+        with self._lock:
+            pending = self._waiting.get((src_id, tag, sn)) or self._waiting.get((src_id, tag, None))
+            if pending is None:
+                now = self._clock.monotonic()
+                self._expire(now)
+                if len(self._late) == self._late.maxlen:
+                    self.evicted += 1
+                self._late.append((rx_frame, now))
+                self.late += 1
+            else:
+                for key in pending.keys:
+                    if self._waiting.get(key) is pending:
+                        del self._waiting[key]
+                self.matched += 1
+        if pending is None:
+            logger.debug('late frame from %s, TAG %s, sn=%d' % (binascii.b2a_hex(src_id), binascii.b2a_hex(tag), sn))
+            return False
+        pending._set(rx_frame)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(matched=self.matched, late=self.late, claimed=self.claimed, evicted=self.evicted,
+                        expired=self.expired, buffered=len(self._late), waiting=len(self._waiting))
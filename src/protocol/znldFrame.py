@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii, struct
+from libs.rxBuffer import RxBuffer
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+FRAME_HEADER = b'\x55\x55'
+FRAME_LEN = 22
+CRC_LEN = 2
+# compact frame: short addresses (node_config.json 'addr') instead of the 6 bytes IDs, 8 bytes less on air
+COMPACT_HEADER = b'\x55\xAA'
+COMPACT_LEN = 14
+SYNC_BYTE = b'\x55' # 1st byte of both headers
+
+
+ID_LEN = 6
+ADDR_LEN = 2
+MESG_LEN = 5 # TAG + 4 bytes value
+
+BROADCAST_ID = b'\x00' * ID_LEN
+BROADCAST_ADDR = 0xFFFF
+# ID of a short address which the receiver doesn't know, e.g. on a RELAY
+SHORT_ID_PREFIX = b'\xff' * (ID_LEN - ADDR_LEN)
+
+# header, source ID, destination ID, SN, TAG, value, CRC
+_LAYOUT = struct.Struct('>2s6s6sBc4sH')
+# header, source addr, destination addr, SN, TAG, value, CRC
+_COMPACT = struct.Struct('>2sHHBc4sH')
+_ADDRS = struct.Struct('>HH')
+_ADDR = struct.Struct('>H')
+_CRC = struct.Struct('>H')
+_unpack = _LAYOUT.unpack
+_unpack_compact = _COMPACT.unpack
+_crc_hqx = binascii.crc_hqx
+_new_frame = object.__new__ # Frame.decode() skips __init__()
+_SN_BYTES = [struct.pack('>B', sn) for sn in range(256)]
+
+
+def crc16(data):
+    ''' CRC-CCITT (0xFFFF) of data (str or memoryview), packed MSB firstly '''
+    return _CRC.pack(_crc_hqx(data, 0xFFFF))
+
+
+def short_id(addr):
+    ''' :return: the ID standing for a short address in a decoded compact frame '''
+    if addr == BROADCAST_ADDR:
+        return BROADCAST_ID
+    return SHORT_ID_PREFIX + _ADDR.pack(addr)
+
+
+class Frame(object):
+    """a received frame, its fields are decoded once by decode()"""
+    __slots__ = ('src_id', 'dest_id', 'sn', 'tag', 'value', 'raw')
+
+    def __init__(self, src_id, dest_id, sn, tag, value, raw=None):
+        self.src_id = src_id
+        self.dest_id = dest_id
+        self.sn = sn # int
+        self.tag = tag
+        self.value = value # 4 bytes
+        self.raw = raw # the whole frame as received, including header and CRC
+
+    @staticmethod
+    def decode(data):
+        '''
+        :param data: a whole frame (str) of which the CRC is already checked, e.g. by Deframer.
+                     the short addresses of a compact frame are decoded by short_id()
+        '''
+        frame = _new_frame(Frame)
+        if len(data) == COMPACT_LEN:
+            (header, src_addr, dest_addr, frame.sn, frame.tag, frame.value, crc) = _unpack_compact(data)
+            frame.src_id = short_id(src_addr)
+            frame.dest_id = short_id(dest_addr)
+        else:
+            (header, frame.src_id, frame.dest_id, frame.sn, frame.tag, frame.value, crc) = _unpack(data)
+        frame.raw = data
+        return frame
+
+    def is_compact(self):
+        return len(self.raw) == COMPACT_LEN
+
+    def message(self):
+        ''' TAG + value '''
+        return self.tag + self.value
+
+    def __repr__(self):
+        return '<Frame %s->%s sn=%d tag=%s value=%s>' % (binascii.b2a_hex(self.src_id), binascii.b2a_hex(self.dest_id),
+                                                         self.sn, binascii.b2a_hex(self.tag),
+                                                         binascii.b2a_hex(self.value))
+
+
+class Encoder(object):
+    """
+    builds the frames sent by one node: header + source ID + destination ID is kept per destination,
+    so only SN and message are appended to it before the CRC.
+    """
+    def __init__(self, src_id, max_prefixes=1024):
+        self.src_id = src_id
+        self.max_prefixes = max_prefixes
+        self._prefixes = {}
+        self._compact_prefixes = {}
+
+    def prefix(self, dest_id):
+        prefix = self._prefixes.get(dest_id)
+        if prefix is None:
+            if len(self._prefixes) >= self.max_prefixes:
+                self._prefixes.clear()
+            prefix = FRAME_HEADER + self.src_id + dest_id
+            self._prefixes[dest_id] = prefix
+        return prefix
+
+    def encode(self, dest_id, sn, message):
+        '''
+        :param sn: 0 .. 255
+        :param message: TAG + 4 bytes value
+        :return: the whole frame with CRC
+        '''
+        body = (self._prefixes.get(dest_id) or self.prefix(dest_id)) + _SN_BYTES[sn] + message
+        return body + _CRC.pack(_crc_hqx(body, 0xFFFF))
+
+    def encode_compact(self, src_addr, dest_addr, sn, message):
+        '''
+        :param src_addr: own short address
+        :param dest_addr: short address of the destination
+        :return: the whole compact frame with CRC
+        '''
+        prefix = self._compact_prefixes.get((src_addr, dest_addr))
+        if prefix is None:
+            if len(self._compact_prefixes) >= self.max_prefixes:
+                self._compact_prefixes.clear()
+            prefix = COMPACT_HEADER + _ADDRS.pack(src_addr, dest_addr)
+            self._compact_prefixes[(src_addr, dest_addr)] = prefix
+        body = prefix + _SN_BYTES[sn] + message
+        return body + _CRC.pack(_crc_hqx(body, 0xFFFF))
+
+
+def restamp(frame, last_bytes):
+    ''' replace the last value byte(s) of a whole frame (e.g. the route stamp) and update its CRC '''
+    body = frame[0:len(frame)-CRC_LEN-len(last_bytes)] + last_bytes
+    return body + _CRC.pack(_crc_hqx(body, 0xFFFF))
+
+
+class Deframer(object):
+    """
+    incremental frame extractor, feed it whatever the serial port delivers, in chunks of any size.
+    two states: HUNT for the header, then wait for the BODY of a whole frame and check its CRC.
+    the header tells the frame length, legacy and compact frames may come in any mix.
+    on a CRC failure only the first header byte is dropped and the buffered bytes are rescanned,
+    so a real frame which starts inside a false one (e.g. the header bytes in a payload) is not lost.
+    """
+    HUNT = 0
+    BODY = 1
+
+    def __init__(self, frame_len=FRAME_LEN, rx_buf=None):
+        self.frame_len = frame_len
+        self._lengths = {FRAME_HEADER[1:2]: frame_len, COMPACT_HEADER[1:2]: COMPACT_LEN}
+        if rx_buf is None:
+            rx_buf = RxBuffer(size=16 * frame_len)
+        self.rx_buf = rx_buf
+        self.state = self.HUNT
+        # statistics
+        self.frames = 0 # valid frames
+        self.resyncs = 0 # false header syncs (CRC failures) which needed a rescan
+        self.junk = 0 # bytes thrown away while hunting for header
+
+    def feed(self, data):
+        '''
+        :param data: a received chunk, of any size: it is written in pieces of at most the free space of rx_buf,
+                     with the frames completed by each piece taken out before the next one
+        :return: list of all the frames completed by this chunk, in order
+        '''
+        frames = []
+        view = memoryview(data)
+        while True:
+            frames.extend(frame.tobytes() for frame in self.frames_available())
+            if not len(view):
+                return frames
+            free = self.rx_buf.writable()
+            n = min(len(view), len(free))
+            free[0:n] = view[0:n]
+            self.rx_buf.commit(n)
+            view = view[n:]
+
+    def frames_available(self):
+        ''' yield every complete frame in the buffer, each memoryview is valid until rx_buf is written again '''
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def next_frame(self):
+        '''
+        :return: memoryview of the next valid frame, valid until rx_buf is written again; None if more bytes are needed
+        '''
+        rx_buf = self.rx_buf
+        while True:
+            if self.state == self.HUNT:
+                index = rx_buf.find(SYNC_BYTE)
+                if index == -1:
+                    self.junk += len(rx_buf)
+                    rx_buf.consume(len(rx_buf))
+                    return None
+                self.junk += index
+                rx_buf.consume(index)
+                self.state = self.BODY
+            if len(rx_buf) < 2:
+                return None
+            frame_len = self._lengths.get(rx_buf[1:2].tobytes())
+            if frame_len is None:
+                # not a header
+                self.state = self.HUNT
+                self.junk += 1
+                rx_buf.consume(1)
+                continue
+            if len(rx_buf) < frame_len:
+                return None
+            self.state = self.HUNT
+            frame = rx_buf[0 : frame_len]
+            if crc16(frame[0 : frame_len-CRC_LEN]) == frame[frame_len-CRC_LEN :].tobytes():
+                rx_buf.consume(frame_len)
+                self.frames += 1
+                return frame
+            self.resyncs += 1
+            logger.debug('CRC check failed on %s, resync after the header byte', binascii.b2a_hex(frame.tobytes()))
+            rx_buf.consume(1)
+
+    def stats(self):
+        return dict(frames=self.frames, resyncs=self.resyncs, junk=self.junk, dropped=self.rx_buf.dropped)
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import os, json, struct
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# a group (zone) is addressed by a multicast ID in the destination field, every member takes the frame
+GROUP_ID_PREFIX = '\xff\xff\xff\xfe'
+MAX_GROUP = 0xFFFF
+MAX_GROUPS = 16 # groups a STA can be member of
+
+# TAG_GROUP_SET value[0]
+GROUP_LEAVE = 0
+GROUP_JOIN = 1
+GROUP_CLEAR = 2
+
+
+def group_id(group):
+    ''' :param group: 1 .. MAX_GROUP '''
+    assert 0 < group <= MAX_GROUP, 'group out of range'
+    return GROUP_ID_PREFIX + struct.pack('>H', group)
+
+
+def is_group(dest_id):
+    return dest_id[0:4] == GROUP_ID_PREFIX
+
+
+def ack_slots(keys):
+    '''
+    number of ACK slots for the members of a group to respond one after another, each one in
+    slot (key % slots) where key is its addr
+    :param keys: addr of every member
+    :return: the fewest slots (1 .. 255) which give every member a slot of its own, or 255
+    '''
+    keys = list(keys)
+    for slots in range(max(1, len(keys)), 255):
+        if len(set(key % slots for key in keys)) == len(keys):
+            return slots
+    return 255
+
+
+class GroupTable(object):
+    """
+    groups of a STA/RELAY, kept in a JSON file (a list of group numbers) so that they survive a restart.
+    """
+    def __init__(self, path=None, max_groups=MAX_GROUPS):
+        '''
+        :param path: JSON file, None to keep the groups in memory only
+        '''
+        self.path = path
+        self.max_groups = max_groups
+        self._lock = threading.Lock()
+        self._ids = set() # group IDs, for the membership check of every received frame
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    groups = json.load(f)
+                self._ids = set(group_id(group) for group in groups[0:max_groups])
+            except (IOError, ValueError, TypeError, AssertionError):
+                logger.error('%s is broken, no group is taken' % path)
+        logger.info('groups: %s' % self.groups())
+
+    def member(self, dest_id):
+        return dest_id in self._ids
+
+    def groups(self):
+        return sorted(struct.unpack('>H', id[4:6])[0] for id in self._ids)
+
+    def join(self, group):
+        ''' :return: False if it is member of max_groups groups already '''
+        with self._lock:
+            id = group_id(group)
+            if id not in self._ids:
+                if len(self._ids) >= self.max_groups:
+                    return False
+                self._ids.add(id)
+                self._save()
+            return True
+
+    def leave(self, group):
+        with self._lock:
+            id = group_id(group)
+            if id in self._ids:
+                self._ids.discard(id)
+                self._save()
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._ids = set()
+            self._save()
+            return True
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(sorted(struct.unpack('>H', id[4:6])[0] for id in self._ids), f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            logger.exception('failed to save groups to %s' % self.path)
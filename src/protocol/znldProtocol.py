@@ -3,9 +3,8 @@
 
 __author__ = 'Wei'
 
-import binascii, ctypes, struct, Queue
+import binascii, struct
 import threading
-import random
 from time import sleep
 
 import logging
@@ -21,6 +20,80 @@ else:
 
 from libs.E32Serial import E32
 from libs.myException import *
+from znldFrame import Deframer, Encoder, Frame, restamp, FRAME_LEN, COMPACT_LEN, BROADCAST_ADDR
+from znldTransaction import Transaction, TransactionEngine
+from znldDispatcher import Dispatcher
+from znldRtt import RttTable
+from znldDedup import DedupCache
+from znldScheduler import TxScheduler
+from znldSeq import SeqCounter, SeqTracker, sn_add
+from znldRoute import RoutingTable, ROUTE_FLOOD, ROUTE_ADJACENT, ROUTE_MAX_SLOTS, pack_stamp, unpack_stamp
+from znldBitmap import BITMAP_LAMPS, make_bitmap, chunks, lamp_state
+from znldAggregate import AckAggregator, AckCollector
+from znldAddress import AddressBook, RC_ADDR
+from znldGroup import GroupTable, group_id, is_group, ack_slots, GROUP_LEAVE, GROUP_JOIN, GROUP_CLEAR
+from znldReport import StatusReporter, report_slot, REPORT_SLOT, REPORT_TELEMETRY
+from znldStore import StationStore
+from znldTelemetry import TelemetryTransaction, TELEMETRY_NAMES, field_mask, pack
+from libs.myClock import SYSTEM_CLOCK
+
+
+class SlotScheduler(object):
+    """
+    deterministic TDMA slots instead of random backoff, counted from the end of the received frame.
+    slot 0 belongs to the addressed STA's response, slot k (1 .. slots-1) to the RELAY which forwards in it.
+    a RELAY gets its slot from the RC slot map (TAG_SLOT_MAP) or, until then, from its own node_config.json 'slot',
+    else from its addr or the last byte of its ID, which RELAYs in range of each other may share.
+    slot_len covers one frame on air at the air data rate plus a guard time, so one hop of forwarding takes
+    at most slots * slot_len.
+    """
+    def __init__(self, frame_len, air_baudrate, node_id, role, slots=8, slot=None, guard=0.05, addr=None,
+                 clock=SYSTEM_CLOCK):
+        '''
+        :param addr: addr of a RELAY which has no slot, its slot is taken from it instead of the ID
+        :raise ValueError: when slots or slot is out of range, see check()
+        '''
+        self._clock = clock
+        self.airtime = frame_len * 10.0 / air_baudrate
+        self.slot_len = self.airtime + guard
+        self.role = role
+        self.slots = slots
+        self.check(slot, slots)
+        if slot is None:
+            slot = self.slot_of(node_id, addr) if role == 'RELAY' else 0
+            if role == 'RELAY':
+                logger.warning('RELAY takes slot %d until RC assigns one, give it a slot in node_config.json' % slot)
+        self.slot = slot
+
+    def slot_of(self, node_id, addr=None):
+        return 1 + (addr if addr is not None else ord(node_id[-1])) % (self.slots - 1)
+
+    def check(self, slot, slots):
+        '''
+        :param slot: None to check slots only
+        :raise ValueError: unless 2 <= slots <= ROUTE_MAX_SLOTS, the 4-bit slot field of the route stamp, and
+                           slot is 0 for a STA, 1 .. slots-1 for a RELAY
+        '''
+        if not 2 <= slots <= ROUTE_MAX_SLOTS:
+            raise ValueError('%d slots, slot 0 is the STA\'s and a RELAY needs another one, at most %d in the route '
+                             'stamp' % (slots, ROUTE_MAX_SLOTS))
+        # slot 0 of a RELAY would collide with the STA responses
+        if slot is not None and not (1 if self.role == 'RELAY' else 0) <= slot < slots:
+            raise ValueError('slot %d out of range for %s with %d slots' % (slot, self.role, slots))
+
+    def set_slot(self, slot, slots):
+        ''' :raise ValueError: see check() '''
+        self.check(slot, slots)
+        self.slot = slot
+        self.slots = slots
+
+    def cycle(self):
+        ''' time for every slot to be used once, i.e. worst case latency of one hop '''
+        return self.slots * self.slot_len
+
+    def delay(self, rx_time):
+        ''' seconds from now to the start of own slot after a frame received at rx_time '''
+        return max(0.0, rx_time + self.slot * self.slot_len - self._clock.monotonic())
 
 
 class Protocol(threading.Thread):
@@ -33,19 +106,42 @@ class Protocol(threading.Thread):
         BYTE_ALL_ON = '\x03'
         BYTE_LEFT_ON = '\x01'
         BYTE_RIGHT_ON = '\x02'
+        BYTE_MULTICAST_ACK = '\x01' # value[2] of the ACK to a multicast request, after its ACK slot key
         TAG_SN = '\x00'
         TAG_ACK = '\x01'
         TAG_NACK = '\x02'
         TAG_LAMP_CTRL = '\x05'
         TAG_POLL = '\x03'
         TAG_POLL_ACK = '\x04'
+        TAG_SLOT_MAP = '\x06'
+        TAG_LAMP_BITMAP = '\x07'
+        TAG_ADDR_SET = '\x08'
+        TAG_GROUP_SET = '\x09'
+        TAG_ACK_BITMAP = '\x0A'
+        TAG_RELIABLE = '\x0B'
+        TAG_EPOCH = '\x0C'
+        TAG_STATUS = '\x0D'
+        TAG_STATUS_ACK = '\x0E'
+        TAG_TELEMETRY = '\x0F'
+        TAG_TELEMETRY_DATA = '\x10'
 
         TAG_DICT = {TAG_SN: 'SN update',
                     TAG_ACK: 'ACK',
                     TAG_NACK: 'NACK',
                     TAG_LAMP_CTRL: 'Lamp control',
                     TAG_POLL: 'Poll',
-                    TAG_POLL_ACK: 'Poll ACK',}
+                    TAG_POLL_ACK: 'Poll ACK',
+                    TAG_SLOT_MAP: 'Slot map',
+                    TAG_LAMP_BITMAP: 'Lamp bitmap',
+                    TAG_ADDR_SET: 'Short address',
+                    TAG_GROUP_SET: 'Group',
+                    TAG_ACK_BITMAP: 'ACK bitmap',
+                    TAG_RELIABLE: 'Reliable lamp control',
+                    TAG_EPOCH: 'Epoch',
+                    TAG_STATUS: 'Status report',
+                    TAG_STATUS_ACK: 'Status report ACK',
+                    TAG_TELEMETRY: 'Telemetry',
+                    TAG_TELEMETRY_DATA: 'Telemetry data',}
 
         MESG_VALUE_LAMP_ALL_ON = BYTE_ALL_ON + '\xFF' * 2 + BYTE_RESERVED
         MESG_LAMP_ALL_ON = TAG_LAMP_CTRL + MESG_VALUE_LAMP_ALL_ON
@@ -58,25 +154,84 @@ class Protocol(threading.Thread):
         pass
 
     def __init__(self, id, stations, role='RC', retry=3, hop=0, baudrate=9600, testing='FALSE', timeout=5,
-                 e32_delay=5, relay_delay=1, relay_random_backoff=3):
+                 e32_delay=5, relay_delay=1, relay_random_backoff=3, window=1, slots=8, slot=None, slot_guard=0.05,
+                 dedup_size=256, dedup_ttl=None, route_ttl=600, sn_ttl=600, addr=None, group_file=None,
+                 report_interval=5, report_slots=64, report_thresholds=None, transport=None, clock=None):
+        '''
+        :param addr: lamp number of a STA/RELAY, i.e. its bit in TAG_LAMP_BITMAP frames and its ACK slot key, as
+                     'addr' of the station in RC's node_config.json, 1 .. 0xFFFE as 0 is RC_ADDR. None to take the
+                     short address RC assigns (TAG_ADDR_SET), which is the same number, until then the bitmaps are
+                     ignored
+        :param group_file: JSON file keeping the groups of a STA/RELAY (TAG_GROUP_SET), None to keep them in memory
+        :param report_interval: min. seconds between two status reports (TAG_STATUS) of a STA/RELAY
+        :param report_slots: slots the status reports of a STA/RELAY are spread over until RC tells the number
+                             for its stations, in the slot map and in the broadcasts which ask for ACKs
+        :param report_thresholds: dict of telemetry field name: change of a STA/RELAY measurement since the last
+                                  report which makes it report again, see STA_set_telemetry()
+        :param transport: object with transmit(frame), cancel() and baudrate_air instead of the E32 serial port,
+                          and receive_into(rx_buf) if the node is started as a thread; a simulated radio has none
+                          and hands the frames to process_frame() instead
+        :param clock: object with monotonic(), sleep(seconds) and wait(event, timeout) instead of the real clock,
+                      e.g. the virtual clock of a simulator
+        '''
         threading.Thread.__init__(self)
         self.thread_stop = False
         self._retry = retry
-        self._RC_queue = Queue.Queue(0) # create no limited queue
+        self._clock = clock or SYSTEM_CLOCK
+        # routes RC received frames to the waiting requests
+        self._dispatcher = Dispatcher(late_ttl=self._late_ttl, clock=self._clock)
+        # RC sends every destination its own SN flow, STA/RELAY keeps a window per (source, destination) flow,
+        # so SN wraps around without any reset frame
+        self._tx_sn = SeqCounter(step=2)
+        self._rx_seq = SeqTracker(ttl=sn_ttl, clock=self._clock)
         self._role = role # three roles: 'RC', 'STA', 'RELAY'
         assert role=='RC' or role=='STA' or role=='RELAY', 'Protocol role mistake!'
         self._id = id
+        if addr is not None and not RC_ADDR < addr < BROADCAST_ADDR:
+            raise ValueError('addr %d out of range, %d is RC_ADDR' % (addr, RC_ADDR))
+        self._lamp_addr = addr
+        self._short_addr = None # STA/RELAY: the short address RC assigned, for the compact frames
         # to simplify protocol, use the same length for TX & RX
         self._tx_frame_len = 22
         self._rx_frame_len = 22
         self._max_frame_len = max(self._tx_frame_len, self._rx_frame_len)
-        self._frame_no = -2
-        self._max_frame_no = 25
+        self._deframer = Deframer(frame_len=self._rx_frame_len)
+        self._encoder = Encoder(self._id) # keeps the frame header of every destination
+        # short addresses for the compact frame, which RC uses with the stations confirming their address
+        self._addresses = AddressBook()
+        self._tx_frames = {FRAME_LEN: 0, COMPACT_LEN: 0} # frames sent in each format
+        # RELAY: ACKs of the downstream STAs to a multicast request, sent upstream as one bitmap
+        self._aggregator = AckAggregator()
+        self._collector = None # RC: AckCollector of the multicast request waiting for ACKs
+        # reliable broadcast: RC numbers its TAG_RELIABLE commands, a STA/RELAY keeps the last epoch of each RC
+        self._epoch = 0
+        self._epochs = {}
+        # STA/RELAY: (RELAYs, sum of their slots) on the way from each RC, counted in its SN reset frame
+        self._rc_paths = {}
+        self._reliable_stats = dict(broadcasts=0, rounds=0, repairs=0, missed=0)
+        # groups (zones) of a STA/RELAY, frames to a group ID are taken by all its members
+        self._groups = GroupTable(path=group_file if self._role != 'RC' else None)
+        self._frame_no = 0 # SN of the last accepted frame, STA/RELAY responds with it + 1
         self._STA_led_status = '\x00'
+        self._rc_id = None # STA/RELAY: the RC which status reports go to
+        self._report_slots = report_slots
+        self._report_hops = 0 # STA/RELAY: hops of the farthest station, a report slot takes the hops both ways
+        self._report_thresholds = dict(report_thresholds or {})
+        self._reported_telemetry = {} # STA/RELAY: the measurements the thresholds are counted from
+        self._report_flags = 0 # STA/RELAY: REPORT_* reasons of the next status report
+        self._sent_flags = (None, 0) # STA/RELAY: (number, REPORT_* reasons) of the last status report sent
+        self.on_status = None # RC: on_status(station ID, station dict) is called on every new status report
+        self._reports = {} # RC: station ID -> (number, SN) of its last status report
+        self._telemetry_due = set() # RC: stations which reported a telemetry change, see RC_telemetry_due()
+        self._report_stats = dict(reports=0, duplicates=0, unknown=0)
+        self._telemetry = {} # STA/RELAY: field name: value of the telemetry fields, see STA_set_telemetry()
+        self.telemetry = None # RC: TelemetryStore the telemetry read from the stations is recorded into
         self.stations = stations
         if self._role == 'RC':
             # only need to initialize stas_dict for RC
             self._init_stas_dict()
+            self._addresses.assign(self._id, RC_ADDR)
+            self._RC_assign_addresses(self.stations.keys())
         
         # for testing identification, we will update the last 2 bytes of payload with sequential number
         # _testing = True to enable this feature
@@ -92,13 +247,16 @@ class Protocol(threading.Thread):
             GPIO.setwarnings(False)
             GPIO.setup(self._GPIO_LED, GPIO.OUT)
 
-        if ISRPI:
-            port = '/dev/ttyS0'
+        if transport is not None:
+            self.ser = transport
         else:
-            port = '/dev/ttyUSB0'
-        self.ser = E32(port=port, inHex=False)
-        if self.ser.open() == False:
-            self.thread_stop = True
+            if ISRPI:
+                port = '/dev/ttyS0'
+            else:
+                port = '/dev/ttyUSB0'
+            self.ser = E32(port=port, inHex=False)
+            if self.ser.open() == False:
+                self.thread_stop = True
         # else:
         #     #dump E32 version and configuration, disabled for 1st ver board now
         #     self.ser.set_E32_mode(3)
@@ -106,14 +264,49 @@ class Protocol(threading.Thread):
         #     logger.info('E32 Configuration: %s', self.ser.get_config(inHex=False))
         #     self.ser.set_E32_mode(0)
 
-        self.timeout = (3 + 3 * hop) * 2 * self._max_frame_len * 10 / baudrate + timeout
+        self.baudrate = baudrate
+        self._timeout_margin = timeout
+        self.timeout = self._hop_timeout(hop)
         self.e32_delay = e32_delay # E32 initial communication delay, unknown to us so far. let it be 5 so far
         self.relay_delay = relay_delay # delay x seconds to avoid conflicting with STA response
         self.relay_random_backoff = relay_random_backoff # max. random backoff delay to avoid conflicting between RELAYs
         self.hop = hop
-        logger.info('%s (%s) initialization done with timeout=%s, e32_delay=%s, relay_delay=%s, relay_random_backoff=%s, hop=%s'
+        # TDMA slot of STA response / RELAY forwarding, it replaces relay_delay and relay_random_backoff
+        self._slots = SlotScheduler(frame_len=self._max_frame_len, air_baudrate=self.ser.baudrate_air, node_id=self._id,
+                                    role=self._role, slots=slots, slot=slot, guard=slot_guard, addr=addr,
+                                    clock=self._clock)
+        if self._role == 'RC':
+            self._RC_check_stations(self.stations)
+        self._rx_time = self._clock.monotonic() # when the last frame was received
+        # RELAY duplicate suppression of (src_id, dest_id, sn, tag), copies come back within a couple of slot cycles
+        if dedup_ttl is None:
+            dedup_ttl = 4 * self._slots.cycle()
+        # an old SN later than any copy resyncs its flow, the STA missed half of the SN space meanwhile
+        self._rx_seq.resync_after = dedup_ttl
+        self._relay_cache = DedupCache(size=dedup_size, ttl=dedup_ttl, clock=self._clock)
+        # (src_id, sn) of the SN reset frames taken, the copies forwarded by the RELAYs are not taken again
+        self._reset_cache = DedupCache(size=16, ttl=dedup_ttl, clock=self._clock)
+        # next hop towards each node learned from received frames, unicast is only forwarded along it
+        self._routes = RoutingTable(ttl=route_ttl, clock=self._clock)
+        self._relay_pruned = 0 # unicast frames not forwarded as this RELAY isn't on the path
+        self._sent_hops = {} # RC: the next hop in the route stamp of the last request to each station
+        # STA/RELAY transmissions are queued here, so that the receiving thread never sleeps or blocks on TX
+        self._tx_scheduler = TxScheduler(clock=self._clock)
+        # per station RTO, it starts from the hop based timeout and adapts to the measured RTT
+        self._rtt = RttTable(initial_rto=self._initial_rto)
+        # max. outstanding RC requests to different stations
+        self._engine = TransactionEngine(send=self._send_message, dispatcher=self._dispatcher,
+                                         tag_nack=self.LampControl.TAG_NACK, window=window, rtt=self._rtt,
+                                         on_timeout=self._on_timeout, frame_gap=self._response_gap,
+                                         clock=self._clock)
+        # STA/RELAY status reports on the changes RC doesn't learn of otherwise, the report and its ACK may be
+        # forwarded by RELAYs in their slots
+        self._reporter = StatusReporter(send=self._STA_send_status, scheduler=self._tx_scheduler,
+                                        holdoff=self._report_holdoff, interval=report_interval, retry=retry,
+                                        timeout=self.timeout + 2 * self._slots.cycle(), clock=self._clock)
+        logger.info('%s (%s) initialization done with timeout=%s, e32_delay=%s, slot=%s/%s, slot_len=%s, hop=%s'
                     % (self._role, binascii.b2a_hex(self._id), repr(self.timeout), repr(self.e32_delay),
-                       repr(self.relay_delay), repr(self.relay_random_backoff), repr(self.hop)))
+                       repr(self._slots.slot), repr(self._slots.slots), repr(self._slots.slot_len), repr(self.hop)))
 
     def __del__(self):
         if ISRPI:
@@ -122,190 +315,547 @@ class Protocol(threading.Thread):
     def get_stas_dict(self):
         return self.stations
 
+    def _hop_timeout(self, hop):
+        ''' worst case response time of a station `hop` relays away, plus the configured margin '''
+        return (3 + 3 * hop) * 2 * self._max_frame_len * 10.0 / self.baudrate + self._timeout_margin
+
+    def _initial_rto(self, dest_id):
+        ''' initial RTO of a station, from its own 'hop' in node_config.json if it is given '''
+        hop = self.hop
+        if self.stations:
+            station = self.stations.station(dest_id)
+            if station is not None:
+                hop = station.get('hop', hop)
+        return self._hop_timeout(hop)
+
+    def _late_ttl(self, src_id):
+        ''' seconds a late frame from src_id is kept for a request to claim it, the RTO of the station '''
+        return self._rtt.get(src_id).rto
+
+    def get_rtt_stats(self):
+        ''' per station SRTT, RTTVAR and RTO '''
+        return self._rtt.stats()
+
     def _init_stas_dict(self):
-        ''' initialize self.stations for data storage of each node
-            control data: lamp_ctrl, lamp_adj1, lamp_adj2
-            status data: lamp_ctrl_status,  lamp_adj1_status, lamp_adj2_status
-            electric data: voltage, current, power, energy, power_factor, co2, board_temperature, freq
-            environment data: pm2_5, pm10, temperature, humidity
-        '''
-        data = dict(lamp_ctrl=0, lamp_adj1=0, lamp_adj2=0, lamp_ctrl_status=0,  lamp_adj1_status=0, lamp_adj2_status=0,
-                    voltage=0.0, current=0.0, power=0.0, energy=0.0, power_factor=0.0, co2=0.0, board_temperature=0.0,
-                    freq=0.0, pm2_5=0.0, pm10=0.0, temperature=0.0, humidity=0.0)
-        for sta in self.stations.iterkeys():
-            self.stations[sta].update(data)
+        ''' initialize self.stations for data storage of each node, see STATE_FIELDS of znldStore for the data
+            of each node, which are kept in columns beside the node_config.json fields
+        '''
+        if not isinstance(self.stations, StationStore):
+            self.stations = StationStore(self.stations)
         pass
 
-    def _send_message(self, dest_id, message):
+    def _RC_check_stations(self, stations):
+        '''
+        :param stations: dict of station ID: config dict
+        :raise ValueError: when an 'addr' is RC_ADDR or out of range, a 'slot' is out of range, or two RELAYs have
+                           the same one, as they would collide in every slot cycle, or two stations have the same
+                           ACK slot key, see _RC_ack_keys()
+        '''
+        self._RC_ack_keys([binascii.a2b_hex(id) for id in stations.iterkeys()], stations)
+        owners = {}
+        for (id, config) in stations.iteritems():
+            addr = config.get('addr')
+            if addr is not None and not RC_ADDR < addr < BROADCAST_ADDR:
+                raise ValueError('addr %d of station %s out of range, %d is RC_ADDR' % (addr, id, RC_ADDR))
+            slot = config.get('slot')
+            if not slot:
+                # none, or 0 of a STA
+                continue
+            if not 0 < slot < self._slots.slots:
+                raise ValueError('slot %d of station %s out of range, RC has %d slots' % (slot, id, self._slots.slots))
+            if owners.setdefault(slot, id) != id:
+                raise ValueError('slot %d of station %s is the one of station %s' % (slot, id, owners[slot]))
+
+    def _is_broadcast(self, dest_id, tag):
+        ''' a bitmap frame goes to every node, its dest field is a part of the bitmap '''
+        return dest_id == self.LampControl.BROADCAST_ID or tag == self.LampControl.TAG_LAMP_BITMAP \
+            or tag == self.LampControl.TAG_ACK_BITMAP
+
+    def _flow_id(self, dest_id, tag):
+        '''
+        SN flow of a frame: its destination, BROADCAST_ID for every other broadcast. a lamp bitmap takes up to
+        8 frames, they have a flow of their own so that they don't use up the SN space of the broadcasts.
+        '''
+        if tag == self.LampControl.TAG_LAMP_BITMAP:
+            return (self.LampControl.BROADCAST_ID, tag)
+        return self.LampControl.BROADCAST_ID if self._is_broadcast(dest_id, tag) else dest_id
+
+    def _send_message(self, dest_id, message, delay=0, sn=None, frames=1):
+        '''
+        :param dest_id: destination ID, group ID, or 6 bitmap bytes of a TAG_LAMP_BITMAP/TAG_ACK_BITMAP message
+        :param delay: seconds a STA/RELAY waits before sending, 0 to send in slot 0
+        :param sn: SN of a STA/RELAY response, the last received SN + 1 by default
+        :param frames: frames of the response to an RC request, SN + 1 .. SN + frames
+        :return: SN of the message frame
+        '''
         assert len(message) == self.LampControl.MESG_LENGTH, 'payload length is not 5'
+        broadcast = self._is_broadcast(dest_id, message[0])
         if self._role == 'RC':
             # have to increase it by 2 to avoid conflicting with STA's response when it isn't received by RC
-            self._frame_no += 2
-        if self._role == 'STA' or self._role == 'RELAY':
-            self._frame_no += 1
-
-        tx_str_reset_sn = None
-        if self._frame_no >= self._max_frame_no and self._role == 'RC':
-            if dest_id != self.LampControl.BROADCAST_ID:
-                self._frame_no = 0
-                tx_str_reset_sn = self.LampControl.FRAME_HEADER + self._id + self.LampControl.BROADCAST_ID\
-                         + chr(self._frame_no) + self.LampControl.MESG_NULL
-                self._frame_no = 1
-            else:
-                # no need to send 2nd broadcast frame if it is already broadcast.
-                self._frame_no = 0
-        tx_str_message = self.LampControl.FRAME_HEADER + self._id + dest_id + chr(self._frame_no) + message
-        if tx_str_reset_sn:
-            tx_str_list = [tx_str_reset_sn, tx_str_message]
+            sn = self._tx_sn.next(self._flow_id(dest_id, message[0]), frames)
+        elif sn is None:
+            # STA/RELAY responds with the request SN + 1
+            sn = sn_add(self._frame_no, 1)
+
+        if self._testing and message[0] not in (self.LampControl.TAG_LAMP_BITMAP, self.LampControl.TAG_ACK_BITMAP,
+                                                self.LampControl.TAG_TELEMETRY_DATA, self.LampControl.TAG_SLOT_MAP,
+                                                self.LampControl.TAG_STATUS):
+            # for testing only, replace the 2nd last byte of message to self._count
+            # self._count will increase for every frame for identification
+            count_str = struct.pack('>B', self._count & 0xFF)
+            message = message[0:self.LampControl.MESG_LENGTH-2] + count_str + message[-1]
+            self._count += 1
+
+        multicast = broadcast or is_group(dest_id)
+        if not multicast:
+            # the last byte of unicast is the route stamp, send it along the learned route if any
+            next_hop = self._routes.next_hop(dest_id)
+            message = message[0:self.LampControl.MESG_LENGTH-1] + pack_stamp(0, next_hop)
+            if self._role == 'RC':
+                self._sent_hops[dest_id] = next_hop
+
+        addrs = None if multicast else self._addresses.compact(self._id, dest_id)
+        if addrs is None:
+            tx_str = self._encoder.encode(dest_id, sn, message)
         else:
-            tx_str_list = [tx_str_message]
-
-        for index in range(len(tx_str_list)):
-            tx_str =  tx_str_list[index]
-            
-            if self._testing:
-                # for testing only, replace the last two bytes of message to self._count
-                # self._count will increase for every frame for identification
-                count_str = struct.pack('>H', self._count)
-                tx_str = tx_str[0:len(tx_str)-2] + count_str
-                self._count += 1
-
-            crc = struct.pack('>H', ctypes.c_uint16(binascii.crc_hqx(tx_str, 0xFFFF)).value) # MSB firstly
-            tx_str = tx_str + crc
-            logger.debug('TX: {0}'.format(binascii.b2a_hex(tx_str)))
-            try:
-                self.ser.transmit(tx_str)
-            except:
-                logger.error('Tx error!')
-            if index == 0 and tx_str_reset_sn:
-                logger.debug('broadcast sn=0 update frame')
-                # need to consider network delay here given relay hop number
-                sleep(self.hop * (self.relay_random_backoff + self.e32_delay))
-        pass
+            tx_str = self._encoder.encode_compact(addrs[0], addrs[1], sn, message)
+        if self._role == 'RC':
+            self._transmit(tx_str)
+        else:
+            # STA response goes in slot 0, i.e. right now, but not from the receiving thread
+            self._tx_scheduler.schedule(delay, self._transmit, (tx_str,),
+                                        label='sn=%d to %s' % (sn, binascii.b2a_hex(dest_id)))
+        return sn
 
-    def _forward_frame(self, frame):
+    def _transmit(self, tx_str):
+        logger.debug('TX: {0}'.format(binascii.b2a_hex(tx_str)))
+        self._tx_frames[len(tx_str)] = self._tx_frames.get(len(tx_str), 0) + 1
+        try:
+            self.ser.transmit(tx_str)
+        except:
+            logger.error('Tx error!')
+
+    def _forward_frame(self, frame, stamp=None):
+        '''
+        :param stamp: new route stamp of a unicast frame (or the new last bytes of the value), None to forward it
+                      as it is
+        '''
         if self._role == 'RELAY':
-            try:
-                self.ser.transmit(frame)
-            except:
-                logger.error('Tx error!')
+            if stamp is not None:
+                frame = restamp(frame, stamp)
+            self._transmit(frame)
 
     def _recv_frame(self):
         '''
         check the frame header and later the checksum, return the whole frame until the checksum is correct.
-        :return: the received frame
-        '''
-        done = False
-        got_header = False
-        rx_str = ''
-        rx_len = self._rx_frame_len
-        while not done:
-            rx_str = rx_str + self.ser.receive(n=rx_len)  # keep receiving until getting required bytes
-            if not got_header:
-                index = rx_str.find(self.LampControl.FRAME_HEADER)
-                if index == -1:
-                    rx_str = ''
-                else:
-                    got_header = True
-                    rx_str = rx_str[index:]
-                    rx_len = index
-            else:
-                rx_crc = rx_str[-2 :]
-                str_payload = rx_str[0 : self._rx_frame_len-2]
-                crc = struct.pack('>H', ctypes.c_uint16(binascii.crc_hqx(str_payload, 0xFFFF)).value)  # MSB firstly
-                if crc == rx_crc:
-                    done = True
-                else:
-                    got_header = False
-                    rx_str = rx_str[2 :]
-                    rx_len = 2
-                    logger.error('A frame is received: %s', binascii.b2a_hex(rx_str))
-                    logger.error('Payload: %s', binascii.b2a_hex(str_payload))
-                    logger.error('RX CRC: %s', binascii.b2a_hex(rx_crc))
-                    logger.error('calculated CRC: %s', binascii.b2a_hex(crc))
-                    logger.error('CRC check failed, remove Header and continue')
-        logger.debug('RX: {0}'.format(binascii.b2a_hex(rx_str)))
-        return rx_str
+        serial bytes are read into the deframer buffer, frames which arrived in the same read are returned
+        by the following calls without reading again.
+        :return: the received Frame
+        '''
+        while True:
+            frame = self._deframer.next_frame()
+            if frame is not None:
+                rx_frame = Frame.decode(frame.tobytes())
+                logger.debug('RX: {0}'.format(binascii.b2a_hex(rx_frame.raw)))
+                return rx_frame
+            self.ser.receive_into(self._deframer.rx_buf)
+
+    def settle_time(self):
+        ''' worst case time for a frame from RC to reach the last hop: E32 delay plus one slot cycle per hop '''
+        return self.hop * (self.e32_delay + self._slots.cycle())
+
+    def get_relay_stats(self):
+        ''' RELAY duplicate suppression hit/miss/eviction counters '''
+        return self._relay_cache.stats()
+
+    def get_route_stats(self):
+        ''' learned next hop (TDMA slot of the RELAY) of every node and routing counters '''
+        stats = self._routes.stats()
+        stats['pruned'] = self._relay_pruned
+        stats['next_hop'] = self._routes.routes()
+        return stats
+
+    def get_seq_stats(self):
+        ''' STA/RELAY SN flows: accepted, duplicated, expired, reset and resynced '''
+        return self._rx_seq.stats()
+
+    def get_tx_pending(self):
+        ''' queued STA/RELAY transmissions: list of (seconds to deadline, description) '''
+        return self._tx_scheduler.pending()
+
+    def get_tx_stats(self):
+        ''' queued, sent and cancelled transmissions and the worst lateness in seconds '''
+        return self._tx_scheduler.stats()
+
+    def get_address_stats(self):
+        '''
+        short addresses, frames sent in the legacy / compact format and the air time saved by the compact ones
+        '''
+        stats = self._addresses.stats()
+        stats['legacy_frames'] = self._tx_frames.get(FRAME_LEN, 0)
+        stats['compact_frames'] = self._tx_frames.get(COMPACT_LEN, 0)
+        stats['saved_bytes'] = stats['compact_frames'] * (FRAME_LEN - COMPACT_LEN)
+        stats['saved_airtime'] = stats['saved_bytes'] * 10.0 / self.ser.baudrate_air
+        return stats
+
+    def get_aggregate_stats(self):
+        ''' RELAY ACK aggregation: open windows, windows and ACKs taken in '''
+        return self._aggregator.stats()
+
+    def get_groups(self):
+        ''' groups of a STA/RELAY '''
+        return self._groups.groups()
+
+    def get_rx_stats(self):
+        ''' deframer statistics: valid frames, resync events, junk bytes and bytes dropped on buffer overflow '''
+        return self._deframer.stats()
 
     def _STA_frame_process(self, rx_frame):
         '''
         STA/RELAY received frame processing per the protocol
-        :param rx_frame: the received frame
+        :param rx_frame: the received Frame
         :return: 
         '''
-        src_id = rx_frame[2:8]
-        dest_id = rx_frame[8:14]
-        sn = ord(rx_frame[14])
-        tag = rx_frame[15]
-        value = rx_frame[16:20]
+        src_id = rx_frame.src_id
+        dest_id = rx_frame.dest_id
+        sn = rx_frame.sn
+        tag = rx_frame.tag
+        value = rx_frame.value
+        (tx_slot, next_slot) = unpack_stamp(value[3])
         update_frame_no = False
+        broadcast = self._is_broadcast(dest_id, tag)
+        multicast = broadcast or is_group(dest_id)
+        flow_id = self._flow_id(dest_id, tag)
 
-        if dest_id == self._id or dest_id == self.LampControl.BROADCAST_ID:
+        if self.addressed(rx_frame):
             logger.debug('frame received: Nsn=%s, Psn=%s' % (str(sn), str(self._frame_no)))
-            if sn > self._frame_no or (sn == 0 and sn != self._frame_no):
-                update_frame_no = True
+            if tag == self.LampControl.TAG_SN:
+                # SN reset frame, e.g. on RC startup, restarts every flow from src_id
+                if not self._reset_cache.seen((src_id, sn)):
+                    self._rx_seq.reset(src_id, flow_id, sn)
+                    self._epochs.pop(src_id, None)
+                    # the RELAYs stamp it and count themselves in it, so that the ACKs to multicast are
+                    # on the ACK slot grid from the start
+                    self._routes.learn(src_id, tx_slot)
+                    self._rc_paths[src_id] = (ord(value[1]), ord(value[2]))
+                    update_frame_no = True
+            else:
+                update_frame_no = self._rx_seq.accept(src_id, flow_id, sn)
+            if update_frame_no:
                 self._frame_no = sn
+                if not multicast:
+                    # the response goes back the way the request came
+                    self._routes.learn(src_id, tx_slot)
+                if tag != self.LampControl.TAG_ACK_BITMAP:
+                    # every other frame a STA/RELAY takes comes from RC, which its status reports go to
+                    self._rc_id = src_id
                 if self.LampControl.TAG_DICT.has_key(tag):
                     # need to deal with different protocol TAG here
                     if tag == self.LampControl.TAG_LAMP_CTRL:
                         logger.debug('got TAG_LAMP_CTRL')
-                        self._STA_do_lamp_ctrl(value)
-                        if dest_id != self.LampControl.BROADCAST_ID:
+                        # RC learns the new status from the ACK (in the ACK bitmap of a RELAY), else from a status
+                        # report. every station changes at once on a broadcast without ACK slots, RC sends one
+                        # when it doesn't want to hear back, so that no report storm follows it
+                        acked = not multicast or value[3] != self.LampControl.BYTE_RESERVED
+                        self._STA_do_lamp_ctrl(value, report=not acked and not broadcast)
+                        if dest_id == self.LampControl.BROADCAST_ID and value[3] != self.LampControl.BYTE_RESERVED:
+                            # the ACK slots of every station
+                            self._report_slots = ord(value[3])
+                        if not multicast:
                             logger.debug('sent ACK')
                             self._send_message(src_id, self.LampControl.MESG_ACK)
+                        elif value[3] != self.LampControl.BYTE_RESERVED:
+                            # ACK requested by a broadcast or group lamp ctrl, value[3] is the number of ACK slots
+                            self._STA_ack_multicast(src_id, sn, ord(value[3]))
                         else:
                             logger.debug('no ACK to broadcast')
+                    elif tag == self.LampControl.TAG_RELIABLE:
+                        logger.debug('got TAG_RELIABLE, epoch %d' % ord(value[3]))
+                        self._STA_do_lamp_ctrl(value)
+                        self._epochs[src_id] = value[3]
+                    elif tag == self.LampControl.TAG_EPOCH:
+                        if value[3] != self.LampControl.BYTE_RESERVED:
+                            self._report_slots = ord(value[3])
+                        if self._epochs.get(src_id) == value[0] and value[3] != self.LampControl.BYTE_RESERVED:
+                            # confirm the last TAG_RELIABLE with an ACK in own ACK slot, the silence of a
+                            # station which missed it asks for the repair
+                            logger.debug('confirm epoch %d' % ord(value[0]))
+                            self._STA_ack_multicast(src_id, sn, ord(value[3]))
+                        else:
+                            logger.debug('missed epoch %d, wait for repair' % ord(value[0]))
                     elif tag == self.LampControl.TAG_POLL:
                         logger.debug('got TAG_POLL')
                         MESG_POLL_ACK = self.LampControl.TAG_POLL_ACK + self._STA_led_status \
                                         + self.LampControl.BYTE_RESERVED * 3
                         self._send_message(src_id, MESG_POLL_ACK)
+                    elif tag == self.LampControl.TAG_SLOT_MAP:
+                        logger.debug('got TAG_SLOT_MAP')
+                        if dest_id != self.LampControl.BROADCAST_ID:
+                            try:
+                                self._slots.set_slot(ord(value[0]), ord(value[1]) & 0xF)
+                            except ValueError:
+                                self._send_message(src_id, self.LampControl.MESG_NACK)
+                            else:
+                                self._report_hops = ord(value[1]) >> 4
+                                if value[2] != self.LampControl.BYTE_RESERVED:
+                                    # the ACK slots of every station
+                                    self._report_slots = ord(value[2])
+                                logger.info('slot %d/%d assigned' % (self._slots.slot, self._slots.slots))
+                                self._send_message(src_id, self.LampControl.MESG_ACK)
+                    elif tag == self.LampControl.TAG_ADDR_SET:
+                        logger.debug('got TAG_ADDR_SET')
+                        if dest_id != self.LampControl.BROADCAST_ID:
+                            self._STA_set_addr(src_id, struct.unpack('>H', value[0:2])[0])
+                    elif tag == self.LampControl.TAG_GROUP_SET:
+                        logger.debug('got TAG_GROUP_SET')
+                        if dest_id == self._id:
+                            self._STA_set_group(src_id, ord(value[0]), struct.unpack('>H', value[1:3])[0])
+                    elif tag == self.LampControl.TAG_LAMP_BITMAP:
+                        state = lamp_state(dest_id, value, self._lamp_number())
+                        if state is not None:
+                            logger.debug('got TAG_LAMP_BITMAP')
+                            self._STA_do_lamp_ctrl(self.LampControl.MESG_VALUE_LAMP_ALL_ON if state
+                                                   else self.LampControl.MESG_VALUE_LAMP_ALL_OFF)
+                    elif tag == self.LampControl.TAG_TELEMETRY:
+                        logger.debug('got TAG_TELEMETRY')
+                        if dest_id == self._id:
+                            adjacent = tx_slot == 0 and next_slot == ROUTE_ADJACENT
+                            self._STA_send_telemetry(src_id, sn, struct.unpack('>H', value[0:2])[0],
+                                                     self._frame_gap(adjacent))
+                    elif tag == self.LampControl.TAG_STATUS_ACK:
+                        if dest_id == self._id and self._reporter.ack(ord(value[1])):
+                            logger.debug('status report %d is ACKed' % ord(value[1]))
                 else:
                     logger.debug('got unknown CMD TAG, sent NACK')
                     self._send_message(src_id, self.LampControl.MESG_NACK)
             else:
                 logger.debug('duplicated frame received')
 
-        # do relay if self._role is 'RELAY'
-        if self._role == 'RELAY' and dest_id != self._id:
-            logger.debug('RELAY: Nsn=%s, Psn=%s' % (str(sn), str(self._frame_no)))
-            if update_frame_no: # handle broadcast frame again
-                # each RELAY need random backoff before TX to avoid E32 RF conflicting
-                sleep(random.sample(range(self.relay_random_backoff + 1), 1)[0])
-                logger.info('RELAY sn = %s' % str(sn))
-                self._forward_frame(rx_frame)
-            else:
-                if sn > self._frame_no or (sn == 0 and sn != self._frame_no):
-                    update_frame_no = True
-                    self._frame_no = sn
-                    # each RELAY need a fixed delay before random backoff TX to avoid E32 RF conflicting with STA response
-                    sleep(self.relay_delay)
-                    # each RELAY need random backoff before TX to avoid E32 RF conflicting
-                    sleep(random.sample(range(self.relay_random_backoff + 1), 1)[0])
-                    logger.info('RELAY sn = %s' % str(sn))
-                    self._forward_frame(rx_frame)
+        # do relay if self._role is 'RELAY', but not its own frames which the next RELAY sends back
+        if self._role == 'RELAY' and (dest_id != self._id or broadcast) and src_id != self._id:
+            # every distinct frame is forwarded once, whatever the other flows are doing
+            if self._relay_cache.seen((src_id, dest_id, sn, tag)):
+                logger.debug('RELAY: duplicated frame sn=%s from %s' % (str(sn), binascii.b2a_hex(src_id)))
+                return
+            stamp = None
+            if not multicast:
+                # the 1st copy comes from the direction of src_id
+                self._routes.learn(src_id, tx_slot)
+                if next_slot == ROUTE_FLOOD:
+                    stamp = pack_stamp(self._slots.slot, ROUTE_FLOOD)
+                elif next_slot == self._slots.slot:
+                    stamp = pack_stamp(self._slots.slot, self._routes.next_hop(dest_id))
+                else:
+                    logger.debug('RELAY: not on the path to %s' % binascii.b2a_hex(dest_id))
+                    self._relay_pruned += 1
+                    return
+                if tag == self.LampControl.TAG_ACK and value[2] == self.LampControl.BYTE_MULTICAST_ACK \
+                        and self._aggregator.absorb(dest_id, sn, struct.unpack('>H', value[0:2])[0]):
+                    logger.debug('RELAY: ACK sn=%s from %s is aggregated' % (str(sn), binascii.b2a_hex(src_id)))
+                    return
+            elif (tag == self.LampControl.TAG_LAMP_CTRL or tag == self.LampControl.TAG_EPOCH) \
+                    and value[3] != self.LampControl.BYTE_RESERVED:
+                self._RELAY_open_window(src_id, sn, ord(value[3]))
+            elif tag == self.LampControl.TAG_SN:
+                # the SN reset frame has room for the RELAYs on the way, the sum of their slots and the route stamp
+                stamp = chr(min(255, ord(value[1]) + 1)) + chr(min(255, ord(value[2]) + self._slots.slot)) \
+                        + pack_stamp(self._slots.slot, ROUTE_FLOOD)
+            # slot 0 is left for STA response, each RELAY forwards in its own slot to avoid E32 RF conflicting
+            logger.info('RELAY sn = %s' % str(sn))
+            self._tx_scheduler.schedule(self._slots.delay(self._rx_time), self._forward_frame, (rx_frame.raw, stamp),
+                                        label='forward sn=%d from %s to %s' % (sn, binascii.b2a_hex(src_id),
+                                                                              binascii.b2a_hex(dest_id)))
         pass
 
-    def run(self):
+    def _STA_set_addr(self, rc_id, addr):
+        '''
+        take the short address assigned by RC, which has RC_ADDR, and ACK in the legacy format.
+        compact frames are only sent to RC in response to a compact one (see process_frame()), which proves
+        that the RELAYs on the way take them.
+        '''
+        if addr == RC_ADDR or not self._addresses.assign(rc_id, RC_ADDR, replace=True) \
+                or not self._addresses.assign(self._id, addr, replace=True):
+            self._send_message(rc_id, self.LampControl.MESG_NACK)
+            return
+        logger.info('short address %d assigned' % addr)
+        self._short_addr = addr
+        self._send_message(rc_id, self.LampControl.MESG_ACK)
+
+    def _STA_ack_multicast(self, rc_id, sn, slots):
+        ''' ACK a multicast request which asks for ACKs in `slots` ACK slots '''
+        if self._role == 'RELAY':
+            # own ACK goes in the ACK bitmap of this RELAY
+            self._RELAY_open_window(rc_id, sn, slots)
+            self._aggregator.absorb(rc_id, sn_add(sn, 1), self._ack_key())
+        else:
+            # the STAs ACK one after another, after the RELAYs forwarded the request,
+            # with their addr for the RELAY which takes it in its ACK bitmap
+            slot = self._ack_key() % slots
+            logger.debug('sent ACK to multicast in slot %d' % slot)
+            self._send_message(rc_id, self.LampControl.TAG_ACK + struct.pack('>H', self._ack_key())
+                               + self.LampControl.BYTE_MULTICAST_ACK + self.LampControl.BYTE_RESERVED,
+                               delay=self._ack_delay(rc_id, slot))
+
+    def _RELAY_open_window(self, rc_id, sn, slots):
+        '''
+        start taking in the ACKs to a multicast request: the STAs around hear it within a slot cycle after
+        this RELAY forwarded it, and ACK within one more slot cycle plus their ACK slots
+        '''
+        if self._aggregator.open(rc_id, sn):
+            window = self._slots.delay(self._rx_time) + 2 * self._slots.cycle() \
+                     + slots * self._slots.slot_len + self.e32_delay
+            self._tx_scheduler.schedule(window, self._RELAY_close_window, (rc_id, sn),
+                                        label='ACK bitmap of sn=%d' % sn)
+
+    def _RELAY_close_window(self, rc_id, sn):
+        ''' send the ACK bitmap upstream, flooded like a broadcast, one frame per 72 addr in use '''
+        addrs = self._aggregator.close(rc_id, sn)
+        if not addrs:
+            return
+        frames = chunks(make_bitmap(addrs, addrs[-1] + 1), skip_empty=True)
+        logger.info('RELAY: %d ACKs to sn=%d in %d frames' % (len(addrs), sn, len(frames)))
+        for (bits, value) in frames:
+            self._send_message(bits, self.LampControl.TAG_ACK_BITMAP + value, sn=sn_add(sn, 1))
+
+    def _ack_delay(self, rc_id, slot):
+        '''
+        delay of the ACK to a multicast request in ACK slot `slot`, counted from when the request was received.
+        a STA behind RELAYs got it each RELAY's slot plus a frame on air later than the nodes which hear RC,
+        so it takes that back to share the same ACK slot grid with them, the RELAYs of the way are counted in
+        the SN reset frame of RC. the radio latency of a RELAY comes on top of it, unknown here, so half of the
+        guard time is taken back for it as well: the ACK is off the grid by less than the guard time either way.
+        '''
+        delay = self._slots.cycle() + slot * self._slots.slot_len
+        (relays, slot_sum) = self._rc_paths.get(rc_id, (0, 0))
+        next_slot = self._routes.next_hop(rc_id)
+        if not relays and next_slot != ROUTE_FLOOD and next_slot != ROUTE_ADJACENT:
+            # RC's SN reset frame is missed or came through legacy RELAYs, at least the next one is known
+            (relays, slot_sum) = (1, next_slot)
+        delay -= slot_sum * self._slots.slot_len \
+                 + relays * (self._slots.airtime + (self._slots.slot_len - self._slots.airtime) / 2)
+        return delay
+
+    def _frame_gap(self, adjacent):
+        '''
+        seconds from one frame of a multi-frame response to the next one: a slot when RC sent the request with
+        the route stamp of a station which hears it directly, as no RELAY forwards it and the RELAY slots are
+        free, else a slot cycle so that the RELAYs forward each frame before the next one comes
+        '''
+        if adjacent:
+            return self._slots.slot_len
+        return self._slots.cycle()
+
+    def _response_gap(self, dest_id):
+        ''' frame gap of the multi-frame response to the request just sent to dest_id, by its route stamp '''
+        return self._frame_gap(self._sent_hops.get(dest_id) == ROUTE_ADJACENT)
+
+    def _lamp_number(self):
+        ''' the bit of a STA/RELAY in TAG_LAMP_BITMAP frames, None if it has none '''
+        return self._lamp_addr if self._lamp_addr is not None else self._short_addr
+
+    def _ack_key(self):
+        ''' the number a STA takes its ACK slot from, RC knows it as 'addr' in node_config.json '''
+        addr = self._lamp_number()
+        return addr if addr is not None else ord(self._id[-1])
+
+    def _STA_set_group(self, rc_id, op, group):
+        try:
+            if op == GROUP_JOIN:
+                result = self._groups.join(group)
+            elif op == GROUP_LEAVE:
+                result = self._groups.leave(group)
+            elif op == GROUP_CLEAR:
+                result = self._groups.clear()
+            else:
+                result = False
+        except AssertionError:
+            result = False
+        logger.info('groups: %s' % self._groups.groups())
+        self._send_message(rc_id, self.LampControl.MESG_ACK if result else self.LampControl.MESG_NACK)
+
+    def _startup(self):
         if self._role == 'RC':
             # broadcast frame number reset frame upon the startup to avoid STA confusing issue
             self._send_message(self.LampControl.BROADCAST_ID, self.LampControl.MESG_NULL)
 
+    def addressed(self, rx_frame):
+        ''' whether rx_frame is addressed to this node: to its ID, to every node, or to one of its groups '''
+        dest_id = rx_frame.dest_id
+        return dest_id == self._id or self._is_broadcast(dest_id, rx_frame.tag) or self._groups.member(dest_id)
+
+    def accepts(self, rx_frame):
+        '''
+        whether this node handles rx_frame at all: a STA drops the frames addressed to others without any side
+        effect, RC and RELAYs (which forward them) take every frame
+        :param rx_frame: the received Frame
+        '''
+        if self._role != 'STA':
+            return True
+        return self.addressed(self._addresses.resolve(rx_frame))
+
+    def process_frame(self, rx_frame):
+        '''
+        handle one received frame, it is called by the receiving thread or by a simulated radio
+        :param rx_frame: the received Frame
+        '''
+        self._rx_time = self._clock.monotonic()
+        rx_frame = self._addresses.resolve(rx_frame)
+        if rx_frame.dest_id == self._id and rx_frame.is_compact():
+            # the sender has its short address and the RELAYs on the way take compact frames
+            self._addresses.enable(rx_frame.src_id)
+        elif rx_frame.dest_id == self._id and self._role != 'RC':
+            # RC fell back to the legacy format, e.g. a legacy RELAY on the way drops compact frames:
+            # respond in the same format
+            self._addresses.disable(rx_frame.src_id)
+        elif rx_frame.dest_id == self._id:
+            # the station responded after a fallback, the compact request may have been lost on the way
+            self._addresses.retry(rx_frame.src_id)
+        if self._role == 'RC':
+            station = self.stations.station(rx_frame.src_id)
+            if station is not None:
+                station['last_seen'] = self._rx_time
+            collector = self._collector
+            if collector is not None and collector.feed(rx_frame):
+                return
+            if rx_frame.tag == self.LampControl.TAG_STATUS and rx_frame.dest_id == self._id:
+                self._RC_on_status(rx_frame)
+                return
+            if rx_frame.tag == self.LampControl.TAG_POLL_ACK and station is not None:
+                station['lamp_ctrl_status'] = ord(rx_frame.value[0])
+            # hand rx_frame over to the RC request waiting for it
+            if self._dispatcher.dispatch(rx_frame) and rx_frame.dest_id == self._id:
+                # the 1st copy of a response tells the next hop towards the station
+                self._routes.learn(rx_frame.src_id, unpack_stamp(rx_frame.value[3])[0])
+        else:
+            # process here for STA & RELAY
+            self._STA_frame_process(rx_frame)
+
+    def run(self):
+        self._startup()
+        if self._role != 'RC':
+            self._tx_scheduler.start()
         logger.info('Thread receiving starts running until it is stop on purpose.')
         while not self.thread_stop:
-            rx_frame = self._recv_frame()
-            if self._role == 'RC':
-                # place rx_frame into queue for RC tx routine process
-                self._RC_queue.put(rx_frame)
-            else:
-                # process here for STA & RELAY
-                self._STA_frame_process(rx_frame)
+            try:
+                rx_frame = self._recv_frame()
+            except RxCancelled:
+                logger.debug('receiving is cancelled')
+                break
+            self.process_frame(rx_frame)
+        self._tx_scheduler.stop()
         logger.debug('Thread receiving end')
 
     def stop(self):
         self.thread_stop = True
+        # wake up the pending serial read so that the thread ends right now
+        self.ser.cancel()
 
-    def _STA_do_lamp_ctrl(self, value):
+    def _STA_do_lamp_ctrl(self, value, report=False):
+        '''
+        :param report: report a change of the lamp status to RC, which doesn't learn of it from an ACK
+        '''
+        if report and value[0] != self._STA_led_status:
+            self.STA_report_status()
         if value[0] == self.LampControl.BYTE_ALL_ON:
             logger.info('LED ALL ON')
             if ISRPI:
@@ -317,30 +867,147 @@ class Protocol(threading.Thread):
         self._STA_led_status = value[0]
         pass
 
-    def _RC_wait_for_resp(self, src_id, tag, timeout):
-        result = False
-        while result == False:
-            try:
-                rx_frame = self._RC_queue.get(True, timeout)
-                self._RC_queue.task_done()
-            except Queue.Empty:
-                raise RxTimeOut
-            else:
-                rx_src_id = rx_frame[2:8]
-                rx_dest_id = rx_frame[8:14]
-                rx_sn = ord(rx_frame[14])
-                rx_tag = rx_frame[15]
-                if rx_src_id == src_id and rx_dest_id == self._id:
-                    if rx_sn > self._frame_no:
-                        self._frame_no = rx_sn
-                        if rx_tag == self.LampControl.TAG_NACK:
-                            raise RxNack
-                        elif rx_tag == tag:
-                            result = True
-                        else:
-                            logger.debug('unexpected frame received with TAG %s', binascii.b2a_hex(rx_tag))
-                            break
-        return (result, rx_frame[15:20])
+    def STA_report_status(self, flags=0):
+        '''
+        report the status to RC without waiting for a poll, e.g. on a change of the lamp status by a group lamp
+        ctrl without ACK slots. it is sent once RC is known, i.e. after the 1st frame from RC.
+        :param flags: REPORT_* reasons of the report for RC, e.g. REPORT_TELEMETRY
+        '''
+        if self._rc_id is not None:
+            self._report_flags |= flags
+            self._reporter.changed()
+
+    def _STA_send_status(self, report_no):
+        if self._sent_flags[0] != report_no:
+            # a new report takes the reasons so far, its retries carry the same ones
+            self._sent_flags = (report_no, self._report_flags)
+            self._report_flags = 0
+        logger.debug('sent status report %d' % report_no)
+        self._send_message(self._rc_id, self.LampControl.TAG_STATUS + self._STA_led_status + chr(report_no)
+                           + chr(self._sent_flags[1]) + self.LampControl.BYTE_RESERVED,
+                           sn=self._tx_sn.next(self._rc_id))
+
+    def STA_set_telemetry(self, values):
+        '''
+        take new measurements, which are sent to RC on its telemetry readout (TAG_TELEMETRY). a field which
+        changed by its report threshold or more since the last report makes the STA report (REPORT_TELEMETRY),
+        so that RC reads it without waiting for the next sweep
+        :param values: dict of field name (see TELEMETRY_FIELDS of znldTelemetry): value, None for no value
+        '''
+        self._telemetry.update(values)
+        crossed = []
+        for (name, threshold) in self._report_thresholds.iteritems():
+            value = values.get(name)
+            if value is None:
+                continue
+            last = self._reported_telemetry.setdefault(name, value)
+            if abs(value - last) >= threshold:
+                crossed.append(name)
+        if crossed and self._rc_id is not None:
+            logger.debug('telemetry %s crossed the report threshold' % ', '.join(crossed))
+            self._reported_telemetry.update((name, values[name]) for name in crossed)
+            self.STA_report_status(REPORT_TELEMETRY)
+
+    def _STA_send_telemetry(self, rc_id, sn, mask, gap):
+        ''' answer a telemetry readout, one frame every `gap` seconds '''
+        parts = pack(mask, self._telemetry)
+        logger.debug('sent telemetry in %d frames' % len(parts))
+        for (index, part) in enumerate(parts):
+            self._send_message(rc_id, self.LampControl.TAG_TELEMETRY_DATA + part + self.LampControl.BYTE_RESERVED,
+                               delay=index * gap, sn=sn_add(sn, 1 + index))
+
+    def _report_holdoff(self, attempt):
+        '''
+        the reports of stations which change at once (e.g. a voltage dip) go in their own slots, the ACK slots of
+        every station RC tells, each one long enough for the report and the ACK of RC forwarded over the hops of
+        the farthest station. every attempt moves to another slot.
+        '''
+        slot = report_slot(self._ack_key(), attempt, self._report_slots)
+        return self._ack_delay(self._rc_id, slot * REPORT_SLOT * (1 + 2 * self._report_hops))
+
+    def get_report_stats(self):
+        ''' STA/RELAY status reports sent, retried, ACKed and given up; RC status reports received '''
+        if self._role == 'RC':
+            return dict(self._report_stats)
+        return self._reporter.stats()
+
+    def _RC_on_status(self, rx_frame):
+        ''' take a status report and ACK it, a report sent again as its ACK was lost is ACKed once more '''
+        src_id = rx_frame.src_id
+        station = self.stations.station(src_id)
+        if station is None:
+            self._report_stats['unknown'] += 1
+            return
+        report_no = ord(rx_frame.value[1])
+        last = self._reports.get(src_id)
+        if last == (report_no, rx_frame.sn):
+            # another copy of the same frame, e.g. forwarded by a RELAY as well
+            return
+        self._reports[src_id] = (report_no, rx_frame.sn)
+        # the ACK goes back the way the report came
+        self._routes.learn(src_id, unpack_stamp(rx_frame.value[3])[0])
+        self._send_message(src_id, self.LampControl.TAG_STATUS_ACK + self.LampControl.BYTE_RESERVED
+                           + rx_frame.value[1] + self.LampControl.BYTE_RESERVED * 2)
+        if last is not None and last[0] == report_no:
+            self._report_stats['duplicates'] += 1
+            return
+        self._report_stats['reports'] += 1
+        if ord(rx_frame.value[2]) & REPORT_TELEMETRY:
+            self._telemetry_due.add(src_id)
+        station['lamp_ctrl_status'] = ord(rx_frame.value[0])
+        logger.info('status report of STA (%s): %d' % (binascii.b2a_hex(src_id), station['lamp_ctrl_status']))
+        if self.on_status is not None:
+            self.on_status(src_id, station)
+
+    def _RC_set_ctrl(self, dest_ids, value):
+        ''' the lamp ctrl value RC sent to dest_ids, None for every station '''
+        if dest_ids is not None:
+            dest_ids = [id for id in (self.stations.hex_of(id) for id in dest_ids) if id is not None]
+        self.stations.assign('lamp_ctrl', ord(value[0]), dest_ids)
+
+    def RC_telemetry_due(self):
+        ''' :return: ID bytes of the stations which reported a telemetry change since the last call '''
+        (due, self._telemetry_due) = (self._telemetry_due, set())
+        return list(due)
+
+    def RC_out_of_sync(self):
+        ''' :return: IDs of the stations whose lamp status isn't the lamp ctrl RC sent them last '''
+        return self.stations.bin_ids(self.stations.where('lamp_ctrl_status', '!=', 'lamp_ctrl'))
+
+    def _RC_set_status(self, dest_id, value):
+        ''' the lamp status of a station which ACKed lamp ctrl `value` '''
+        station = self.stations.station(dest_id)
+        if station is not None:
+            station['lamp_ctrl_status'] = ord(value[0])
+
+    def _on_timeout(self, dest_id):
+        ''' a request to dest_id timed out: flood the retry in case the route is broken, in the legacy format
+            in case the station lost its short address '''
+        self._routes.forget(dest_id)
+        self._addresses.disable(dest_id)
+
+    def _RC_wait_for_resp(self, src_id, sn, tag, timeout):
+        '''
+        wait for the response from src_id to the frame sent with sn, which comes back with sn + 1
+        :return: (True, TAG + value) on the expected TAG
+        '''
+        sent_at = self._clock.monotonic()
+        pending = self._dispatcher.expect(src_id, (tag, self.LampControl.TAG_NACK), (sn + 1) & 0xFF, since=sent_at)
+        rx_frame = pending.wait(timeout)
+        if rx_frame is None:
+            self._dispatcher.cancel(pending)
+            self._rtt.on_timeout(src_id)
+            self._on_timeout(src_id)
+            raise RxTimeOut
+        if not pending.claimed:
+            self._rtt.sample(src_id, self._clock.monotonic() - sent_at)
+        if rx_frame.tag == self.LampControl.TAG_NACK:
+            raise RxNack
+        return (True, rx_frame.message())
+
+    def get_dispatch_stats(self):
+        ''' RC dispatcher statistics: matched, late, claimed, evicted and expired frames '''
+        return self._dispatcher.stats()
 
     def RC_unicast_poll(self, dest_id, expected):
         '''
@@ -355,9 +1022,10 @@ class Protocol(threading.Thread):
         logger.info('RC send POLL to STA (%s)' % binascii.b2a_hex(dest_id))
         while count < self._retry:
             logger.info('RC send message %s times' % str(count + 1))
-            self._send_message(dest_id, mesg)
+            sn = self._send_message(dest_id, mesg)
             try:
-                (result, data) = self._RC_wait_for_resp(src_id=dest_id, tag=self.LampControl.TAG_POLL_ACK, timeout=self.timeout)
+                (result, data) = self._RC_wait_for_resp(src_id=dest_id, sn=sn, tag=self.LampControl.TAG_POLL_ACK,
+                                                        timeout=self._rtt.timeout(dest_id))
                 if result:
                     if data[1] == expected:
                         return True
@@ -384,17 +1052,20 @@ class Protocol(threading.Thread):
         mesg = self.LampControl.TAG_LAMP_CTRL + value
         logger.info('RC send lamp ctrl (%s) to STA (%s)' %
                     (binascii.b2a_hex(value), binascii.b2a_hex(dest_id)))
+        self._RC_set_ctrl(None if dest_id == self.LampControl.BROADCAST_ID else [dest_id], value)
         while count < self._retry:
             logger.info('RC send message %s times' % str(count+1))
-            self._send_message(dest_id, mesg)
+            sn = self._send_message(dest_id, mesg)
             if dest_id == self.LampControl.BROADCAST_ID:
                 # no response is expected on broadcast TX
                 logger.info('Broadcast mesg: %s' % binascii.b2a_hex(mesg))
                 return True
             try:
-                (result, data) = self._RC_wait_for_resp(src_id=dest_id, tag=self.LampControl.TAG_ACK, timeout=self.timeout)
+                (result, data) = self._RC_wait_for_resp(src_id=dest_id, sn=sn, tag=self.LampControl.TAG_ACK,
+                                                        timeout=self._rtt.timeout(dest_id))
                 if result:
                     logger.info('RC got TAG_ACK from STA (%s)' % binascii.b2a_hex(dest_id))
+                    self._RC_set_status(dest_id, value)
                     return True
                 else:
                     count += 1
@@ -408,6 +1079,422 @@ class Protocol(threading.Thread):
             return False
         pass
 
+    def RC_assign_slot(self, dest_id, slot, slots, report_slots=None):
+        '''
+        unicast the TDMA slot map entry of a STA/RELAY, expect TAG_ACK.
+        value[1] is the number of slots, its high nibble the hops of the farthest station, value[2] the number
+        of status report slots.
+        :param slot: own slot, 0 for STA and 1 .. slots-1 for RELAY
+        :param slots: number of slots
+        :param report_slots: slots the status reports are spread over, the ACK slots of every station by default
+        :return: True on success, False on failure
+        :raise ValueError: when slots doesn't fit the 4-bit slot field or slot isn't one of them
+        '''
+        if not 0 <= slot < slots <= ROUTE_MAX_SLOTS:
+            raise ValueError('slot %d/%d out of range, at most %d slots' % (slot, slots, ROUTE_MAX_SLOTS))
+        if report_slots is None:
+            report_slots = self._RC_report_slots()
+        mesg = self.LampControl.TAG_SLOT_MAP + chr(slot) + chr(slots | min(self.hop, 0xF) << 4) + chr(report_slots) \
+               + self.LampControl.BYTE_RESERVED
+        logger.info('RC assign slot %d/%d to STA (%s)' % (slot, slots, binascii.b2a_hex(dest_id)))
+        txn = Transaction(dest_id, mesg, self.LampControl.TAG_ACK, self._retry)
+        self._engine.run([txn])
+        return txn.result
+
+    def RC_send_slot_map(self, ids=None):
+        '''
+        assign the slots given in node_config.json ('slot' of each station) with the RC number of slots
+        :param ids: IDs (hex) of the stations to send it to, None for every station
+        :return: dict of dest_id: True on success, False on failure
+        '''
+        results = {}
+        report_slots = self._RC_report_slots()
+        for id in (self.stations.iterkeys() if ids is None else ids):
+            if 'slot' in self.stations[id]:
+                dest_id = self.stations.bin_of(id)
+                results[dest_id] = self.RC_assign_slot(dest_id, self.stations[id]['slot'], self._slots.slots,
+                                                       report_slots)
+        return results
+
+    def RC_assign_address(self, dest_id, addr):
+        '''
+        unicast the short address of a STA/RELAY in the legacy format, expect TAG_ACK.
+        compact frames are tried from then on, the station responds in the format of the request. a request
+        which times out, e.g. as a legacy RELAY on the way drops compact frames, falls back to the legacy format,
+        for good after AddressBook.max_failures fallbacks. a legacy node NACKs the unknown TAG and stays legacy.
+        a station which ACKs it takes TAG_LAMP_BITMAP as well, which is older, one which NACKs it doesn't:
+        'bitmap' of the station tells it RC_lamp_bitmap().
+        :param addr: 1 .. 0xFFFE, unique in the network
+        :return: True on success, False on failure
+        '''
+        if addr == RC_ADDR or not self._addresses.assign(dest_id, addr):
+            return False
+        self._addresses.disable(dest_id)
+        mesg = self.LampControl.TAG_ADDR_SET + struct.pack('>H', addr) + self.LampControl.BYTE_RESERVED * 2
+        logger.info('RC assign short address %d to STA (%s)' % (addr, binascii.b2a_hex(dest_id)))
+        txn = Transaction(dest_id, mesg, self.LampControl.TAG_ACK, self._retry)
+        self._engine.run([txn])
+        if txn.result:
+            self._addresses.enable(dest_id)
+        station = self.stations.station(dest_id)
+        if station is not None and (txn.result or isinstance(txn.error, RxNack)):
+            station['bitmap'] = bool(txn.result)
+        return txn.result
+
+    def RC_send_address_map(self, ids=None):
+        '''
+        assign the short addresses given in node_config.json ('addr' of each station)
+        :param ids: IDs (hex) of the stations to send it to, None for every station
+        :return: dict of dest_id: True on success, False on failure
+        '''
+        results = {}
+        for id in (self.stations.iterkeys() if ids is None else ids):
+            if 'addr' in self.stations[id]:
+                dest_id = self.stations.bin_of(id)
+                results[dest_id] = self.RC_assign_address(dest_id, self.stations[id]['addr'])
+        return results
+
+    def RC_set_group(self, dest_id, group, op=GROUP_JOIN):
+        '''
+        unicast a group membership change to a STA/RELAY, which keeps it across restarts, expect TAG_ACK
+        :param group: 1 .. 0xFFFF, ignored by GROUP_CLEAR
+        :param op: GROUP_JOIN, GROUP_LEAVE or GROUP_CLEAR (leave every group)
+        :return: True on success, False on failure
+        '''
+        mesg = self.LampControl.TAG_GROUP_SET + chr(op) + struct.pack('>H', group) + self.LampControl.BYTE_RESERVED
+        logger.info('RC set group %d (op %d) of STA (%s)' % (group, op, binascii.b2a_hex(dest_id)))
+        txn = Transaction(dest_id, mesg, self.LampControl.TAG_ACK, self._retry)
+        self._engine.run([txn])
+        station = self.stations.station(dest_id)
+        if txn.result and station is not None:
+            groups = set(station.get('groups', []))
+            if op == GROUP_JOIN:
+                groups.add(group)
+            elif op == GROUP_LEAVE:
+                groups.discard(group)
+            else:
+                groups = set()
+            station['groups'] = sorted(groups)
+        return txn.result
+
+    def RC_send_group_map(self, ids=None):
+        '''
+        make the groups of every station those given in node_config.json ('groups' of each station)
+        :param ids: IDs (hex) of the stations to send it to, None for every station
+        :return: dict of dest_id: True on success, False on failure
+        '''
+        results = {}
+        for id in (self.stations.iterkeys() if ids is None else ids):
+            if 'groups' in self.stations[id]:
+                dest_id = self.stations.bin_of(id)
+                groups = list(self.stations[id]['groups'])
+                result = self.RC_set_group(dest_id, 0, GROUP_CLEAR)
+                for group in groups:
+                    result = result and self.RC_set_group(dest_id, group, GROUP_JOIN)
+                results[dest_id] = result
+        return results
+
+    def _RC_assign_addresses(self, ids, replace=False):
+        '''
+        take the short addresses of stations ids into the address book, as RC knows them from node_config.json
+        :param replace: True to take an addr from the station which had it, e.g. on reload
+        '''
+        for id in ids:
+            if 'addr' in self.stations[id]:
+                self._addresses.assign(self.stations.bin_of(id), self.stations[id]['addr'], replace=replace)
+
+    def RC_reload_stations(self, stations):
+        '''
+        take a new station list while RC is running, e.g. from a StationFile: the removed stations are
+        forgotten, and the slot, short address and groups of the new and changed ones are sent to them
+        :param stations: dict of station ID (hex): config dict, as 'stations' of node_config.json
+        :return: (added, removed, changed) lists of station IDs (hex)
+        :raise ValueError: when two stations have the same addr, name or slot, the station list is kept then
+        '''
+        self._RC_check_stations(stations)
+        (added, removed, changed) = self.stations.reload(stations)
+        logger.info('RC reloads stations: %d added, %d removed, %d changed' % (len(added), len(removed), len(changed)))
+        for id in removed:
+            self._addresses.release(binascii.a2b_hex(id))
+        updated = added + changed
+        self._RC_assign_addresses(updated, replace=True)
+        self.RC_send_slot_map(updated)
+        self.RC_send_address_map(updated)
+        self.RC_send_group_map(updated)
+        return (added, removed, changed)
+
+    def RC_group_members(self, group):
+        ''' :return: list of the station IDs in a group, per node_config.json and RC_set_group() '''
+        return self.stations.bin_ids([id for id in self.stations.iterkeys()
+                                      if group in self.stations[id].get('groups', [])])
+
+    def RC_lamp_ctrl_group(self, group, value, ack=False):
+        '''
+        lamp ctrl to every member of a group (zone) in one multicast frame
+        :param value: lamp ctrl value, its last byte is replaced by the number of ACK slots
+        :param ack: True to have every member ACK
+        :return: dict of member ID: True if it ACKed, False if not; None for every member without ack
+        '''
+        members = self.RC_group_members(group)
+        logger.info('RC send lamp ctrl (%s) to group %d of %d STAs' % (binascii.b2a_hex(value), group, len(members)))
+        return self._RC_multicast_lamp_ctrl(group_id(group), members, value, ack)
+
+    def RC_lamp_ctrl_broadcast(self, value, ack=True):
+        '''
+        broadcast lamp ctrl which tells which stations applied it: each RELAY sends one ACK bitmap of the
+        STAs it serves, instead of polling every station
+        :param value: lamp ctrl value, its last byte is replaced by the number of ACK slots
+        :return: dict of station ID: True if it ACKed, False if not; None for every station without ack
+        '''
+        members = self.stations.bin_ids()
+        logger.info('RC broadcast lamp ctrl (%s) to %d STAs' % (binascii.b2a_hex(value), len(members)))
+        return self._RC_multicast_lamp_ctrl(self.LampControl.BROADCAST_ID, members, value, ack)
+
+    def _RC_ack_keys(self, members, stations=None):
+        '''
+        :param members: station IDs
+        :param stations: dict of station ID (hex): config dict to take their addr from, else the station list
+        :return: dict of ACK slot key (addr, else the last byte of the ID as a STA takes it): station ID
+        :raise ValueError: when two members have the same key, their ACKs would be taken as the ACK of one of them
+        '''
+        keys = {}
+        for id in members:
+            config = self.stations.station(id) if stations is None else stations[binascii.b2a_hex(id)]
+            key = config.get('addr', ord(id[-1]))
+            if keys.setdefault(key, id) != id:
+                raise ValueError('ACK slot key %d of station %s is the one of station %s, give them distinct addr'
+                                 % (key, binascii.b2a_hex(id), binascii.b2a_hex(keys[key])))
+        return keys
+
+    def _RC_report_slots(self):
+        ''' the status report slots of the stations, their ACK slots for a broadcast '''
+        keys = self._RC_ack_keys(self.stations.bin_ids())
+        return ack_slots(keys.keys()) if keys else 1
+
+    def _RC_multicast_lamp_ctrl(self, dest_id, members, value, ack):
+        keys = self._RC_ack_keys(members) if ack else {}
+        slots = ack_slots(keys.keys()) if keys else 0
+        mesg = self.LampControl.TAG_LAMP_CTRL + value[0:3] + chr(slots)
+        self._RC_set_ctrl(members, value)
+        if not slots:
+            self._send_message(dest_id, mesg)
+            return dict((id, None) for id in members)
+        acked = self._RC_collect_acks(dest_id, mesg, keys, slots)
+        for id in acked:
+            self._RC_set_status(id, value)
+        return dict((id, id in acked) for id in members)
+
+    def _RC_collect_acks(self, dest_id, mesg, keys, slots):
+        '''
+        send a multicast request which asks for ACKs in `slots` ACK slots
+        :return: set of the IDs which ACKed, directly or in the ACK bitmap of a RELAY
+        '''
+        sent_at = self._clock.monotonic()
+        sn = self._send_message(dest_id, mesg)
+        collector = AckCollector(self._id, sn, keys, self.LampControl.TAG_ACK, self.LampControl.TAG_ACK_BITMAP)
+        self._collector = collector
+        # the farthest RELAY hears the request after settle_time, closes its window after two slot cycles and
+        # the ACK slots, and its ACK bitmap comes back in about settle_time
+        deadline = sent_at + 2 * self.settle_time() + 3 * self._slots.cycle() + slots * self._slots.slot_len \
+                   + self.e32_delay + self._timeout_margin
+        self._clock.wait(collector.done, max(0.0, deadline - self._clock.monotonic()))
+        self._collector = None
+        logger.info('RC got %d of %d ACKs (%d direct, %d bitmaps)' %
+                    (len(collector.acked), len(keys), collector.acks, collector.bitmaps))
+        return collector.acked
+
+    def RC_reliable_broadcast(self, value, rounds=3):
+        '''
+        broadcast lamp ctrl with an epoch and repair it where it is missed: after the broadcast an epoch beacon
+        asks the stations which have the epoch to ACK (through the RELAY ACK bitmaps), the silent ones missed
+        the command or the beacon and get the command again, until a beacon is ACKed by every station or after
+        `rounds` beacons. a beacon round ends as soon as every station ACKed it, else after its ACK window.
+        :param value: lamp ctrl value, its last byte is replaced by the epoch
+        :return: dict of station ID: True if it ACKed the epoch, False if it didn't at the last beacon
+        '''
+        self._epoch = self._epoch % 255 + 1
+        mesg = self.LampControl.TAG_RELIABLE + value[0:3] + chr(self._epoch)
+        members = self.stations.bin_ids()
+        keys = self._RC_ack_keys(members)
+        slots = ack_slots(keys.keys())
+        beacon = self.LampControl.TAG_EPOCH + chr(self._epoch) + self.LampControl.BYTE_RESERVED * 2 + chr(slots)
+        logger.info('RC reliable broadcast (%s), epoch %d' % (binascii.b2a_hex(value), self._epoch))
+        self._RC_set_ctrl(None, value)
+        self._reliable_stats['broadcasts'] += 1
+        self._send_message(self.LampControl.BROADCAST_ID, mesg)
+        missed = set(members)
+        for beacon_round in range(rounds):
+            self._clock.sleep(self.settle_time())
+            self._reliable_stats['rounds'] += 1
+            missed = set(members) - self._RC_collect_acks(self.LampControl.BROADCAST_ID, beacon, keys, slots)
+            if not missed:
+                break
+            logger.info('RC epoch %d missed by %d stations, repair round %d'
+                        % (self._epoch, len(missed), beacon_round + 1))
+            self._reliable_stats['repairs'] += 1
+            self._send_message(self._RC_repair_target(missed), mesg)
+        self._reliable_stats['missed'] += len(missed)
+        for id in members:
+            if id not in missed:
+                self._RC_set_status(id, value)
+        return dict((id, id not in missed) for id in members)
+
+    def _RC_repair_target(self, missed):
+        '''
+        the group to repair missed stations with if one group has them all, else BROADCAST_ID.
+        a group frame is flooded like a broadcast, so two groups never cost less air time than a broadcast.
+        '''
+        groups = None
+        for id in missed:
+            station_groups = set(self.stations.station(id).get('groups', []))
+            groups = station_groups if groups is None else groups & station_groups
+        if groups:
+            # the smallest group with all of them
+            return group_id(min(groups, key=lambda group: len(self.RC_group_members(group))))
+        return self.LampControl.BROADCAST_ID
+
+    def get_reliable_stats(self):
+        ''' RC reliable broadcasts, beacon rounds, repairs and stations which missed one after all the rounds '''
+        return dict(self._reliable_stats)
+
+    def RC_lamp_ctrl_multi(self, dest_ids, value):
+        '''
+        unicast lamp ctrl to many stations with up to `window` requests outstanding, expect TAG_ACK
+        :param dest_ids: list of station IDs
+        :param value:
+        :return: dict of dest_id: True on success, False on failure
+        '''
+        mesg = self.LampControl.TAG_LAMP_CTRL + value
+        logger.info('RC send lamp ctrl (%s) to %d STAs' % (binascii.b2a_hex(value), len(dest_ids)))
+        self._RC_set_ctrl(dest_ids, value)
+        txns = [Transaction(dest_id, mesg, self.LampControl.TAG_ACK, self._retry) for dest_id in dest_ids]
+        self._engine.run(txns)
+        for txn in txns:
+            if txn.result:
+                self._RC_set_status(txn.dest_id, value)
+        return dict((txn.dest_id, txn.result) for txn in txns)
+
+    def RC_lamp_bitmap(self, lamps_on, lamps=BITMAP_LAMPS):
+        '''
+        set every lamp on or off at once: broadcast the bitmap of lamp states, each STA/RELAY picks out the bit
+        of its own addr. no response is expected, the lamp status of the stations is taken from the bitmap sent,
+        poll them to make sure.
+        only the stations known to take TAG_LAMP_BITMAP ('bitmap' of the station, from node_config.json or
+        learned by RC_assign_address()) take their bit from it, the others get TAG_LAMP_CTRL by unicast. a legacy
+        node takes a bitmap frame whose dest field is BROADCAST_ID or its own ID for its own and NACKs the unknown
+        TAG, while there are any such stations the lamps of those frames are set by unicast as well.
+        :param lamps_on: iterable of the addr of every lamp to be on, the others are off
+        :param lamps: number of lamps (addr 1 .. lamps) to set, addr 0 is RC_ADDR
+        :return: number of frames sent
+        '''
+        lamps_on = set(lamps_on)
+        legacy = set() # ID bytes of the stations not known to take a bitmap
+        ids = {} # addr: ID bytes of the stations which take it
+        for addr in range(RC_ADDR + 1, lamps + 1):
+            id = self.stations.by_addr(addr)
+            if id is None:
+                continue
+            station = self.stations[id]
+            station['lamp_ctrl'] = ord(self.LampControl.BYTE_ALL_ON if addr in lamps_on
+                                       else self.LampControl.BYTE_ALL_OFF)
+            if station.get('bitmap'):
+                ids[addr] = self.stations.bin_of(id)
+            else:
+                legacy.add(self.stations.bin_of(id))
+        # the bit of RC_ADDR is set, so that the dest field of the 1st frame is never BROADCAST_ID
+        frames = chunks(make_bitmap(lamps_on | set([RC_ADDR]), lamps + 1)) if ids else []
+        unicast = set(legacy)
+        if legacy:
+            taken = legacy | set([self.LampControl.BROADCAST_ID])
+            for (bits, value) in [frame for frame in frames if frame[0] in taken]:
+                frames.remove((bits, value))
+                unicast.update(id for (addr, id) in ids.iteritems() if lamp_state(bits, value, addr) is not None)
+        logger.info('RC broadcast lamp bitmap of %d lamps in %d frames, %d STAs by unicast' %
+                    (lamps, len(frames), len(unicast)))
+        for (index, (bits, value)) in enumerate(frames):
+            if index and self.hop:
+                # let the RELAYs forward a frame before the next one, or it would meet their copies on air
+                self._clock.sleep(self._slots.cycle())
+            self._send_message(bits, self.LampControl.TAG_LAMP_BITMAP + value)
+            for (addr, id) in ids.iteritems():
+                if id not in unicast and lamp_state(bits, value, addr) is not None:
+                    station = self.stations.station(id)
+                    station['lamp_ctrl_status'] = station['lamp_ctrl']
+        for on in (True, False):
+            dest_ids = [id for id in unicast if (self.stations.station(id)['addr'] in lamps_on) is on]
+            if dest_ids:
+                self.RC_lamp_ctrl_multi(dest_ids, self.LampControl.MESG_VALUE_LAMP_ALL_ON if on
+                                        else self.LampControl.MESG_VALUE_LAMP_ALL_OFF)
+        return len(frames)
+
+    def RC_run_transactions(self, transactions):
+        '''
+        run prepared requests with up to `window` outstanding, e.g. to look at the tries and latency of each
+        :param transactions: list of Transaction
+        :return: the same list, each one is done
+        '''
+        return self._engine.run(transactions)
+
+    def RC_unicast_poll_multi(self, dest_ids, expected):
+        '''
+        poll many stations with up to `window` requests outstanding, expect TAG_POLL_ACK
+        :param dest_ids: list of station IDs
+        :param expected: expected value in POLL_ACK
+        :return: dict of dest_id: None on success, or the exception (RxTimeOut, RxNack, RxUnexpectedTag) on failure
+        '''
+        logger.info('RC send POLL to %d STAs' % len(dest_ids))
+        txns = [Transaction(dest_id, self.LampControl.MESG_POLL, self.LampControl.TAG_POLL_ACK, self._retry,
+                            expected=expected) for dest_id in dest_ids]
+        self._engine.run(txns)
+        return dict((txn.dest_id, txn.error) for txn in txns)
+
+    def RC_read_telemetry(self, dest_ids=None, fields=TELEMETRY_NAMES):
+        '''
+        read telemetry fields of many stations with up to `window` requests outstanding. a station answers in one
+        frame per 3 bytes of the fields, up to 8 frames, and a frame lost costs a try for the fields in it only.
+        the values go into the station state, and into the telemetry store if RC has one.
+        :param dest_ids: list of station IDs, None for every station
+        :param fields: names of the fields to read, see TELEMETRY_FIELDS of znldTelemetry
+        :return: dict of dest_id: dict of field name: value, without the fields not read or without a value
+        '''
+        if dest_ids is None:
+            dest_ids = self.stations.bin_ids()
+        mask = field_mask(fields)
+        logger.info('RC read %d telemetry fields of %d STAs' % (len(fields), len(dest_ids)))
+        txns = [TelemetryTransaction(dest_id, self.LampControl.TAG_TELEMETRY, self.LampControl.TAG_TELEMETRY_DATA,
+                                     mask, self._retry)
+                for dest_id in dest_ids]
+        self._engine.run(txns)
+        for txn in txns:
+            self._RC_set_telemetry(txn.dest_id, txn.values)
+        return dict((txn.dest_id, txn.values) for txn in txns)
+
+    def _RC_set_telemetry(self, dest_id, values):
+        station = self.stations.station(dest_id)
+        if station is None or not values:
+            return
+        for (name, value) in values.iteritems():
+            station[name] = value
+        addr = station.get('addr')
+        if self.telemetry is not None and addr is not None:
+            for (name, value) in values.iteritems():
+                self.telemetry.record(name, addr, value)
+
+    def RC_silent(self, max_age):
+        ''' :return: ID bytes of the stations RC hasn't heard from for max_age seconds '''
+        return self.stations.bin_ids(self.stations.where('last_seen', '<=', self._clock.monotonic() - max_age))
+
+    def RC_liveness_check(self, max_age):
+        '''
+        poll the stations RC hasn't heard from for max_age seconds, their lamp status comes with the status
+        reports and ACKs otherwise
+        :return: dict of dest_id: None on success, or the exception (RxTimeOut, RxNack) on failure
+        '''
+        dest_ids = self.RC_silent(max_age)
+        if not dest_ids:
+            return {}
+        return self.RC_unicast_poll_multi(dest_ids, None)
+
 
 
 
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import os, csv, json, binascii
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from znldFrame import ID_LEN
+
+# CSV columns taken as numbers, 'groups' is a list of numbers separated by ';' or spaces
+CSV_NUMBERS = ('addr', 'slot', 'hop')
+
+
+def config_path(config_file, path):
+    '''
+    :param config_file: node_config.json
+    :param path: a data file (station_file, group_file, telemetry_dir) of node_config
+    :return: path, next to config_file if it is relative, so that it doesn't depend on the current directory
+    '''
+    if path is None or os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(config_file)), path)
+
+
+def load_stations(path):
+    '''
+    read the station list from node_config.json (its 'stations'), a JSON file with only the stations, or a CSV
+    file with an 'id' column and the station fields in the others, e.g. id,name,addr,slot,hop,groups
+    :return: dict of station ID (lower case hex): config dict
+    :raise ValueError: on a broken file or station ID
+    '''
+    if path.lower().endswith('.csv'):
+        stations = _load_csv(path)
+    else:
+        with open(path) as f:
+            stations = json.load(f)
+        if 'stations' in stations:
+            stations = stations['stations']
+    result = {}
+    for (id, config) in stations.iteritems():
+        id = id.strip().lower()
+        try:
+            if len(binascii.a2b_hex(id)) != ID_LEN:
+                raise TypeError
+        except TypeError:
+            raise ValueError('bad station ID %s in %s' % (id, path))
+        result[str(id)] = config
+    return result
+
+
+def _load_csv(path):
+    stations = {}
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            config = {}
+            for (key, value) in row.iteritems():
+                if key is None or value is None or value.strip() == '':
+                    continue
+                key = key.strip()
+                value = value.strip()
+                if key in CSV_NUMBERS:
+                    config[key] = int(value)
+                elif key == 'groups':
+                    config[key] = [int(group) for group in value.replace(';', ' ').split()]
+                else:
+                    config[key] = value
+            if 'id' not in config:
+                raise ValueError('station without id in %s' % path)
+            stations[config.pop('id')] = config
+    return stations
+
+
+class StationFile(object):
+    """
+    the station list file of RC, reloaded while RC is running whenever it is modified
+    """
+    def __init__(self, path):
+        self.path = path
+        self._mtime = self._modified()
+        # statistics
+        self.reloads = 0
+        self.errors = 0
+
+    def _modified(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def load(self):
+        return load_stations(self.path)
+
+    def changed(self):
+        '''
+        :return: the new station list if the file was modified since the last call, else None
+        '''
+        mtime = self._modified()
+        if mtime is None or mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            stations = self.load()
+        except (IOError, ValueError) as e:
+            self.errors += 1
+            logger.error('%s is not reloaded: %s' % (self.path, e))
+            return None
+        self.reloads += 1
+        return stations
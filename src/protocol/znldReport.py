@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myClock import SYSTEM_CLOCK
+
+REPORT_SLOT = 4 # TDMA slots taken by a status report and the ACK of RC at 0 hops, 1 + 2 * hops times that beyond
+
+# TAG_STATUS value[2], the reasons of a report besides the lamp status
+REPORT_TELEMETRY = 0x01 # a measurement changed by its threshold, RC reads the telemetry
+
+
+def report_slot(key, attempt, slots):
+    '''
+    report slot of an attempt: the 1st one in the ACK slot (key % slots), every retry moves on by a step which
+    keeps the stations with their own ACK slot apart and separates two keys which share one
+    :param key: addr of the station
+    :param attempt: 0 for the 1st attempt
+    :param slots: number of report slots, the ACK slots of every station
+    '''
+    if slots <= 1:
+        return 0
+    step = 1 + (key // slots) % (slots - 1)
+    slot = (key + attempt * step) % slots
+    if attempt and slot == (key + (attempt - 1) * step) % slots:
+        slot = (slot + 1) % slots
+    return slot
+
+
+class StatusReporter(object):
+    """
+    STA side of the unsolicited status report (TAG_STATUS): a change RC doesn't learn of otherwise (a lamp status
+    RC didn't command, a measurement crossing its threshold) is sent to RC without waiting for a poll. reports are
+    rate limited to one per `interval`, the changes in between go in the next one, and a report is sent again
+    with backoff until RC ACKs its number (TAG_STATUS_ACK) or after `retry` attempts. every attempt carries the
+    status of the moment.
+    """
+    def __init__(self, send, scheduler, holdoff, interval=5.0, retry=3, timeout=5.0, clock=SYSTEM_CLOCK):
+        '''
+        :param send: send(report_no) sends the report, report_no is 1 .. 255
+        :param scheduler: TxScheduler which runs the reports and their timeouts
+        :param holdoff: holdoff(attempt) is the extra delay of an attempt (0 for the 1st one), which spreads
+                        the reports of the stations which change at once
+        :param interval: min. seconds from one report to the next one
+        :param timeout: seconds to wait for the ACK of the 1st attempt, doubled for each retry
+        '''
+        self._send = send
+        self._scheduler = scheduler
+        self._holdoff = holdoff
+        self.interval = interval
+        self.retry = retry
+        self.timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._report_no = 0
+        self._pending = None # number of the report waiting for its ACK
+        self._attempt = 0
+        self._entry = None # the scheduled attempt or ACK timeout
+        self._dirty = False # changed since the last report was sent
+        self._last_sent = None
+        # statistics
+        self.reports = 0
+        self.retries = 0
+        self.acked = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    def changed(self):
+        ''' the status changed, report it '''
+        with self._lock:
+            if self._dirty:
+                self.coalesced += 1
+            self._dirty = True
+            if self._entry is None:
+                self._schedule_next()
+
+    def ack(self, report_no):
+        ''' :return: False if report_no isn't the report waiting for its ACK '''
+        with self._lock:
+            if self._pending is None or report_no != self._pending:
+                return False
+            self._scheduler.cancel(self._entry)
+            self._entry = None
+            self._pending = None
+            self.acked += 1
+            if self._dirty:
+                self._schedule_next()
+            return True
+
+    def _schedule_next(self):
+        ''' a new report, after the holdoff and not earlier than `interval` after the last one '''
+        delay = self._holdoff(0)
+        if self._last_sent is not None:
+            delay = max(delay, self._last_sent + self.interval - self._clock.monotonic())
+        self._entry = self._scheduler.schedule(delay, self._fire, label='status report')
+
+    def _fire(self):
+        with self._lock:
+            if self._pending is None:
+                self._report_no = self._report_no % 255 + 1
+                self._pending = self._report_no
+                self._attempt = 0
+                self.reports += 1
+            else:
+                self.retries += 1
+            self._attempt += 1
+            self._dirty = False
+            self._last_sent = self._clock.monotonic()
+            report_no = self._pending
+            self._entry = self._scheduler.schedule(self.timeout * (1 << (self._attempt - 1)), self._expire,
+                                                   label='status report %d timeout' % report_no)
+        self._send(report_no)
+
+    def _expire(self):
+        with self._lock:
+            if self._attempt < self.retry:
+                logger.debug('status report %d is not ACKed, retry' % self._pending)
+                self._entry = self._scheduler.schedule(self._holdoff(self._attempt), self._fire,
+                                                       label='status report %d retry' % self._pending)
+                return
+            logger.info('status report %d is not ACKed, give up' % self._pending)
+            self.failed += 1
+            self._pending = None
+            self._entry = None
+            if self._dirty:
+                self._schedule_next()
+
+    def stats(self):
+        return dict(reports=self.reports, retries=self.retries, acked=self.acked, failed=self.failed,
+                    coalesced=self.coalesced, pending=self._pending is not None)
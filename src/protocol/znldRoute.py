@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myClock import SYSTEM_CLOCK
+
+# route stamp, the last (reserved) value byte of a unicast frame:
+#   high nibble: TDMA slot of the RELAY which transmitted this copy, 0 if it is sent by its originator
+#   low nibble: TDMA slot of the RELAY which shall forward it next, ROUTE_FLOOD if no route is known,
+#               ROUTE_ADJACENT if the destination hears the transmitter directly
+# legacy nodes always send 0 there, i.e. a frame from its originator to be flooded.
+ROUTE_FLOOD = 0
+ROUTE_ADJACENT = 0xF
+ROUTE_MAX_SLOTS = ROUTE_ADJACENT
+
+
+def pack_stamp(tx_slot, next_slot):
+    return chr((tx_slot << 4) | next_slot)
+
+
+def unpack_stamp(stamp):
+    ''' :return: (tx_slot, next_slot) '''
+    stamp = ord(stamp)
+    return (stamp >> 4, stamp & 0xF)
+
+
+class RoutingTable(object):
+    """
+    next hop towards each node, learned from the 1st copy of every frame heard from it (reverse path):
+    the copy which arrives first comes from the direction of its originator, so the RELAY which
+    transmitted it (tx slot of the stamp) is the next hop back, or the node itself if it sent it directly.
+    an entry is forgotten after ttl seconds or when a request to that node times out, and the frame
+    is flooded again until a new route is learned.
+    """
+    def __init__(self, ttl=600.0, clock=SYSTEM_CLOCK):
+        self._clock = clock
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._routes = {} # node_id -> (next slot, learned at)
+        # statistics
+        self.learned = 0
+        self.changed = 0
+        self.forgotten = 0
+
+    def learn(self, node_id, tx_slot):
+        '''
+        :param node_id: originator of a received frame
+        :param tx_slot: tx slot of its route stamp, 0 if it is heard directly
+        '''
+        next_slot = tx_slot if tx_slot != 0 else ROUTE_ADJACENT
+        with self._lock:
+            old = self._routes.get(node_id)
+            if old is None:
+                self.learned += 1
+            elif old[0] != next_slot:
+                self.changed += 1
+                logger.debug('route to %s changed from slot %d to %d' % (binascii.b2a_hex(node_id), old[0], next_slot))
+            self._routes[node_id] = (next_slot, self._clock.monotonic())
+
+    def next_hop(self, node_id):
+        '''
+        :return: slot of the next RELAY towards node_id, ROUTE_ADJACENT if it is heard directly,
+                 ROUTE_FLOOD if no route is known
+        '''
+        with self._lock:
+            route = self._routes.get(node_id)
+            if route is None:
+                return ROUTE_FLOOD
+            if self._clock.monotonic() - route[1] >= self.ttl:
+                del self._routes[node_id]
+                self.forgotten += 1
+                return ROUTE_FLOOD
+            return route[0]
+
+    def forget(self, node_id):
+        with self._lock:
+            if self._routes.pop(node_id, None) is not None:
+                self.forgotten += 1
+                logger.debug('route to %s is forgotten' % binascii.b2a_hex(node_id))
+
+    def routes(self):
+        ''' :return: dict of node hex ID: next slot (ROUTE_ADJACENT if heard directly) '''
+        with self._lock:
+            return dict((binascii.b2a_hex(node_id), route[0]) for node_id, route in self._routes.iteritems())
+
+    def stats(self):
+        with self._lock:
+            return dict(routes=len(self._routes), learned=self.learned, changed=self.changed,
+                        forgotten=self.forgotten)
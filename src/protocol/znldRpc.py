@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import json
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# RC daemon API: JSON-RPC 2.0 over a Unix stream socket, one JSON object per line. a request may carry a
+# "priority" member beside "method" and "params", lower runs earlier, the default one is by method.
+# station IDs are hex strings as in node_config.json, lamp ctrl values hex strings of their 4 bytes.
+RPC_SOCKET = '/tmp/znld-rc.sock'
+
+PRIORITY_CONTROL = 0 # lamp ctrl, someone waits for the lamps
+PRIORITY_POLL = 10
+PRIORITY_BACKGROUND = 20 # telemetry sweeps, liveness checks
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RpcError(Exception):
+    """ an error response of the RC daemon """
+    def __init__(self, code, message):
+        Exception.__init__(self, '%s (%d)' % (message, code))
+        self.code = code
+        self.message = message
+
+
+def encode(message):
+    ''' :return: one line of the stream '''
+    return json.dumps(message, separators=(',', ':')) + '\n'
+
+
+def request(id, method, params=None, priority=None):
+    message = {'jsonrpc': '2.0', 'id': id, 'method': method, 'params': params or {}}
+    if priority is not None:
+        message['priority'] = priority
+    return message
+
+
+def notification(method, params):
+    ''' a message from the daemon which isn't a response, e.g. a state change to a subscriber '''
+    return {'jsonrpc': '2.0', 'method': method, 'params': params}
+
+
+def result(id, value):
+    return {'jsonrpc': '2.0', 'id': id, 'result': value}
+
+
+def error(id, code, message):
+    return {'jsonrpc': '2.0', 'id': id, 'error': {'code': code, 'message': message}}
+
+
+class LineReader(object):
+    """ the JSON messages of a stream socket, one per line """
+    def __init__(self, sock, size=4096):
+        self._sock = sock
+        self._size = size
+        self._buffer = ''
+
+    def next(self):
+        '''
+        :return: the next message, None at the end of the stream
+        :raise ValueError: on a line which isn't JSON
+        '''
+        while '\n' not in self._buffer:
+            data = self._sock.recv(self._size)
+            if not data:
+                return None
+            self._buffer += data
+        (line, self._buffer) = self._buffer.split('\n', 1)
+        return json.loads(line)
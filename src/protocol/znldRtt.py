@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class RttEstimator(object):
+    """
+    smoothed RTT and RTT variance of one station (Jacobson/Karels), RTO = SRTT + 4 * RTTVAR.
+    the response SN tells which try it answers, so a retried request still gives a valid sample;
+    on timeout RTO is backed off exponentially (Karn) until the next valid sample.
+    """
+    ALPHA = 0.125
+    BETA = 0.25
+    K = 4
+    MAX_BACKOFF = 8
+
+    def __init__(self, initial_rto, min_rto=0.5, max_rto=60.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.backoff = 1
+        self.samples = 0
+        self.timeouts = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + self.K * self.rttvar))
+        self.backoff = 1
+        self.samples += 1
+
+    def on_timeout(self):
+        self.timeouts += 1
+        self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+
+    def timeout(self):
+        ''' :return: seconds to wait for the response of the next try '''
+        return min(self.max_rto, self.rto * self.backoff)
+
+
+class RttTable(object):
+    """RttEstimator of every station, created on first use with initial_rto(dest_id)"""
+    def __init__(self, initial_rto, min_rto=0.5, max_rto=60.0):
+        '''
+        :param initial_rto: initial_rto(dest_id) returns RTO in seconds before any sample, e.g. from the hop number
+        '''
+        self._initial_rto = initial_rto
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+        self._lock = threading.Lock()
+        self._table = {}
+
+    def get(self, dest_id):
+        with self._lock:
+            estimator = self._table.get(dest_id)
+            if estimator is None:
+                estimator = RttEstimator(self._initial_rto(dest_id), self._min_rto, self._max_rto)
+                self._table[dest_id] = estimator
+            return estimator
+
+    def timeout(self, dest_id):
+        return self.get(dest_id).timeout()
+
+    def sample(self, dest_id, rtt):
+        estimator = self.get(dest_id)
+        estimator.sample(rtt)
+        logger.debug('STA (%s) rtt=%.3f srtt=%.3f rttvar=%.3f rto=%.3f' %
+                     (binascii.b2a_hex(dest_id), rtt, estimator.srtt, estimator.rttvar, estimator.rto))
+
+    def on_timeout(self, dest_id):
+        estimator = self.get(dest_id)
+        estimator.on_timeout()
+        logger.debug('STA (%s) timeout, next rto=%.3f' % (binascii.b2a_hex(dest_id), estimator.timeout()))
+
+    def stats(self):
+        ''' :return: dict of station hex ID: dict(srtt, rttvar, rto, samples, timeouts) '''
+        with self._lock:
+            return dict((binascii.b2a_hex(dest_id), dict(srtt=e.srtt, rttvar=e.rttvar, rto=e.timeout(),
+                                                         samples=e.samples, timeouts=e.timeouts))
+                        for dest_id, e in self._table.iteritems())
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import heapq
+import itertools
+import os
+import fcntl
+import select
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myClock import SYSTEM_CLOCK
+
+
+class TxEntry(object):
+    """one queued transmission"""
+    __slots__ = ('deadline', 'callback', 'args', 'label', 'cancelled')
+
+    def __init__(self, deadline, callback, args, label):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.label = label
+        self.cancelled = False
+
+
+class TxScheduler(object):
+    """
+    delayed transmissions of a STA/RELAY, e.g. a forward in its TDMA slot, in deadline order.
+    the RX thread only queues them and goes back to reading the serial port; they are sent by the
+    scheduler thread (start()), or by a simulator calling run_due().
+    """
+    def __init__(self, clock=SYSTEM_CLOCK, on_schedule=None):
+        '''
+        :param on_schedule: on_schedule(deadline) is called for every queued entry, e.g. to wake up a simulator
+        '''
+        self._clock = clock
+        self.on_schedule = on_schedule
+        self._lock = threading.Lock()
+        self._queue = [] # heap of (deadline, seq, TxEntry)
+        self._seq = itertools.count()
+        self._thread = None
+        self._stop = False
+        self._wake_r = None
+        self._wake_w = None # written under _lock, closed under it once the thread is done
+        # statistics
+        self.sent = 0
+        self.cancelled = 0
+        self.max_lateness = 0.0 # seconds, how late the worst entry was run after its deadline
+
+    def schedule(self, delay, callback, args=(), label=None):
+        '''
+        :param delay: seconds from now, 0 to send as soon as possible
+        :param label: description shown by pending()
+        :return: TxEntry which can be cancelled
+        '''
+        entry = TxEntry(self._clock.monotonic() + max(0.0, delay), callback, args, label)
+        with self._lock:
+            heapq.heappush(self._queue, (entry.deadline, next(self._seq), entry))
+            first = self._queue[0][2] is entry
+        if first:
+            self._wake()
+        if self.on_schedule is not None:
+            self.on_schedule(entry.deadline)
+        return entry
+
+    def cancel(self, entry):
+        ''' drop a queued entry, it is skipped when its deadline comes '''
+        if not entry.cancelled:
+            entry.cancelled = True
+            self.cancelled += 1
+
+    def pending(self):
+        ''' :return: list of (seconds to deadline, label) of the queued entries, in deadline order '''
+        now = self._clock.monotonic()
+        with self._lock:
+            return [(deadline - now, entry.label) for (deadline, seq, entry) in sorted(self._queue)
+                    if not entry.cancelled]
+
+    def __len__(self):
+        return len(self._queue)
+
+    def run_due(self):
+        '''
+        run every entry whose deadline has come
+        :return: deadline of the next entry, or None if nothing is queued
+        '''
+        while True:
+            now = self._clock.monotonic()
+            with self._lock:
+                if not self._queue:
+                    return None
+                if self._queue[0][0] > now:
+                    return self._queue[0][0]
+                (deadline, seq, entry) = heapq.heappop(self._queue)
+            if entry.cancelled:
+                continue
+            self.max_lateness = max(self.max_lateness, now - deadline)
+            self.sent += 1
+            try:
+                entry.callback(*entry.args)
+            except Exception:
+                logger.exception('scheduled TX (%s) failed' % entry.label)
+
+    def _wake(self):
+        with self._lock:
+            if self._wake_w is not None:
+                try:
+                    os.write(self._wake_w, '\x00')
+                except OSError:
+                    pass
+
+    def start(self):
+        ''' send the queued entries from a thread of its own '''
+        if self._thread is not None:
+            return
+        self._stop = False
+        (wake_r, wake_w) = os.pipe()
+        # a full pipe wakes the thread anyway, a write must never block with _lock held
+        fcntl.fcntl(wake_w, fcntl.F_SETFL, fcntl.fcntl(wake_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+        with self._lock:
+            (self._wake_r, self._wake_w) = (wake_r, wake_w)
+        self._thread = threading.Thread(target=self._run, name='Thread TX scheduler')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        (wake_r, wake_w) = (self._wake_r, self._wake_w)
+        while not self._stop:
+            deadline = self.run_due()
+            timeout = None if deadline is None else max(0.0, deadline - self._clock.monotonic())
+            # select() wakes up on time, unlike the polling Condition.wait() of python 2
+            if select.select([wake_r], [], [], timeout)[0]:
+                os.read(wake_r, 64)
+        # no other thread writes the pipe once _wake_w is None, a restarted scheduler has a pipe of its own
+        with self._lock:
+            if self._wake_w == wake_w:
+                (self._wake_r, self._wake_w) = (None, None)
+            os.close(wake_r)
+            os.close(wake_w)
+
+    def stats(self):
+        return dict(queued=len(self._queue), sent=self.sent, cancelled=self.cancelled,
+                    max_lateness=self.max_lateness)
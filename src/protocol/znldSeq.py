@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myClock import SYSTEM_CLOCK
+
+SN_BITS = 8
+SN_MOD = 1 << SN_BITS
+SN_HALF = SN_MOD >> 1
+
+
+def sn_add(sn, n):
+    return (sn + n) % SN_MOD
+
+
+def sn_newer(sn, last):
+    '''
+    serial number arithmetic (RFC 1982): sn is newer than last if it is ahead by less than half of the space,
+    so the comparison keeps working across the wrap-around
+    '''
+    return 0 < (sn - last) % SN_MOD < SN_HALF
+
+
+class SeqCounter(object):
+    """
+    SN of the frames sent by RC, one flow per destination (a STA, or the broadcast ID),
+    so a station only ever sees the SNs of its own flow, which never jump ahead by half of the space.
+    """
+    def __init__(self, step=2):
+        '''
+        :param step: 2 on RC as a STA responds with request SN + 1
+        '''
+        self.step = step
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def next(self, dest_id, frames=1):
+        '''
+        :param frames: frames of the response, which come with SN + 1 .. SN + frames, the next SN is after them
+        '''
+        with self._lock:
+            sn = self._next.get(dest_id, 0)
+            self._next[dest_id] = sn_add(sn, self.step * (frames // self.step + 1))
+            return sn
+
+
+class SeqTracker(object):
+    """
+    STA/RELAY duplicate check of the received frames, with a window (the last accepted SN) per
+    (source ID, destination ID) flow. a window which saw nothing for ttl seconds is stale and the next SN
+    is taken whatever it is, e.g. after RC restarts; an SN reset frame of a source restarts all its flows.
+    an old SN which comes resync_after seconds or more after the last one taken is no copy of a frame taken,
+    those come within a couple of slot cycles: the source went on by half of the SN space or more meanwhile,
+    e.g. while the STA was powered off, and the window is resynced to it.
+    """
+    def __init__(self, ttl=600.0, resync_after=None, clock=SYSTEM_CLOCK):
+        '''
+        :param resync_after: seconds after which an old SN resyncs the window, None to wait for ttl
+        '''
+        self.ttl = ttl
+        self.resync_after = resync_after
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._windows = {} # (src_id, dest_id) -> (last SN, last seen)
+        # statistics
+        self.accepted = 0
+        self.duplicates = 0
+        self.expired = 0
+        self.resets = 0
+        self.resyncs = 0
+
+    def accept(self, src_id, dest_id, sn):
+        '''
+        :return: True if sn is new in the flow (and it becomes the last one), False on a duplicate or old frame
+        '''
+        now = self._clock.monotonic()
+        key = (src_id, dest_id)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and now - window[1] >= self.ttl:
+                self.expired += 1
+                window = None
+            if window is not None and not sn_newer(sn, window[0]):
+                if self.resync_after is None or now - window[1] < self.resync_after:
+                    self.duplicates += 1
+                    return False
+                logger.debug('SN flow of %s is resynced, %d after %d' % (binascii.b2a_hex(src_id), sn, window[0]))
+                self.resyncs += 1
+            self._windows[key] = (sn, now)
+            self.accepted += 1
+            return True
+
+    def reset(self, src_id, dest_id, sn):
+        ''' restart every flow of src_id, the SN reset frame itself is the first one of (src_id, dest_id) '''
+        now = self._clock.monotonic()
+        with self._lock:
+            for key in [key for key in self._windows if key[0] == src_id]:
+                del self._windows[key]
+            self._windows[(src_id, dest_id)] = (sn, now)
+            self.resets += 1
+        logger.debug('SN flows of %s are reset' % binascii.b2a_hex(src_id))
+
+    def stats(self):
+        with self._lock:
+            return dict(flows=len(self._windows), accepted=self.accepted, duplicates=self.duplicates,
+                        expired=self.expired, resets=self.resets, resyncs=self.resyncs)
@@ -0,0 +1,450 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import os
+import mmap
+import time
+import bisect
+import struct
+import itertools
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# telemetry of the stations recorded over time, one directory with 3 files per metric:
+#   <metric>.raw  every sample: time (s), station addr, value
+#   <metric>.1m   minute rollup: bucket start (s), station addr, count, min, max, sum
+#   <metric>.1h   hour rollup, the same records as the minute one
+# a file is a header and fixed size records, appended in time order and read through mmap.
+METRICS = ('voltage', 'current', 'power', 'energy', 'power_factor', 'co2', 'board_temperature', 'freq',
+           'pm2_5', 'pm10', 'temperature', 'humidity')
+
+MAGIC = 'ZTS1'
+HEADER = struct.Struct('<4sHI') # magic, record size, number of records
+HEADER_SIZE = 16
+RAW = struct.Struct('<IHf')
+ROLLUP = struct.Struct('<IHHffd')
+if numpy is not None:
+    RAW_DTYPE = numpy.dtype([('t', '<u4'), ('addr', '<u2'), ('value', '<f4')])
+    ROLLUP_DTYPE = numpy.dtype([('t', '<u4'), ('addr', '<u2'), ('count', '<u2'), ('min', '<f4'), ('max', '<f4'),
+                                ('sum', '<f8')])
+else:
+    RAW_DTYPE = ROLLUP_DTYPE = None
+
+# (suffix, bucket seconds, default retention seconds), 0 is the raw samples
+LEVELS = (('raw', 0, 2 * 86400), ('1m', 60, 14 * 86400), ('1h', 3600, 400 * 86400))
+MAX_COUNT = 0xFFFF
+
+
+class SeriesFile(object):
+    """
+    a file of fixed size records in time order (the 1st field of a record is its time in seconds), mapped into
+    memory. it grows by `grow` records at a time, and the number of records in the header is only written by
+    commit(), so a crash loses the records appended since the last commit and nothing else.
+    """
+    def __init__(self, path, record, dtype=None, grow=4096):
+        '''
+        :param record: struct.Struct of a record
+        :param dtype: numpy dtype of a record, None without numpy
+        '''
+        self.path = path
+        self.record = record
+        self.dtype = dtype
+        self.grow = grow
+        self._file = None
+        self._map = None
+        self.count = 0
+        self._open()
+
+    def _open(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER_SIZE
+        self._file = open(self.path, 'wb+' if new else 'rb+')
+        if new:
+            self._file.write(HEADER.pack(MAGIC, self.record.size, 0).ljust(HEADER_SIZE, '\0'))
+            self._file.truncate(HEADER_SIZE + self.grow * self.record.size)
+            self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        (magic, size, count) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or size != self.record.size:
+            self.close()
+            raise ValueError('%s is not a time series of %d byte records' % (self.path, self.record.size))
+        self.count = min(count, self.capacity())
+
+    def capacity(self):
+        return (len(self._map) - HEADER_SIZE) // self.record.size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _reserve(self, n):
+        if self.count + n <= self.capacity():
+            return
+        records = self.count + n + self.grow
+        self._map.close()
+        self._file.truncate(HEADER_SIZE + records * self.record.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def append(self, records):
+        ''' :param records: tuples of the record fields, not older than the last record '''
+        self._reserve(len(records))
+        pack_into = self.record.pack_into
+        offset = HEADER_SIZE + self.count * self.record.size
+        for record in records:
+            pack_into(self._map, offset, *record)
+            offset += self.record.size
+        self.count += len(records)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.record.unpack_from(self._map, HEADER_SIZE + index * self.record.size)
+
+    def __setitem__(self, index, record):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        self.record.pack_into(self._map, HEADER_SIZE + index * self.record.size, *record)
+
+    def time(self, index):
+        return struct.unpack_from('<I', self._map, HEADER_SIZE + index * self.record.size)[0]
+
+    def last_time(self):
+        return self.time(self.count - 1) if self.count else 0
+
+    def commit(self):
+        ''' make the records appended or changed so far durable '''
+        HEADER.pack_into(self._map, 0, MAGIC, self.record.size, self.count)
+        self._map.flush()
+
+    def find(self, t):
+        ''' :return: index of the 1st record not older than t '''
+        return bisect.bisect_left(_Times(self), t)
+
+    def blocks(self, start, stop, size=4096):
+        ''' :return: iterator of the records start .. stop-1 in blocks of `size`, each one a tuple per field '''
+        fields = len(self.record.format.lstrip('<'))
+        for first in xrange(start, stop, size):
+            n = min(size, stop - first)
+            values = struct.unpack_from('<' + self.record.format.lstrip('<') * n, self._map,
+                                        HEADER_SIZE + first * self.record.size)
+            yield [values[field::fields] for field in range(fields)]
+
+    def array(self, start=0, stop=None):
+        ''' :return: numpy array of records start .. stop-1 sharing the memory of the file, copy it to keep it '''
+        stop = self.count if stop is None else stop
+        return numpy.frombuffer(self._map, dtype=self.dtype, count=stop - start,
+                                offset=HEADER_SIZE + start * self.record.size)
+
+    def compact(self, t):
+        '''
+        drop the records older than t: the newer ones are written to a new file which then takes the place of this
+        one, so a crash in between leaves either the old or the new file
+        :return: number of records dropped
+        '''
+        start = self.find(t)
+        if start == 0:
+            return 0
+        size = self.record.size
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, size, self.count - start).ljust(HEADER_SIZE, '\0'))
+            f.write(self._map[HEADER_SIZE + start * size:HEADER_SIZE + self.count * size])
+            f.truncate(HEADER_SIZE + (self.count - start + self.grow) * size)
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.rename(temp, self.path)
+        self._open()
+        return start
+
+
+class _Times(object):
+    ''' record times of a SeriesFile as a sequence, for bisect '''
+    def __init__(self, series):
+        self._series = series
+
+    def __len__(self):
+        return len(self._series)
+
+    def __getitem__(self, index):
+        return self._series.time(index)
+
+
+class Rollup(object):
+    """
+    a rollup file, one record per station and bucket: the record of the current bucket of a station is updated
+    in place while its samples come in
+    """
+    def __init__(self, path, seconds, grow=4096):
+        self.seconds = seconds
+        self.series = SeriesFile(path, ROLLUP, ROLLUP_DTYPE, grow)
+        self._open = {}
+        self._load_open()
+
+    def _load_open(self):
+        ''' addr: (bucket, record index) of the last bucket, so it keeps being updated after a restart '''
+        self._open = {}
+        series = self.series
+        if not len(series):
+            return
+        bucket = series.last_time()
+        for index in xrange(series.find(bucket), len(series)):
+            self._open[series[index][1]] = (bucket, index)
+
+    def add(self, buckets):
+        ''' :param buckets: list of (bucket, addr, count, min, max, sum) in bucket order '''
+        new = []
+        for (bucket, addr, count, low, high, total) in buckets:
+            last = self._open.get(addr)
+            if last is not None and last[0] == bucket:
+                (t, addr, old_count, old_low, old_high, old_total) = self.series[last[1]]
+                if old_count + count <= MAX_COUNT:
+                    self.series[last[1]] = (bucket, addr, old_count + count, min(low, old_low),
+                                            max(high, old_high), old_total + total)
+                    continue
+            self._open[addr] = (bucket, len(self.series) + len(new))
+            new.append((bucket, addr, count, low, high, total))
+        if new:
+            self.series.append(new)
+
+    def compact(self, t):
+        dropped = self.series.compact(t - t % self.seconds)
+        if dropped:
+            self._load_open()
+        return dropped
+
+
+class TelemetryStore(object):
+    """
+    telemetry of the stations (voltage, power, pm2_5, ...) kept over time on disk: an append-only log of the
+    samples of every metric, and its minute and hour rollups for queries over days and weeks.
+    samples are taken in memory and written in batches, by flush() or when `batch` of them are waiting or the
+    oldest waited `flush_interval` seconds. compact() drops what is older than the retention of each file.
+    sample times are wall clock seconds and never go backwards in a file: a sample older than the last one
+    written (e.g. after the clock was set back) takes the time of the last one.
+    """
+    def __init__(self, path, metrics=METRICS, batch=1024, flush_interval=60.0, retention=None, grow=4096):
+        '''
+        :param path: directory of the files, created if missing
+        :param retention: dict of 'raw', '1m' or '1h': seconds to keep, the defaults of LEVELS for the others
+        '''
+        self.path = path
+        self.metrics = tuple(metrics)
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.retention = dict((name, keep) for (name, seconds, keep) in LEVELS)
+        self.retention.update(retention or {})
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock = threading.RLock()
+        self._raw = {}
+        self._rollups = {}
+        for metric in self.metrics:
+            self._raw[metric] = SeriesFile(os.path.join(path, metric + '.raw'), RAW, RAW_DTYPE, grow)
+            self._rollups[metric] = [(name, Rollup(os.path.join(path, '%s.%s' % (metric, name)), seconds, grow))
+                                     for (name, seconds, keep) in LEVELS if seconds]
+        self._pending = []
+        self._oldest = None # when the oldest pending sample was taken in
+        # statistics
+        self.samples = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for metric in self.metrics:
+                self._raw[metric].close()
+                for (name, rollup) in self._rollups[metric]:
+                    rollup.series.close()
+
+    def record(self, metric, addr, value, t=None):
+        '''
+        take a sample in, it is written with the next batch
+        :param addr: addr of the station
+        :param t: time of the sample, now by default
+        '''
+        if metric not in self._raw:
+            raise KeyError('%s is not a telemetry metric' % metric)
+        with self._lock:
+            self._pending.append((metric, int(time.time() if t is None else t), addr, value))
+            if self._oldest is None:
+                self._oldest = time.time()
+            if len(self._pending) >= self.batch:
+                self.flush()
+
+    def due(self):
+        ''' :return: True if the pending samples are to be written '''
+        with self._lock:
+            return self._oldest is not None and time.time() - self._oldest >= self.flush_interval
+
+    def flush(self):
+        ''' write the pending samples '''
+        with self._lock:
+            pending, self._pending, self._oldest = self._pending, [], None
+            if not pending:
+                return
+            by_metric = {}
+            for (metric, t, addr, value) in pending:
+                by_metric.setdefault(metric, []).append((t, addr, value))
+            for (metric, samples) in by_metric.iteritems():
+                self._write(metric, samples)
+            self.samples += len(pending)
+            self.flushes += 1
+
+    def _write(self, metric, samples):
+        raw = self._raw[metric]
+        samples.sort()
+        last = raw.last_time()
+        samples = [(max(t, last), addr, value) for (t, addr, value) in samples]
+        raw.append(samples)
+        for (name, rollup) in self._rollups[metric]:
+            buckets = {}
+            order = []
+            for (t, addr, value) in samples:
+                key = (t - t % rollup.seconds, addr)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = [1, value, value, value]
+                    order.append(key)
+                else:
+                    bucket[0] += 1
+                    bucket[1] = min(bucket[1], value)
+                    bucket[2] = max(bucket[2], value)
+                    bucket[3] += value
+            rollup.add([(key[0], key[1], min(buckets[key][0], MAX_COUNT)) + tuple(buckets[key][1:])
+                        for key in order])
+            rollup.series.commit()
+        raw.commit()
+
+    def compact(self, now=None):
+        '''
+        drop the samples and rollups older than their retention
+        :return: number of records dropped
+        '''
+        now = time.time() if now is None else now
+        dropped = 0
+        with self._lock:
+            self.flush()
+            for metric in self.metrics:
+                dropped += self._raw[metric].compact(int(now - self.retention['raw']))
+                for (name, rollup) in self._rollups[metric]:
+                    dropped += rollup.compact(int(now - self.retention[name]))
+        self.dropped += dropped
+        if dropped:
+            logger.info('%d telemetry records older than their retention are dropped' % dropped)
+        return dropped
+
+    def resolution(self, start, stop, now=None):
+        '''
+        :return: the finest level ('raw', '1m' or '1h') which still has the data from start and takes
+                 no more than some hundred records per station for start .. stop
+        '''
+        now = time.time() if now is None else now
+        for (name, seconds, keep) in LEVELS:
+            if start >= now - self.retention[name] and (stop - start) <= max(seconds, 10) * 720:
+                return name
+        return LEVELS[-1][0]
+
+    def query(self, metric, start, stop, addr=None, step=None, resolution=None):
+        '''
+        the samples of a metric from start up to (not including) stop, in steps
+        :param addr: addr of a station, None for every station together
+        :param step: seconds of a step, the seconds of the resolution by default. steps start at multiples of
+                     `step`, and a rollup bucket is taken whole when start is in it
+        :param resolution: 'raw', '1m' or '1h', see resolution() by default
+        :return: list of (step start, count, min, max, mean)
+        '''
+        start, stop = int(start), int(stop)
+        with self._lock:
+            self.flush()
+            resolution = resolution or self.resolution(start, stop)
+            if resolution == 'raw':
+                series = self._raw[metric]
+                step = step or 1
+            else:
+                rollup = dict(self._rollups[metric])[resolution]
+                series = rollup.series
+                step = step or rollup.seconds
+                start -= start % rollup.seconds
+            (first, last) = (series.find(start), series.find(stop))
+            if numpy is not None:
+                return self._query_numpy(series, first, last, addr, step, resolution == 'raw')
+            return self._query(series, first, last, addr, step, resolution == 'raw')
+
+    @staticmethod
+    def _query(series, first, last, addr, step, raw):
+        steps = []
+        current = None
+        for columns in series.blocks(first, last):
+            if raw:
+                (times, addrs, values) = columns
+                rows = itertools.izip(times, itertools.repeat(1), values, values, values)
+            else:
+                rows = itertools.izip(columns[0], *columns[2:])
+                addrs = columns[1]
+            if addr is not None:
+                rows = itertools.compress(rows, [a == addr for a in addrs])
+            for (t, count, low, high, total) in rows:
+                t -= t % step
+                if current is None or current[0] != t:
+                    current = [t, count, low, high, total]
+                    steps.append(current)
+                else:
+                    current[1] += count
+                    current[2] = min(current[2], low)
+                    current[3] = max(current[3], high)
+                    current[4] += total
+        return [(t, count, low, high, total / count) for (t, count, low, high, total) in steps]
+
+    @staticmethod
+    def _query_numpy(series, first, last, addr, step, raw):
+        records = series.array(first, last)
+        if addr is not None:
+            records = records[records['addr'] == addr]
+        if not len(records):
+            return []
+        t = records['t'].astype('i8')
+        t -= t % step
+        (starts, index) = numpy.unique(t, return_index=True)
+        if raw:
+            value = records['value'].astype('f8')
+            (count, low, high, total) = (numpy.diff(numpy.append(index, len(t))), value, value, value)
+        else:
+            count = numpy.add.reduceat(records['count'].astype('i8'), index)
+            (low, high, total) = (records['min'], records['max'], records['sum'])
+        low = numpy.minimum.reduceat(low, index)
+        high = numpy.maximum.reduceat(high, index)
+        total = numpy.add.reduceat(total, index)
+        return zip(starts.tolist(), count.tolist(), low.tolist(), high.tolist(), (total / count).tolist())
+
+    def summary(self, metric, start, stop, addr=None):
+        ''' :return: (count, min, max, mean) of a metric from start to stop, None without samples '''
+        steps = self.query(metric, start, stop, addr=addr)
+        if not steps:
+            return None
+        count = sum(step[1] for step in steps)
+        return (count, min(step[2] for step in steps), max(step[3] for step in steps),
+                sum(step[1] * step[4] for step in steps) / count)
+
+    def stats(self):
+        with self._lock:
+            records = dict((metric, len(self._raw[metric])) for metric in self.metrics)
+            return dict(samples=self.samples, flushes=self.flushes, dropped=self.dropped,
+                        pending=len(self._pending), records=records)
@@ -0,0 +1,372 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import heapq
+import itertools
+import random
+import struct
+import sys
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from znldProtocol import Protocol
+from znldFrame import Frame
+
+
+class SimTimeUp(Exception):
+    ''' raised in the driver when the simulation reaches its end time '''
+    pass
+
+
+class Simulator(object):
+    """
+    discrete-event simulator on virtual time. STA/RELAY nodes only react to received frames and are run
+    by the event loop directly. the RC is driven by a driver function in its own thread, which hands over
+    to the event loop whenever it sleeps or waits (see SimClock), so only one of them runs at any time.
+    """
+    def __init__(self, seed=None):
+        self.now = 0.0
+        self.random = random.Random(seed)
+        self.events = 0 # events run so far
+        self._queue = [] # heap of (time, seq, callback, args)
+        self._seq = itertools.count()
+        self._until = None
+        self._driver = None
+        self._blocked = None # (deadline, predicate) of the waiting driver, None when it returned
+        self._time_up = False
+        self._error = None
+        self._sim_turn = threading.Event()
+        self._driver_turn = threading.Event()
+
+    def schedule(self, at, callback, *args):
+        heapq.heappush(self._queue, (at, next(self._seq), callback, args))
+
+    def in_driver(self):
+        return self._driver is not None and threading.current_thread() is self._driver
+
+    def block(self, deadline, predicate=None):
+        '''
+        called by the driver thread: run the event loop until predicate() is true or the deadline
+        :param deadline: virtual time, None for no deadline
+        '''
+        if self._time_up:
+            raise SimTimeUp
+        self._blocked = (deadline, predicate)
+        self._driver_turn.clear()
+        self._sim_turn.set()
+        self._driver_turn.wait()
+        if self._time_up:
+            raise SimTimeUp
+
+    def sleep(self, seconds):
+        ''' sleep in the driver for `seconds` of virtual time '''
+        self.block(self.now + seconds)
+
+    def _advance(self, deadline, predicate=None):
+        '''
+        :return: True when predicate() is true or deadline is reached, False if the end time is reached
+                 or nothing is left to happen
+        '''
+        while predicate is None or not predicate():
+            if self._queue and (deadline is None or self._queue[0][0] < deadline):
+                (at, seq, callback, args) = self._queue[0]
+                if self._until is not None and at > self._until:
+                    self.now = self._until
+                    return False
+                heapq.heappop(self._queue)
+                self.now = max(self.now, at)
+                callback(*args)
+                self.events += 1
+            elif deadline is not None:
+                if self._until is not None and deadline > self._until:
+                    self.now = self._until
+                    return False
+                self.now = max(self.now, deadline)
+                return True
+            else:
+                return False
+        return True
+
+    def _drive(self, driver):
+        try:
+            driver()
+        except SimTimeUp:
+            logger.debug('driver stopped at %.3f' % self.now)
+        except:
+            self._error = sys.exc_info()
+        finally:
+            self._blocked = None
+            self._sim_turn.set()
+
+    def run(self, driver=None, until=None):
+        '''
+        :param driver: driver() is run in its own thread on virtual time, e.g. RC requests
+        :param until: virtual time to stop at, None to run until the driver returns (or no event is left)
+        '''
+        self._until = until
+        if driver is None:
+            self._advance(until)
+            return
+        self._time_up = False
+        self._error = None
+        self._sim_turn.clear()
+        self._driver = threading.Thread(target=self._drive, args=(driver,), name='Thread simulation driver')
+        self._driver.setDaemon(True)
+        self._driver.start()
+        while True:
+            self._sim_turn.wait()
+            self._sim_turn.clear()
+            if self._blocked is None:
+                break
+            (deadline, predicate) = self._blocked
+            if not self._advance(deadline, predicate):
+                self._time_up = True
+            self._driver_turn.set()
+        self._driver.join()
+        self._driver = None
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+
+class SimClock(object):
+    """
+    virtual clock of one node. sleep() in a frame handler moves the node's own time ahead, the node
+    can't receive meanwhile (frames wait for it like in the serial buffer); sleep() and wait() in the
+    driver hand over to the event loop.
+    """
+    def __init__(self, sim):
+        self._sim = sim
+        self.t = 0.0 # node time, ahead of sim.now while its handler sleeps
+
+    def monotonic(self):
+        return max(self.t, self._sim.now)
+
+    def sleep(self, seconds):
+        if self._sim.in_driver():
+            self._sim.block(self._sim.now + seconds)
+        else:
+            self.t = self.monotonic() + max(0.0, seconds)
+
+    def wait(self, event, timeout=None):
+        if event.isSet() or not self._sim.in_driver():
+            return event.isSet()
+        self._sim.block(None if timeout is None else self._sim.now + timeout, event.isSet)
+        return event.isSet()
+
+
+class _Reception(object):
+    __slots__ = ('frame', 'end', 'corrupted')
+
+    def __init__(self, frame, end):
+        self.frame = frame
+        self.end = end
+        self.corrupted = False
+
+
+class SimPort(object):
+    """simulated E32 of one node, it is the Protocol transport"""
+    def __init__(self, medium, clock, baudrate_air=1200):
+        self.medium = medium
+        self.clock = clock
+        self.baudrate_air = baudrate_air
+        self.protocol = None
+        self.links = [] # [peer SimPort, loss probability]
+        self.tx_until = 0.0 # half duplex: nothing is received while transmitting
+        self.tx_free = 0.0 # frames queued in the E32 go on air one after another
+        self.rx_until = 0.0
+        self.rx_last = None # the reception which ends last
+        self.tx_cnt = 0
+        self.rx_cnt = 0
+
+    def transmit(self, frame):
+        self.medium.transmit(self, frame, self.clock.monotonic())
+
+    def cancel(self):
+        pass
+
+    def accepts(self, frame):
+        '''
+        a STA drops frames addressed to others without any side effect, so they aren't delivered to it
+        (they still take its air time)
+        :param frame: Frame
+        '''
+        return self.protocol.accepts(frame)
+
+    def deliver(self, frame):
+        ''' :param frame: Frame '''
+        sim = self.medium.sim
+        if self.clock.t > sim.now:
+            # still busy in the handler of an earlier frame
+            sim.schedule(self.clock.t, self.deliver, frame)
+            return
+        self.clock.t = sim.now
+        self.rx_cnt += len(frame.raw)
+        self.protocol.process_frame(frame)
+
+
+class SimMedium(object):
+    """
+    radio channel shared by the nodes: a frame takes len * 10 / air baudrate on air after the E32 delay
+    (and after the frames queued before it),
+    it reaches the linked nodes unless it is lost on the link or overlaps another frame at the receiver.
+    """
+    def __init__(self, sim, tx_delay=0.05, loss=0.0):
+        '''
+        :param tx_delay: seconds from the serial TX to the start of the frame on air
+        :param loss: default loss probability of a link
+        '''
+        self.sim = sim
+        self.tx_delay = tx_delay
+        self.loss = loss
+        # statistics
+        self.frames = 0
+        self.bytes = 0
+        self.airtime = 0.0
+        self.delivered = 0
+        self.collisions = 0
+        self.lost = 0
+
+    def link(self, a, b, loss=None):
+        ''' both way link between SimPort a and b '''
+        if loss is None:
+            loss = self.loss
+        a.links.append([b, loss])
+        b.links.append([a, loss])
+
+    def transmit(self, port, frame, at):
+        start = max(at + self.tx_delay, port.tx_free)
+        port.tx_free = start + len(frame) * 10.0 / port.baudrate_air
+        self.sim.schedule(start, self._tx_start, port, frame)
+
+    def _tx_start(self, port, frame):
+        start = self.sim.now
+        end = start + len(frame) * 10.0 / port.baudrate_air
+        self.frames += 1
+        self.bytes += len(frame)
+        self.airtime += end - start
+        port.tx_cnt += len(frame)
+        if port.rx_until > start and port.rx_last is not None:
+            port.rx_last.corrupted = True
+        port.tx_until = max(port.tx_until, end)
+        # decoded once, every receiver gets the same Frame
+        frame = Frame.decode(frame)
+        for (peer, loss) in port.links:
+            rx = _Reception(frame, end)
+            if peer.rx_until > start:
+                # overlaps the frame being received
+                rx.corrupted = True
+                peer.rx_last.corrupted = True
+            elif peer.tx_until > start:
+                rx.corrupted = True
+            if end >= peer.rx_until:
+                peer.rx_until = end
+                peer.rx_last = rx
+            if peer.accepts(frame):
+                self.sim.schedule(end, self._rx_end, peer, rx, loss)
+
+    def _rx_end(self, peer, rx, loss):
+        if rx.corrupted:
+            self.collisions += 1
+        elif loss and self.sim.random.random() < loss:
+            self.lost += 1
+        else:
+            self.delivered += 1
+            peer.deliver(rx.frame)
+
+    def stats(self):
+        return dict(frames=self.frames, bytes=self.bytes, airtime=self.airtime, delivered=self.delivered,
+                    collisions=self.collisions, lost=self.lost)
+
+
+def node_id(n):
+    return '\x00\x00' + struct.pack('>I', n)
+
+
+class SimNetwork(object):
+    """
+    RC, RELAYs and STAs in hop levels 0 .. hops: the nodes of a level hear each other, the RELAYs of
+    level k also hear level k + 1, and only level 0 hears the RC, so a STA of level k is k hops away.
+    """
+    def __init__(self, stations=16, hops=1, relays=1, loss=0.0, tx_delay=0.05, baudrate_air=1200, seed=None,
+                 **kwargs):
+        '''
+        :param stations: number of STAs, spread evenly over the levels
+        :param hops: number of relay hops to the farthest level
+        :param relays: RELAYs per level 0 .. hops-1
+        :param loss: loss probability of every link
+        :param kwargs: Protocol parameters of every node, e.g. retry, window, slots, e32_delay, timeout
+        '''
+        self.sim = Simulator(seed)
+        self.medium = SimMedium(self.sim, tx_delay=tx_delay, loss=loss)
+        self.baudrate_air = baudrate_air
+        self.levels = [[] for level in range(hops + 1)]
+        self.sta_ids = []
+        self.relay_ids = []
+        slots = kwargs.get('slots', 8)
+        config = {}
+        n = 2
+        for level in range(hops):
+            for index in range(relays):
+                id = node_id(n)
+                slot = 1 + (level * relays + index) % (slots - 1)
+                self._add('RELAY', id, level, slot=slot, addr=n, **kwargs)
+                self.relay_ids.append(id)
+                config[binascii.b2a_hex(id)] = dict(name='RELAY_%d' % n, addr=n, hop=level)
+                n += 1
+        for index in range(stations):
+            id = node_id(n)
+            level = index % (hops + 1)
+            self._add('STA', id, level, addr=n, **kwargs)
+            self.sta_ids.append(id)
+            config[binascii.b2a_hex(id)] = dict(name='STA_%d' % n, addr=n, hop=level)
+            n += 1
+        self.rc = self._add('RC', node_id(1), None, hop=hops, stations=config, **kwargs)
+        self._link(hops)
+
+    def _add(self, role, id, level, **kwargs):
+        clock = SimClock(self.sim)
+        port = SimPort(self.medium, clock, self.baudrate_air)
+        protocol = Protocol(id=id, role=role, transport=port, clock=clock, stations=kwargs.pop('stations', None),
+                            **kwargs)
+        port.protocol = protocol
+        # queued transmissions are run by the event loop instead of the scheduler thread
+        scheduler = protocol._tx_scheduler
+        scheduler.on_schedule = lambda deadline: self.sim.schedule(deadline, scheduler.run_due)
+        if level is not None:
+            self.levels[level].append(port)
+        else:
+            self.rc_port = port
+        return protocol
+
+    def _link(self, hops):
+        for port in self.levels[0]:
+            self.medium.link(self.rc_port, port)
+        for level in range(hops + 1):
+            ports = self.levels[level]
+            for i in range(len(ports)):
+                for j in range(i + 1, len(ports)):
+                    self.medium.link(ports[i], ports[j])
+            if level < hops:
+                for port in ports:
+                    if port.protocol._role == 'RELAY':
+                        for peer in self.levels[level + 1]:
+                            self.medium.link(port, peer)
+
+    def run(self, driver, until=None):
+        '''
+        :param driver: driver(rc) issues RC requests, the RC startup frame is sent before it
+        :param until: virtual seconds to stop at
+        '''
+        def drive():
+            self.rc._startup()
+            driver(self.rc)
+        self.sim.run(drive, until)
+
+    def sleep(self, seconds):
+        self.sim.sleep(seconds)
@@ -0,0 +1,329 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import array
+import binascii
+import itertools
+import operator
+import threading
+from collections import MutableMapping
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# state of every station kept by RC, one typed column per field
+#   control data: lamp_ctrl, lamp_adj1, lamp_adj2
+#   status data: lamp_ctrl_status,  lamp_adj1_status, lamp_adj2_status
+#   electric data: voltage, current, power, energy, power_factor, co2, board_temperature, freq
+#   environment data: pm2_5, pm10, temperature, humidity
+#   last_seen: when RC last heard from the station, -inf if never
+STATE_FIELDS = (('lamp_ctrl', 'i', 0), ('lamp_adj1', 'i', 0), ('lamp_adj2', 'i', 0),
+                ('lamp_ctrl_status', 'i', 0), ('lamp_adj1_status', 'i', 0), ('lamp_adj2_status', 'i', 0),
+                ('voltage', 'd', 0.0), ('current', 'd', 0.0), ('power', 'd', 0.0), ('energy', 'd', 0.0),
+                ('power_factor', 'd', 0.0), ('co2', 'd', 0.0), ('board_temperature', 'd', 0.0), ('freq', 'd', 0.0),
+                ('pm2_5', 'd', 0.0), ('pm10', 'd', 0.0), ('temperature', 'd', 0.0), ('humidity', 'd', 0.0),
+                ('last_seen', 'd', float('-inf')))
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt,
+             '>=': operator.ge}
+
+
+class StationView(MutableMapping):
+    """
+    one station of a StationStore as a dict: the state fields are in the columns of the store,
+    the node_config.json fields (name, addr, slot, groups ...) in the config dict of the station.
+    """
+    def __init__(self, store, id):
+        self._store = store
+        self._id = id
+
+    def __getitem__(self, key):
+        return self._store._get(self._id, key)
+
+    def __setitem__(self, key, value):
+        self._store._set(self._id, key, value)
+
+    def __delitem__(self, key):
+        self._store._delete(self._id, key)
+
+    def __iter__(self):
+        return iter(self._store._keys(self._id))
+
+    def __len__(self):
+        return len(self._store._keys(self._id))
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+
+class StationStore(MutableMapping):
+    """
+    station state of RC in typed columns (array.array, numpy arrays on top of them if numpy is there) instead of
+    a dict per station, indexed by station ID (hex string, as in node_config.json), by ID bytes (as in the frames),
+    by addr and by name.
+    store[id] is a StationView, so the code written for the dict of dicts keeps working, while the queries over
+    every station, e.g. where() and total(), run over the columns.
+    """
+    def __init__(self, stations=None):
+        '''
+        :param stations: dict of station ID: config dict, e.g. 'stations' of node_config.json
+        '''
+        self._lock = threading.RLock()
+        self._columns = dict((name, array.array(typecode)) for (name, typecode, default) in STATE_FIELDS)
+        self._defaults = dict((name, default) for (name, typecode, default) in STATE_FIELDS)
+        self._ids = [] # row -> station ID
+        self._rows = {} # station ID -> row
+        self._config = [] # row -> config dict
+        self._bins = {} # ID bytes -> station ID
+        self._bin_ids = {} # station ID -> ID bytes
+        self._addrs = {} # addr -> station ID
+        self._names = {} # name -> station ID
+        self.on_change = None # on_change(station ID, state field, value) is called when a state field changes
+        for (id, config) in (stations or {}).iteritems():
+            self[id] = config
+
+    # dict of stations
+    def __getitem__(self, id):
+        if id not in self._rows:
+            raise KeyError(id)
+        return StationView(self, id)
+
+    def __setitem__(self, id, config):
+        '''
+        add a station, or replace its config and state, with the state fields given in config
+        :raise ValueError: when the addr or the name is another station's
+        '''
+        config = dict(config)
+        state = dict((name, config.pop(name)) for name in self._columns.keys() if name in config)
+        with self._lock:
+            self._check(id, config)
+            row = self._rows.get(id)
+            if row is None:
+                row = len(self._ids)
+                self._ids.append(id)
+                self._rows[id] = row
+                self._bin_ids[id] = binascii.a2b_hex(id)
+                self._bins[self._bin_ids[id]] = id
+                self._config.append(config)
+                for (name, column) in self._columns.iteritems():
+                    column.append(self._defaults[name])
+            else:
+                self._unindex(row)
+                self._config[row] = config
+                for (name, column) in self._columns.iteritems():
+                    column[row] = self._defaults[name]
+            self._index(row)
+            for (name, value) in state.iteritems():
+                self._columns[name][row] = value
+
+    def __delitem__(self, id):
+        ''' the last row takes the place of the deleted one '''
+        with self._lock:
+            row = self._rows.pop(id)
+            self._unindex(row)
+            del self._bins[self._bin_ids.pop(id)]
+            last = len(self._ids) - 1
+            if row != last:
+                self._ids[row] = self._ids[last]
+                self._rows[self._ids[row]] = row
+                self._config[row] = self._config[last]
+                for column in self._columns.itervalues():
+                    column[row] = column[last]
+            self._ids.pop()
+            self._config.pop()
+            for column in self._columns.itervalues():
+                column.pop()
+
+    def __iter__(self):
+        return iter(list(self._ids))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, id):
+        return id in self._rows
+
+    def __repr__(self):
+        return repr(dict((id, dict(self[id].iteritems())) for id in self._ids))
+
+    def _check(self, id, config):
+        ''' :raise ValueError: when the addr or the name in config is another station's '''
+        for (key, index) in (('addr', self._addrs), ('name', self._names)):
+            if key in config and index.get(config[key], id) != id:
+                raise ValueError('%s %s of station %s is the one of station %s'
+                                 % (key, config[key], id, index[config[key]]))
+
+    def _index(self, row):
+        config = self._config[row]
+        if 'addr' in config:
+            self._addrs[config['addr']] = self._ids[row]
+        if 'name' in config:
+            self._names[config['name']] = self._ids[row]
+
+    def _unindex(self, row):
+        config = self._config[row]
+        for (key, index) in (('addr', self._addrs), ('name', self._names)):
+            if key in config and index.get(config[key]) == self._ids[row]:
+                del index[config[key]]
+
+    def reload(self, stations):
+        '''
+        take a new station list, e.g. node_config.json edited while RC is running: new stations are added,
+        the missing ones removed, and the others keep their state with the new config
+        :param stations: dict of station ID: config dict
+        :return: (added, removed, changed) lists of station IDs
+        :raise ValueError: when two stations have the same addr or name, nothing is changed then
+        '''
+        for key in ('addr', 'name'):
+            owners = {}
+            for (id, config) in stations.iteritems():
+                if key in config and owners.setdefault(config[key], id) != id:
+                    raise ValueError('%s %s of station %s is the one of station %s'
+                                     % (key, config[key], id, owners[config[key]]))
+        added, removed, changed = [], [], []
+        with self._lock:
+            for id in [id for id in self._ids if id not in stations]:
+                del self[id]
+                removed.append(id)
+            for (id, config) in stations.iteritems():
+                row = self._rows.get(id)
+                if row is None:
+                    self[id] = config
+                    added.append(id)
+                elif self._config[row] != config:
+                    self._unindex(row)
+                    self._config[row] = dict(config)
+                    self._index(row)
+                    changed.append(id)
+        return (added, removed, changed)
+
+    # fields of a station, for StationView
+    def _get(self, id, key):
+        row = self._rows[id]
+        column = self._columns.get(key)
+        if column is not None:
+            return column[row]
+        return self._config[row][key]
+
+    def _set(self, id, key, value):
+        with self._lock:
+            row = self._rows[id]
+            column = self._columns.get(key)
+            if column is not None:
+                changed = column[row] != value
+                column[row] = value
+                if changed and self.on_change is not None:
+                    self.on_change(id, key, column[row])
+                return
+            if key == 'addr' or key == 'name':
+                self._check(id, {key: value})
+                self._unindex(row)
+                self._config[row][key] = value
+                self._index(row)
+            else:
+                self._config[row][key] = value
+
+    def _delete(self, id, key):
+        if key in self._columns:
+            raise KeyError('%s is a state field' % key)
+        with self._lock:
+            row = self._rows[id]
+            self._unindex(row)
+            del self._config[row][key]
+            self._index(row)
+
+    def _keys(self, id):
+        return self._config[self._rows[id]].keys() + [name for (name, typecode, default) in STATE_FIELDS]
+
+    # lookups, the ID bytes of the frames and the hex IDs of node_config.json
+    def by_addr(self, addr):
+        ''' :return: ID of the station with addr, None if there is none '''
+        return self._addrs.get(addr)
+
+    def by_name(self, name):
+        ''' :return: ID of the station with name, None if there is none '''
+        return self._names.get(name)
+
+    def hex_of(self, bin_id):
+        ''' :return: ID of the station with ID bytes bin_id, None if there is none '''
+        return self._bins.get(bin_id)
+
+    def station(self, bin_id):
+        ''' :return: StationView of the station with ID bytes bin_id, None if there is none '''
+        id = self._bins.get(bin_id)
+        return None if id is None else StationView(self, id)
+
+    def bin_of(self, id):
+        ''' :return: ID bytes of the station with ID id '''
+        return self._bin_ids[id]
+
+    def bin_ids(self, ids=None):
+        ''' :return: ID bytes of the stations with ids, of every station in row order by default '''
+        return [self._bin_ids[id] for id in (self._ids if ids is None else ids)]
+
+    # queries over the columns
+
+    def column(self, name):
+        '''
+        :return: a copy of the column of a state field in row order (see ids()), a numpy array if numpy is there,
+                 else an array.array
+        '''
+        with self._lock:
+            if numpy is not None:
+                return self._view(name).copy()
+            return array.array(self._columns[name].typecode, self._columns[name])
+
+    def _view(self, name):
+        ''' numpy array sharing the memory of a column, only to be used under the lock: the column may move when
+            a station is added '''
+        column = self._columns[name]
+        return numpy.frombuffer(column, dtype=column.typecode) if len(column) else numpy.array([], column.typecode)
+
+    def ids(self):
+        ''' :return: station IDs in row order '''
+        return list(self._ids)
+
+    def where(self, name, op, other):
+        '''
+        IDs of the stations where the comparison holds, e.g. where('lamp_ctrl_status', '!=', 'lamp_ctrl')
+        :param op: '==', '!=', '<', '<=', '>' or '>='
+        :param other: a value, or the name of another state field
+        '''
+        compare = OPERATORS[op]
+        with self._lock:
+            if numpy is not None and self._ids:
+                right = self._view(other) if isinstance(other, basestring) else other
+                return [self._ids[row] for row in numpy.flatnonzero(compare(self._view(name), right))]
+            right = self._columns[other] if isinstance(other, basestring) else itertools.repeat(other)
+            return list(itertools.compress(self._ids, itertools.imap(compare, self._columns[name], right)))
+
+    def total(self, name):
+        ''' sum of a state field over every station, e.g. total('power') '''
+        with self._lock:
+            if numpy is not None and len(self._ids):
+                return self._view(name).sum().item()
+            return sum(self._columns[name])
+
+    def assign(self, name, value, ids=None):
+        '''
+        set a state field of many stations at once
+        :param ids: station IDs, None for every station
+        '''
+        with self._lock:
+            column = self._columns[name]
+            if self.on_change is not None:
+                for id in (self._ids if ids is None else ids):
+                    self._set(id, name, value)
+            elif ids is None:
+                column[:] = array.array(column.typecode, [value]) * len(column)
+            else:
+                for id in ids:
+                    column[self._rows[id]] = value
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import struct
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from znldTransaction import Transaction
+
+# telemetry readout (TAG_TELEMETRY): RC asks for a set of fields, value[0:2] is the mask of them (bit n is field n
+# below), and the station answers with the fields packed one after another in fixed point, big endian, 3 bytes
+# per TAG_TELEMETRY_DATA frame (value[0:3]) with request SN + 1, + 2 ... up to 8 frames for every field.
+# (name, bytes, unit, signed), a field is round(value / unit), all ones (unsigned) or 0x80.. (signed) is no value.
+TELEMETRY_FIELDS = (('voltage', 2, 0.1, False), ('current', 2, 0.001, False), ('power', 2, 0.1, False),
+                    ('energy', 3, 0.01, False), ('power_factor', 1, 0.01, False), ('co2', 2, 1, False),
+                    ('board_temperature', 2, 0.1, True), ('freq', 2, 0.01, False),
+                    ('pm2_5', 2, 0.1, False), ('pm10', 2, 0.1, False), ('temperature', 2, 0.1, True),
+                    ('humidity', 2, 0.1, False))
+TELEMETRY_NAMES = tuple(field[0] for field in TELEMETRY_FIELDS)
+ELECTRIC_NAMES = ('voltage', 'current', 'power', 'energy', 'power_factor', 'freq')
+ENVIRONMENT_NAMES = ('co2', 'pm2_5', 'pm10', 'temperature', 'humidity')
+FRAME_BYTES = 3
+
+
+def field_mask(names):
+    ''' :return: the mask of the fields with names '''
+    mask = 0
+    for name in names:
+        mask |= 1 << TELEMETRY_NAMES.index(name)
+    return mask
+
+
+def mask_fields(mask):
+    ''' :return: the fields of a mask in the order they are packed '''
+    return [field for (bit, field) in enumerate(TELEMETRY_FIELDS) if mask & (1 << bit)]
+
+
+def frame_count(mask):
+    ''' :return: number of TAG_TELEMETRY_DATA frames of the fields of a mask '''
+    return (sum(field[1] for field in mask_fields(mask)) + FRAME_BYTES - 1) // FRAME_BYTES
+
+
+def _no_value(size, signed):
+    return 1 << (8 * size - 1) if signed else (1 << (8 * size)) - 1
+
+
+def pack(mask, values):
+    '''
+    :param values: dict of field name: value, a field without a value is sent as none
+    :return: list of the value bytes of each frame
+    '''
+    data = ''
+    for (name, size, unit, signed) in mask_fields(mask):
+        bits = 8 * size
+        value = values.get(name)
+        if value is None:
+            raw = _no_value(size, signed)
+        elif signed:
+            limit = (1 << (bits - 1)) - 1
+            raw = max(-limit, min(limit, int(round(value / unit)))) % (1 << bits)
+        else:
+            raw = max(0, min((1 << bits) - 2, int(round(value / unit))))
+        data += ''.join(chr((raw >> (8 * (size - 1 - n))) & 0xFF) for n in range(size))
+    data += '\x00' * (-len(data) % FRAME_BYTES)
+    return [data[offset:offset + FRAME_BYTES] for offset in range(0, len(data), FRAME_BYTES)]
+
+
+def unpack(mask, parts):
+    '''
+    :param parts: dict of frame index: value bytes of the frame, the lost frames are missing
+    :return: dict of field name: value of every field which came whole and has a value
+    '''
+    return dict((name, value) for (name, value) in _whole_fields(mask, parts) if value is not None)
+
+
+def _whole_fields(mask, parts):
+    ''' :return: (name, value) of every field which came whole, value is None if the station has none '''
+    fields = []
+    offset = 0
+    for (name, size, unit, signed) in mask_fields(mask):
+        frames = range(offset // FRAME_BYTES, (offset + size - 1) // FRAME_BYTES + 1)
+        offset += size
+        if not all(index in parts for index in frames):
+            continue
+        start = offset - size - frames[0] * FRAME_BYTES
+        raw = 0
+        for byte in ''.join(parts[index] for index in frames)[start:start + size]:
+            raw = (raw << 8) | ord(byte)
+        if raw == _no_value(size, signed):
+            fields.append((name, None))
+            continue
+        if signed and raw & (1 << (8 * size - 1)):
+            raw -= 1 << (8 * size)
+        fields.append((name, raw * unit))
+    return fields
+
+
+class TelemetryTransaction(Transaction):
+    """
+    a telemetry readout of one station: the answer is frame_count(mask) frames, each one frame_gap after the
+    other, which the engine may set for each try as it depends on the route the try went. a try which gets only some of them asks the next time for the fields it
+    didn't get, so a lost frame costs a frame or two more instead of the whole readout, and such a try isn't
+    counted in `retry`.
+    """
+    def __init__(self, dest_id, tag, resp_tag, mask, retry, frame_gap=0):
+        '''
+        :param tag: TAG of the request, TAG_TELEMETRY
+        :param resp_tag: TAG of the answer, TAG_TELEMETRY_DATA
+        :param mask: the fields to read, see field_mask()
+        '''
+        Transaction.__init__(self, dest_id, None, resp_tag, retry)
+        self._tag = tag
+        self.frame_gap = frame_gap
+        self.values = {} # field name: value read so far
+        self._set_mask(mask)
+
+    def _set_mask(self, mask):
+        self.mask = mask
+        self.mesg = self._tag + struct.pack('>H', mask) + '\x00' * 2
+        self.frames = frame_count(mask)
+        self._parts = {}
+
+    def take(self, index, rx_frame):
+        self._parts[index] = rx_frame.value[0:FRAME_BYTES]
+        if len(self._parts) < self.frames:
+            return False
+        self.values.update(unpack(self.mask, self._parts))
+        return True
+
+    def expired(self):
+        fields = _whole_fields(self.mask, self._parts)
+        self.values.update((name, value) for (name, value) in fields if value is not None)
+        # the next try asks only for the fields which didn't come whole, the parts of this one are dropped as
+        # the values may have changed in between
+        mask = self.mask & ~field_mask(name for (name, value) in fields)
+        if fields and mask:
+            logger.debug('telemetry of STA (%s): %d fields got, %d to go' %
+                         (binascii.b2a_hex(self.dest_id), len(fields), len(mask_fields(mask))))
+            # a try which got some fields doesn't count, there are no more of them than fields
+            self.retry += 1
+        self._set_mask(mask or self.mask)
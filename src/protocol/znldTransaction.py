@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import threading
+from collections import deque
+
+import logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+from libs.myClock import SYSTEM_CLOCK
+from libs.myException import *
+
+
+class Transaction(object):
+    """one RC request to a station, it is retried until a response is matched or retries run out"""
+    def __init__(self, dest_id, mesg, resp_tag, retry, timeout=None, expected=None):
+        '''
+        :param dest_id: station ID
+        :param mesg: the 5 bytes message to be sent
+        :param resp_tag: TAG of the expected response
+        :param retry: max. times to send the message
+        :param timeout: seconds to wait for the response of each try, None to take the station RTO of the engine
+        :param expected: if not None, the 1st value byte of the response must be equal to it
+        '''
+        self.dest_id = dest_id
+        self.mesg = mesg
+        self.resp_tag = resp_tag
+        self.retry = retry
+        self.timeout = timeout
+        self.expected = expected
+        self.tries = 0
+        self.sn = None # SN of the latest try
+        self.pendings = [] # responses waited for, one per try
+        self.deadline = None
+        self.sent_at = None
+        self.started_at = None # time of the 1st try
+        self.finished_at = None # time when it is done
+        self.rtt = None # seconds from the answered try to the response
+        self.result = None # True on success, False on failure, None while on-going
+        self.error = None # RxTimeOut, RxNack or RxUnexpectedTag on failure
+        self.data = None # TAG + value of the response
+        self.frames = 1 # frames of the response, with request SN + 1, + 2 ...
+        self.frame_gap = 0 # seconds from one frame of the response to the next one
+
+    def done(self):
+        return self.result is not None
+
+    def take(self, index, rx_frame):
+        '''
+        a frame of the response to the latest try
+        :param index: 0 for the frame with request SN + 1, 1 for SN + 2 ...
+        :return: True if the response is complete
+        '''
+        return True
+
+    def expired(self):
+        ''' the latest try timed out, e.g. to change the request of the next one '''
+        pass
+
+    def latency(self):
+        ''' :return: seconds from the 1st try to the end, None while on-going '''
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def __repr__(self):
+        return '<Transaction %s tries=%d result=%s error=%s>' % (binascii.b2a_hex(self.dest_id), self.tries,
+                                                                 self.result, self.error.__class__.__name__)
+
+
+class TransactionEngine(object):
+    """
+    RC transaction engine which keeps up to `window` requests outstanding to different stations.
+    a response is matched to its request by the dispatcher on source ID and SN (the STA responds with
+    request SN + 1), and every request has its own retry timer, so a sweep costs about the slowest RTT
+    per window. a late response to an earlier try of the same request is accepted as well, unless the response
+    is more than one frame, whose frames only fit together within a try: the frames of a try which timed out
+    are dropped.
+    """
+    def __init__(self, send, dispatcher, tag_nack, window=1, rtt=None, on_timeout=None, frame_gap=None,
+                 clock=SYSTEM_CLOCK):
+        '''
+        :param send: send(dest_id, mesg) transmits one frame and returns the SN used, send(dest_id, mesg, frames)
+                     leaves the SNs of a response of `frames` frames out of the next request
+        :param dispatcher: Dispatcher of received frames
+        :param tag_nack: TAG of NACK
+        :param window: max. outstanding requests
+        :param rtt: RttTable which gives the timeout of each try and is updated by every response and timeout
+        :param on_timeout: on_timeout(dest_id) is called when a try times out
+        :param frame_gap: frame_gap(dest_id) is the frame gap of a response of more than one frame to the try
+                          just sent to dest_id, which depends on how it was sent, None to keep the frame_gap
+                          of the transaction
+        :param clock: clock of the retry timers
+        '''
+        self._clock = clock
+        self._send = send
+        self._rtt = rtt
+        self._on_timeout = on_timeout
+        self._frame_gap = frame_gap
+        self._dispatcher = dispatcher
+        self._tag_nack = tag_nack
+        self.window = max(1, window)
+
+    def _transmit(self, txn, responses, arrived):
+        txn.tries += 1
+        logger.info('RC send message to STA (%s) %s times' % (binascii.b2a_hex(txn.dest_id), str(txn.tries)))
+        if txn.frames == 1:
+            txn.sn = self._send(txn.dest_id, txn.mesg)
+        else:
+            txn.sn = self._send(txn.dest_id, txn.mesg, frames=txn.frames)
+            if self._frame_gap is not None:
+                txn.frame_gap = self._frame_gap(txn.dest_id)
+        txn.sent_at = self._clock.monotonic()
+        if txn.started_at is None:
+            txn.started_at = txn.sent_at
+        if self._rtt is not None and txn.timeout is None:
+            timeout = self._rtt.timeout(txn.dest_id)
+        else:
+            timeout = txn.timeout
+        txn.deadline = txn.sent_at + timeout + (txn.frames - 1) * txn.frame_gap
+        callback = lambda pending, rx_frame: self._respond(responses, arrived, (txn, pending, rx_frame))
+        for index in range(txn.frames):
+            pending = self._dispatcher.expect(txn.dest_id, (txn.resp_tag, self._tag_nack), (txn.sn + 1 + index) & 0xFF,
+                                              callback=callback, since=txn.sent_at)
+            pending.sent_at = txn.sent_at
+            pending.sn = txn.sn
+            pending.index = index
+            txn.pendings.append(pending)
+
+    @staticmethod
+    def _respond(responses, arrived, response):
+        responses.append(response)
+        arrived.set()
+
+    def _expire(self, txn, responses, arrived):
+        if self._rtt is not None:
+            self._rtt.on_timeout(txn.dest_id)
+        if self._on_timeout is not None:
+            self._on_timeout(txn.dest_id)
+        if txn.frames > 1:
+            # the frames of this try which are still to come don't fit with those of the next one
+            for a_pending in txn.pendings:
+                self._dispatcher.cancel(a_pending)
+            txn.pendings = []
+        txn.expired()
+        if txn.tries < txn.retry:
+            self._transmit(txn, responses, arrived)
+        else:
+            logger.debug('RC didn\'t get expected response from STA (%s)' % binascii.b2a_hex(txn.dest_id))
+            txn.result = False
+            txn.error = RxTimeOut()
+            txn.finished_at = self._clock.monotonic()
+
+    def _complete(self, txn, pending, rx_frame):
+        if rx_frame.tag != self._tag_nack:
+            if (txn.frames > 1 and pending.sn != txn.sn) or not txn.take(pending.index, rx_frame):
+                return
+        # the response SN tells which try it answers, so measure from that try, without the gaps of the frames
+        # before it. a frame claimed from the late-frame buffer arrived before it was waited for, no RTT sample
+        txn.finished_at = self._clock.monotonic()
+        if not pending.claimed:
+            txn.rtt = txn.finished_at - pending.sent_at - pending.index * txn.frame_gap
+            if self._rtt is not None:
+                self._rtt.sample(txn.dest_id, txn.rtt)
+        txn.data = rx_frame.message()
+        tag = rx_frame.tag
+        if tag == self._tag_nack:
+            txn.result = False
+            txn.error = RxNack()
+        elif txn.expected is None or txn.data[1] == txn.expected:
+            txn.result = True
+        else:
+            txn.result = False
+            txn.error = RxUnexpectedTag()
+
+    def run(self, transactions):
+        '''
+        run all transactions to the end, requests to the same station are never outstanding at the same time.
+        :param transactions: list of Transaction
+        :return: the same list, each one is done
+        '''
+        pending = deque(transactions)
+        outstanding = {} # dest_id -> Transaction
+        responses = deque() # (Transaction, Pending, rx_frame) appended by dispatcher callbacks
+        arrived = threading.Event() # set on every append
+        while pending or outstanding:
+            # fill the window
+            blocked = deque()
+            while pending and len(outstanding) < self.window:
+                txn = pending.popleft()
+                if txn.dest_id in outstanding:
+                    blocked.append(txn)
+                    continue
+                outstanding[txn.dest_id] = txn
+                self._transmit(txn, responses, arrived)
+            pending.extendleft(reversed(blocked))
+
+            timeout = max(0.0, min(txn.deadline for txn in outstanding.itervalues()) - self._clock.monotonic())
+            if not responses:
+                self._clock.wait(arrived, timeout)
+            arrived.clear()
+            while responses:
+                (txn, a_pending, rx_frame) = responses.popleft()
+                if not txn.done():
+                    self._complete(txn, a_pending, rx_frame)
+
+            now = self._clock.monotonic()
+            for txn in outstanding.values():
+                if not txn.done() and txn.deadline <= now:
+                    self._expire(txn, responses, arrived)
+                if txn.done():
+                    del outstanding[txn.dest_id]
+                    for a_pending in txn.pendings:
+                        self._dispatcher.cancel(a_pending)
+        return transactions
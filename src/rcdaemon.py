@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+from protocol.znldDaemon import RcDaemon
+
+import json
+import logging
+import logging.config
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    # headless RC: owns the E32 and serves the RC API on node_config 'rpc_socket', the GUI (startup.py),
+    # test scripts and cron jobs connect to it with protocol.znldClient.RcClient
+    with open('logging_config.json', 'r') as logging_config_file:
+        logging_config = json.load(logging_config_file)
+        logging_config['handlers']['file']['filename'] = 'rcdaemon.log'
+        logging.config.dictConfig(logging_config)
+    file_name = 'node_config.json'
+    with open(file_name, 'r') as node_config_file:
+        node_config = json.load(node_config_file)
+        logger.info('%s', node_config)
+    if node_config['role'].strip().upper() != 'RC':
+        logger.error('role of rcdaemon must be RC')
+        exit(-1)
+    RcDaemon(node_config, file_name).serve_forever()
@@ -4,10 +4,16 @@
 __author__ = 'Wei; Mike'
 
 from protocol.znldProtocol import Protocol
+from protocol.znldDaemon import RcDaemon
+from protocol.znldClient import RcClient, RemoteStations, RemoteTelemetry
+from protocol.znldRpc import RPC_SOCKET, RpcError
+from protocol.znldRegistry import config_path
 from gui.znldGUI import *
 from libs.myException import *
 
 import binascii
+import socket
+import threading
 from time import sleep
 import json
 import logging
@@ -15,28 +21,47 @@ import logging.config
 logger = logging.getLogger(__name__)
 
 class ZNLDApp(Application):
-    def __init__(self, stations):
-        self.rc = Protocol(id=id, role=role, hop=hop, baudrate=e32_baudrate,
-                           testing = testing, timeout = timeout, e32_delay = e32_delay, relay_delay = relay_delay,
-                           relay_random_backoff = relay_random_backoff, stations=stations)
-        self.rc.setName('Thread RC receiving')
-        self.rc.setDaemon(True)
-        self.rc.start()
-        self.stations = self.rc.get_stas_dict() # get stations dict proxy reference in multiprocess env
-        Application.__init__(self, self.stations)
+    def __init__(self, rc):
+        '''
+        :param rc: RcClient of the RC daemon, which reloads the station list, reads the telemetry and polls the
+                   silent stations
+        '''
+        self.rc = rc
+        self.stations = RemoteStations(rc) # kept current by the state notifications of the daemon
+        Application.__init__(self, self.stations, RemoteTelemetry(rc))
+        # the stations added by a reload get their LEDs
+        self.stations.on_reload = self.on_stations_reloaded
 
     def __del__(self):
-        logger.debug('Waiting for thread end')
-        self.rc.join()
+        logger.debug('Closing RC client')
+        self.rc.close()
         logger.debug('End')
 
 
+    def run_in_background(self, target, *args):
+        ''' call target(*args) from a thread of its own, off the Tk thread '''
+        thread = threading.Thread(target=target, args=args, name='Thread GUI request')
+        thread.setDaemon(True)
+        thread.start()
+
+    def reliable_broadcast(self, mesg):
+        ''' the stations which missed it get it again after the epoch beacon '''
+        try:
+            results = self.rc.RC_reliable_broadcast(mesg)
+        except RpcError as e:
+            logger.error('reliable broadcast failed: %s' % e)
+            return
+        missed = [binascii.b2a_hex(id) for id in results.keys() if not results[id]]
+        if missed:
+            logger.warning('%d stations missed the broadcast: %s' % (len(missed), ', '.join(sorted(missed))))
+
     def on_all_lamps_on_button_click(self):
         '''灯具全部开'''
         logger.info('on_all_lamps_on_button_click')
         mesg = Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON
         logger.info('broadcast mesg = %s' % binascii.b2a_hex(mesg))
-        self.rc.RC_lamp_ctrl(Protocol.LampControl.BROADCAST_ID, mesg)
+        # the beacon rounds take a while, the GUI mustn't wait for them
+        self.run_in_background(self.reliable_broadcast, mesg)
         pass
 
     def on_all_lamps_off_button_click(self):
@@ -44,7 +69,22 @@ class ZNLDApp(Application):
         logger.info('on_all_lamps_off_button_click')
         mesg = Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF
         logger.info('broadcast mesg = %s' % binascii.b2a_hex(mesg))
-        self.rc.RC_lamp_ctrl(Protocol.LampControl.BROADCAST_ID, mesg)
+        # the beacon rounds take a while, the GUI mustn't wait for them
+        self.run_in_background(self.reliable_broadcast, mesg)
+        pass
+
+    def on_zone_lamps_button_click(self, zone, status):
+        '''区域灯具开关'''
+        logger.info('on_zone_lamps_button_click: zone %d, status %d' % (zone, status))
+        if status == 1:
+            mesg = Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON
+        else:
+            mesg = Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF
+        results = self.rc.RC_lamp_ctrl_group(zone, mesg, ack=True)
+        # the members which didn't ACK get it by unicast
+        missed = [id for id in results.keys() if not results[id]]
+        if missed:
+            self.rc.RC_lamp_ctrl_multi(missed, mesg)
         pass
 
     def on_lamp_status_query_button_click(self, lamp_num):
@@ -69,9 +109,12 @@ class ZNLDApp(Application):
             mesg = Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON
         else:
             mesg = Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF
-        station_id = '\x00' * 5 + chr(lamp_num + 2)
-        logger.info('unicast to STA (%s) mesg = %s' % (binascii.b2a_hex(station_id), binascii.b2a_hex(mesg)))
-        self.rc.RC_lamp_ctrl(station_id, mesg)
+        id = self.stations.by_addr(lamp_num + 2)
+        if id is None:
+            logger.error('no STA has addr %d' % (lamp_num + 2))
+            return
+        logger.info('unicast to STA (%s) mesg = %s' % (id, binascii.b2a_hex(mesg)))
+        self.rc.RC_lamp_ctrl(self.stations.bin_of(id), mesg)
         pass
 
     def on_lamp_confirm_button_click(self):
@@ -92,11 +135,10 @@ class ZNLDApp(Application):
             lamp_on = Protocol.LampControl.BYTE_ALL_OFF
         mesg = lamp_on + chr(lamp1_val) + chr(lamp2_val) + Protocol.LampControl.BYTE_RESERVED
 
-        for id in self.stations.keys():
-            if self.stations[id]['addr'] == node_addr:
-                logger.info('unicast to STA (%s) mesg = %s' % (id, binascii.b2a_hex(mesg)))
-                self.rc.RC_lamp_ctrl(binascii.a2b_hex(id), mesg)
-                break
+        id = self.stations.by_addr(node_addr)
+        if id is not None:
+            logger.info('unicast to STA (%s) mesg = %s' % (id, binascii.b2a_hex(mesg)))
+            self.rc.RC_lamp_ctrl(self.stations.bin_of(id), mesg)
         pass
 
 
@@ -127,62 +169,57 @@ if __name__ == "__main__":
         exit(-1)
 
     if role == 'RC':
-        hop = node_config['hop']
-        e32_baudrate = node_config['e32']['baudrate']
-        stations = node_config['stations']
-        testing = node_config['testing'].strip().upper()
-        timeout = node_config['timeout']
-        e32_delay = node_config['e32_delay']
-        relay_delay = node_config['relay_delay']
-        relay_random_backoff = node_config['relay_random_backoff']
         try:
             gui = node_config['gui'].strip().upper()
         except KeyError:
             gui = 'YES'
+        # RC is the RC daemon (rcdaemon.py) when one is running, else it runs in this process for as long as
+        # this one does, see protocol/znldDaemon.py for its node_config keys
+        daemon = None
+        rpc_socket = node_config.get('rpc_socket', RPC_SOCKET)
+        try:
+            rc = RcClient(rpc_socket)
+        except socket.error:
+            logger.info('no RC daemon on %s, starting one in this process' % rpc_socket)
+            daemon = RcDaemon(node_config, file_name)
+            daemon.start()
+            rc = RcClient(rpc_socket)
 
         if gui == 'NO':
             logger.debug('running in non-GUI mode')
-            rc = Protocol(id=id, role=role, hop=hop, baudrate=e32_baudrate,
-                          testing=testing, timeout=timeout, e32_delay=e32_delay, relay_delay=relay_delay,
-                          relay_random_backoff=relay_random_backoff, stations=stations)
-            rc.setName('Thread RC receiving')
-            rc.setDaemon(True)
+            stations = rc.call('stations', {'fields': ['name']})
             results = {}
             for id in stations.keys():
                 name = stations[id]['name']
                 results[name] = {'OK': 0, 'ERR_TAG': 0, 'ERR_TO': 0, 'ERR_NACK': 0}
             try:
-                rc.start()
-                sleep(6)
                 loop = 0
                 led_ctrl = 0x3
                 while loop < 10000:
                     mesg = chr(led_ctrl) + '\xFF\xFF\x00'
                     logger.info('broadcast led_ctrl = %s' % repr(led_ctrl))
                     #rc.RC_lamp_ctrl('\x00\x00\x00\x00\x00\x02', mesg)
-                    rc.RC_lamp_ctrl(Protocol.LampControl.BROADCAST_ID, mesg)
-                    # need to consider network delay here given relay node number
-                    sleep(rc.hop * (rc.e32_delay + rc.relay_random_backoff))
-                    logger.info('poll led status from each STA:')
+                    # the RELAYs gather the ACKs of their STAs, only the stations which didn't ACK are polled
+                    acks = rc.RC_lamp_ctrl_broadcast(mesg)
+                    missed = [binascii.a2b_hex(id) for id in stations.keys() if not acks.get(binascii.a2b_hex(id))]
+                    logger.info('poll led status from %d STAs which didn\'t ACK:' % len(missed))
+                    errors = rc.RC_unicast_poll_multi(missed, chr(led_ctrl))
                     for id in stations.keys():
                         name = stations[id]['name']
-                        try:
-                            rc.RC_unicast_poll(binascii.a2b_hex(id), chr(led_ctrl))
-                        except RxUnexpectedTag:
+                        error = errors.get(binascii.a2b_hex(id))
+                        if isinstance(error, RxUnexpectedTag):
                             logger.error('RC got unexpected TAG_POLL_ACK from STA (%s)' % id)
                             results[name]['ERR_TAG'] += 1
-                        except RxTimeOut:
+                        elif isinstance(error, RxTimeOut):
                             logger.debug('RC didn\'t get expected response from STA (%s)' % id)
                             results[name]['ERR_TO'] += 1
-                        except RxNack:
+                        elif isinstance(error, RxNack):
                             logger.error('NACK is received from STA (%s)' % id)
                             results[name]['ERR_NACK'] += 1
                         else:
                             logger.info('RC got expected TAG_POLL_ACK from STA (%s)' % id)
                             logger.info('%s (%s) response successfully' % (name, id))
                             results[name]['OK'] += 1
-                        # need to consider network delay here given relay node number
-                        sleep(rc.hop * (rc.e32_delay + rc.relay_delay + rc.relay_random_backoff))
                     logger.info('***** loop = %s: %s*****' % (repr(loop), results))
                     loop += 1
                     if led_ctrl == 0x0:
@@ -191,24 +228,32 @@ if __name__ == "__main__":
                         led_ctrl = 0x0
             except KeyboardInterrupt:
                 logger.debug('Stopping Thread by Ctrl-C')
-                rc.stop()
             except:
                 import traceback
                 traceback.print_exc()
             finally:
-                logger.debug('Waiting for thread end')
-                rc.join()
+                rc.close()
+                if daemon is not None:
+                    logger.debug('Waiting for thread end')
+                    daemon.stop()
                 logger.debug('End')
         else:
             logger.debug('running in GUI mode')
             # 实例化Application
-            app = ZNLDApp(stations)
+            app = ZNLDApp(rc)
             #app.clocking()
             # 主消息循环:
             app.mainloop()
+            if daemon is not None:
+                daemon.stop()
 
     elif role == 'STA':
-        sta = Protocol(id=id, role=role, stations=None)
+        sta = Protocol(id=id, role=role, stations=None, slots=node_config.get('slots', 8),
+                       slot=node_config.get('slot'), slot_guard=node_config.get('slot_guard', 0.05),
+                       addr=node_config.get('addr'),
+                       group_file=config_path(file_name, node_config.get('group_file', 'groups.json')),
+                       report_interval=node_config.get('report_interval', 5),
+                       report_thresholds=node_config.get('report_thresholds'))
         sta.setName('Thread STA receiving')
         sta.setDaemon(True)
         try:
@@ -227,7 +272,13 @@ if __name__ == "__main__":
             logger.debug('End')
 
     elif role == 'RELAY':
-        relay = Protocol(id=id, role=role, stations=None)
+        relay = Protocol(id=id, role=role, stations=None, slots=node_config.get('slots', 8),
+                         slot=node_config.get('slot'), slot_guard=node_config.get('slot_guard', 0.05),
+                         dedup_size=node_config.get('dedup_size', 256), dedup_ttl=node_config.get('dedup_ttl'),
+                         route_ttl=node_config.get('route_ttl', 600), addr=node_config.get('addr'),
+                         group_file=config_path(file_name, node_config.get('group_file', 'groups.json')),
+                         report_interval=node_config.get('report_interval', 5),
+                         report_thresholds=node_config.get('report_thresholds'))
         relay.setName('Thread STA receiving')
         relay.setDaemon(True)
         try:
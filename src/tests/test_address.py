@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldAddress import AddressBook, RC_ADDR
+from protocol.znldProtocol import Protocol
+from protocol.znldSim import SimNetwork
+
+RC_ID = '\x00\x00\x00\x00\x00\x01'
+STA_ID = '\x00\x00\x00\x00\x00\x03'
+
+
+class AddressBookTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_address """
+    def setUp(self):
+        self.book = AddressBook(max_failures=2)
+        self.book.assign(RC_ID, RC_ADDR)
+        self.book.assign(STA_ID, 3)
+
+    def test_compact_after_enable(self):
+        self.assertEqual(self.book.compact(RC_ID, STA_ID), None)
+        self.book.enable(STA_ID)
+        self.assertEqual(self.book.compact(RC_ID, STA_ID), (RC_ADDR, 3))
+        # a new address has to be confirmed again
+        self.book.assign(STA_ID, 4)
+        self.assertEqual(self.book.compact(RC_ID, STA_ID), None)
+
+    def test_legacy_for_good_after_max_failures(self):
+        # never enabled, e.g. a legacy node which NACKed its address
+        self.book.retry(STA_ID)
+        self.assertEqual(self.book.compact(RC_ID, STA_ID), None)
+        self.book.enable(STA_ID)
+        self.book.disable(STA_ID)
+        self.book.retry(STA_ID)
+        self.assertEqual(self.book.compact(RC_ID, STA_ID), (RC_ADDR, 3))
+        self.book.disable(STA_ID)
+        self.book.retry(STA_ID)
+        self.assertEqual(self.book.compact(RC_ID, STA_ID), None)
+        self.assertEqual(self.book.stats()['fallbacks'], 2)
+        # a compact frame from it proves the way again
+        self.book.enable(STA_ID)
+        self.book.disable(STA_ID)
+        self.book.retry(STA_ID)
+        self.assertEqual(self.book.compact(RC_ID, STA_ID), (RC_ADDR, 3))
+
+
+class LegacyRelayTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_address """
+    def test_station_behind_a_legacy_relay_stays_reachable(self):
+        net = SimNetwork(stations=4, hops=1, timeout=1, e32_delay=0.1, seed=1)
+        # a legacy RELAY syncs on the legacy header only, it never gets a compact frame
+        relay = net.levels[0][0]
+        self.assertEqual(relay.protocol._role, 'RELAY')
+        relay.accepts = lambda frame, accepts=relay.accepts: not frame.is_compact() and accepts(frame)
+        results = []
+
+        def driver(rc):
+            results.append(all(rc.RC_send_address_map().values()))
+            for i in range(4):
+                results.append([rc.RC_unicast_poll(id, Protocol.LampControl.BYTE_ALL_OFF) for id in net.sta_ids])
+        net.run(driver, until=3600)
+        self.assertEqual(results, [True] + [[True] * 4] * 4)
+        for port in net.levels[0][1:]:
+            # the STAs which hear RC take compact frames
+            self.assertTrue(port.protocol.get_address_stats()['compact_frames'] > 0)
+        for port in net.levels[1]:
+            self.assertEqual(port.protocol.get_address_stats()['compact_frames'], 0)
+
+
+class LampNumberTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_address """
+    def test_lamp_number_is_kept_apart_from_the_short_address(self):
+        net = SimNetwork(stations=1, hops=0)
+        sta = net.levels[0][0].protocol
+        sta._STA_set_addr(RC_ID, 9)
+        self.assertEqual(sta._short_addr, 9)
+        self.assertEqual(sta._lamp_number(), 2)
+        # the short address RC assigns stands for a lamp number which isn't configured
+        sta._lamp_addr = None
+        self.assertEqual(sta._lamp_number(), 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
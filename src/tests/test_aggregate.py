@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import struct
+import unittest
+
+from protocol.znldAggregate import AckAggregator, AckCollector
+from protocol.znldBitmap import chunks, make_bitmap
+from protocol.znldFrame import Frame
+from protocol.znldProtocol import Protocol
+from protocol.znldSim import SimNetwork
+
+RC_ID = '\x00\x00\x00\x00\x00\x01'
+TAG_ACK = Protocol.LampControl.TAG_ACK
+TAG_ACK_BITMAP = Protocol.LampControl.TAG_ACK_BITMAP
+
+
+class Radio(object):
+    """ transport which sends nothing """
+    baudrate_air = 1200
+
+    def transmit(self, frame):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class AckAggregatorTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_aggregate """
+    def test_window(self):
+        aggregator = AckAggregator()
+        # no window open, the ACK is forwarded as usual
+        self.assertFalse(aggregator.absorb(RC_ID, 11, 3))
+        self.assertTrue(aggregator.open(RC_ID, 10))
+        self.assertFalse(aggregator.open(RC_ID, 10))
+        # the ACKs come with request SN + 1
+        self.assertTrue(aggregator.absorb(RC_ID, 11, 9))
+        self.assertTrue(aggregator.absorb(RC_ID, 11, 0))
+        self.assertTrue(aggregator.absorb(RC_ID, 11, 3))
+        self.assertFalse(aggregator.absorb(RC_ID, 13, 4))
+        self.assertEqual(aggregator.close(RC_ID, 10), [0, 3, 9])
+        self.assertFalse(aggregator.absorb(RC_ID, 11, 5))
+        self.assertEqual(aggregator.close(RC_ID, 10), [])
+
+    def test_window_across_sn_wrap(self):
+        aggregator = AckAggregator()
+        aggregator.open(RC_ID, 255)
+        self.assertTrue(aggregator.absorb(RC_ID, 0, 7))
+        self.assertEqual(aggregator.close(RC_ID, 255), [7])
+
+
+class AckCollectorTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_aggregate """
+    def setUp(self):
+        self.keys = {0: '\x00\x00\x00\x00\x00\x10', 3: '\x00\x00\x00\x00\x00\x13', 77: '\x00\x00\x00\x00\x00\x14'}
+        self.collector = AckCollector(RC_ID, 20, self.keys, TAG_ACK, TAG_ACK_BITMAP)
+
+    def ack(self, addr, src_id, sn=21):
+        return Frame(src_id, RC_ID, sn, TAG_ACK, struct.pack('>H', addr) + '\x01\x00')
+
+    def test_direct_acks_and_bitmaps(self):
+        self.assertTrue(self.collector.feed(self.ack(0, self.keys[0])))
+        # the ACK of another request, or from a station with another key
+        self.assertFalse(self.collector.feed(self.ack(3, self.keys[3], sn=23)))
+        self.assertFalse(self.collector.feed(self.ack(3, self.keys[77])))
+        self.assertFalse(self.collector.done.is_set())
+        for (bits, value) in chunks(make_bitmap([3, 77], 78), skip_empty=True):
+            self.assertTrue(self.collector.feed(Frame('\x00\x00\x00\x00\x00\x02', bits, 21, TAG_ACK_BITMAP, value)))
+        self.assertEqual(self.collector.acked, set(self.keys.values()))
+        self.assertTrue(self.collector.done.is_set())
+
+
+class AckKeyTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_aggregate """
+    def test_rc_rejects_shared_ack_keys(self):
+        # a station without addr takes the last byte of its ID, which is the addr of the other one
+        stations = {'000000000005': {'name': 'STA_5'}, '000000000006': {'name': 'STA_6', 'addr': 5}}
+        self.assertRaises(ValueError, Protocol, id=RC_ID, role='RC', stations=stations, transport=Radio())
+        stations['000000000006']['addr'] = 6
+        Protocol(id=RC_ID, role='RC', stations=stations, transport=Radio())
+
+
+class SimAckTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_aggregate """
+    def run_requests(self, hops, stations=16):
+        '''
+        :return: IDs of the stations which missed the ACK of each broadcast and group lamp ctrl,
+                 on a lossless radio where every ACK is to come back
+        '''
+        net = SimNetwork(stations=stations, hops=hops, timeout=1, e32_delay=0.1, seed=1)
+        missed = []
+
+        def driver(rc):
+            for value in (Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON, Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF):
+                acks = rc.RC_lamp_ctrl_broadcast(value)
+                missed.append(sorted(id for (id, acked) in acks.iteritems() if not acked))
+            for id in rc.stations.iterkeys():
+                rc.stations[id]['groups'] = [1]
+            rc.RC_send_group_map()
+            acks = rc.RC_lamp_ctrl_group(1, Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON, ack=True)
+            self.assertEqual(len(acks), stations + hops)
+            missed.append(sorted(id for (id, acked) in acks.iteritems() if not acked))
+        net.run(driver, until=3600)
+        return missed
+
+    def test_every_station_acks_directly(self):
+        self.assertEqual(self.run_requests(0), [[], [], []])
+
+    def test_every_station_acks_through_a_relay(self):
+        # the STA with the highest addr too, and from the 1st request on
+        self.assertEqual(self.run_requests(1), [[], [], []])
+        self.assertEqual(self.run_requests(1, stations=32), [[], [], []])
+
+    def test_every_station_acks_through_two_relays(self):
+        self.assertEqual(self.run_requests(2), [[], [], []])
+
+
+if __name__ == '__main__':
+    unittest.main()
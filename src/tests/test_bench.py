@@ -0,0 +1,31 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import os
+import imp
+import unittest
+
+bench_protocol = imp.load_source('bench_protocol', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                                'tools', 'bench_protocol.py'))
+
+
+class PercentileTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_bench """
+    def test_nearest_rank(self):
+        values = range(1, 101)
+        self.assertEqual(bench_protocol.percentile(values, 50), 50)
+        self.assertEqual(bench_protocol.percentile(values, 99), 99)
+        self.assertEqual(bench_protocol.percentile(values, 100), 100)
+        self.assertEqual(bench_protocol.percentile(values, 0), 1)
+
+    def test_few_values(self):
+        self.assertEqual(bench_protocol.percentile([3.0, 1.0, 2.0], 50), 2.0)
+        self.assertEqual(bench_protocol.percentile([3.0, 1.0, 2.0], 99), 3.0)
+        self.assertEqual(bench_protocol.percentile([7], 50), 7)
+        self.assertEqual(bench_protocol.percentile([], 50), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import binascii
+import unittest
+
+from protocol.znldBitmap import CHUNK_LAMPS, chunk_addrs, chunks, lamp_state, make_bitmap
+from protocol.znldProtocol import Protocol
+from protocol.znldSim import SimNetwork
+
+RC_ID = '\x00\x00\x00\x00\x00\x01'
+BROADCAST_ID = Protocol.LampControl.BROADCAST_ID
+TAG_LAMP_BITMAP = Protocol.LampControl.TAG_LAMP_BITMAP
+
+
+class Radio(object):
+    """ transport which sends nothing """
+    baudrate_air = 1200
+
+    def transmit(self, frame):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class BitmapTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_bitmap """
+    def test_every_lamp_picks_its_own_bit(self):
+        lamps_on = set([1, 7, 8, 71, 72, 200, 511])
+        frames = chunks(make_bitmap(lamps_on, 512))
+        self.assertEqual(len(frames), 8)
+        for addr in range(1, 512):
+            states = [lamp_state(bits, value, addr) for (bits, value) in frames]
+            self.assertEqual([state for state in states if state is not None], [addr in lamps_on])
+        self.assertEqual(sorted(addr for (bits, value) in frames for addr in chunk_addrs(bits, value)),
+                         sorted(lamps_on))
+
+    def test_empty_chunks_are_skipped(self):
+        frames = chunks(make_bitmap([CHUNK_LAMPS + 1], 512), skip_empty=True)
+        self.assertEqual([ord(value[0]) for (bits, value) in frames], [1])
+
+
+class AddrTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_bitmap """
+    def test_addr_0_is_rc_addr(self):
+        self.assertRaises(ValueError, Protocol, id='\x00\x00\x00\x00\x00\x05', role='STA', stations=None, addr=0,
+                          transport=Radio())
+        stations = {'000000000005': {'name': 'STA_5', 'addr': 0}}
+        self.assertRaises(ValueError, Protocol, id=RC_ID, role='RC', stations=stations, transport=Radio())
+
+
+class SimLampBitmapTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_bitmap """
+    def test_stations_not_known_to_take_bitmaps_get_unicast(self):
+        net = SimNetwork(stations=8, hops=0, timeout=1, e32_delay=0.1, seed=1)
+        legacy = net.levels[0][-1]
+        heard = []
+
+        def accepts(frame, accepts=legacy.accepts):
+            if frame.tag == TAG_LAMP_BITMAP:
+                heard.append(frame.dest_id)
+            return accepts(frame)
+        legacy.accepts = accepts
+        results = []
+
+        def driver(rc):
+            rc.RC_send_address_map()
+            self.assertTrue(all(rc.stations.station(id)['bitmap'] for id in net.sta_ids))
+            # every lamp on, then off. a legacy node would take an all off frame for a broadcast and NACK it
+            results.append(rc.RC_lamp_bitmap(range(1, 160), lamps=160))
+            rc.stations.station(legacy.protocol._id)['bitmap'] = False
+            results.append(rc.RC_lamp_bitmap([], lamps=160))
+            results.append(sorted(set(rc.stations.hex_of(id) for id in rc.RC_out_of_sync())))
+        net.run(driver, until=3600)
+        # 3 frames, then only the 1st one, whose dest field has the bit of RC_ADDR
+        self.assertEqual(results, [3, 1, []])
+        self.assertFalse(BROADCAST_ID in heard[3:] or legacy.protocol._id in heard[3:])
+        for port in net.levels[0]:
+            self.assertEqual(port.protocol._STA_led_status, Protocol.LampControl.BYTE_ALL_OFF,
+                             binascii.b2a_hex(port.protocol._id))
+
+
+if __name__ == '__main__':
+    unittest.main()
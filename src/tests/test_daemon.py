@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import socket
+import threading
+import unittest
+
+from protocol.znldDaemon import RequestQueue, _Connection
+
+
+class RequestQueueTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_daemon """
+    def setUp(self):
+        self.queue = RequestQueue()
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def test_priority_order(self):
+        done = []
+        for (priority, name) in ((2, 'background'), (0, 'control'), (1, 'poll'), (0, 'control 2')):
+            self.queue.submit(priority, done.append, (name,))
+        self.queue.start()
+        self.queue.call(9, lambda: None)
+        self.assertEqual(done, ['control', 'control 2', 'poll', 'background'])
+
+    def test_sweep_lets_urgent_requests_in(self):
+        done = []
+
+        def sweep():
+            for step in range(3):
+                done.append('step %d' % step)
+                if step == 0:
+                    self.queue.submit(0, done.append, ('control',))
+                yield step
+        self.queue.start()
+        self.assertEqual(self.queue.call(2, sweep), 2)
+        self.assertEqual(done, ['step 0', 'control', 'step 1', 'step 2'])
+
+    def test_exception_goes_to_caller(self):
+        self.queue.start()
+        self.assertRaises(KeyError, self.queue.call, 1, {}.__getitem__, 'missing')
+        self.assertEqual(self.queue.call(1, len, 'abc'), 3)
+
+
+class Server(object):
+    def __init__(self):
+        self.closed = []
+
+    def _closed(self, client):
+        self.closed.append(client)
+
+    def handle(self, client, message):
+        pass
+
+
+class ConnectionTest(unittest.TestCase):
+    def test_send_never_blocks_on_a_client_which_stopped_reading(self):
+        (ours, theirs) = socket.socketpair()
+        server = Server()
+        client = _Connection(ours, server, backlog=4)
+        client.start()
+        sent = threading.Event()
+
+        def flood():
+            # as _on_change does with the StationStore lock held
+            for n in range(20):
+                client.send({'method': 'state', 'params': {'value': 'x' * (1 << 22)}})
+            sent.set()
+        thread = threading.Thread(target=flood)
+        thread.setDaemon(True)
+        thread.start()
+        self.assertTrue(sent.wait(10))
+        self.assertTrue(client.closed)
+        self.assertEqual(server.closed, [client])
+        theirs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldDedup import DedupCache
+
+RC_ID = '\x00\x00\x00\x00\x00\x01'
+STA_ID = '\x00\x00\x00\x00\x00\x02'
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 0.0
+
+    def monotonic(self):
+        return self.t
+
+
+class DedupCacheTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_dedup """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DedupCache(size=4, ttl=10.0, clock=self.clock)
+
+    def test_duplicate_within_ttl(self):
+        self.assertFalse(self.cache.seen((RC_ID, STA_ID, 0, 0x01)))
+        self.assertTrue(self.cache.seen((RC_ID, STA_ID, 0, 0x01)))
+        # another tag with the same SN is another frame
+        self.assertFalse(self.cache.seen((RC_ID, STA_ID, 0, 0x02)))
+        self.assertEqual(self.cache.stats(), dict(hits=1, misses=2, evictions=0, size=2))
+
+    def test_key_is_new_again_after_ttl(self):
+        self.cache.seen((RC_ID, STA_ID, 0, 0x01))
+        self.clock.t = 10.0
+        self.assertFalse(self.cache.seen((RC_ID, STA_ID, 0, 0x01)))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_oldest_key_is_evicted_when_full(self):
+        for sn in range(4):
+            self.cache.seen((RC_ID, STA_ID, sn, 0x01))
+        # a hit refreshes SN 0, so SN 1 is the oldest one
+        self.assertTrue(self.cache.seen((RC_ID, STA_ID, 0, 0x01)))
+        self.cache.seen((RC_ID, STA_ID, 4, 0x01))
+        self.assertEqual(len(self.cache), 4)
+        self.assertFalse(self.cache.seen((RC_ID, STA_ID, 1, 0x01)))
+        self.assertTrue(self.cache.seen((RC_ID, STA_ID, 0, 0x01)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldDispatcher import Dispatcher
+from protocol.znldFrame import Frame
+from protocol.znldRtt import RttTable
+from protocol.znldTransaction import Transaction, TransactionEngine
+
+RC_ID = '\x00\x00\x00\x00\x00\x01'
+STA_ID = '\x00\x00\x00\x00\x00\x03'
+TAG_ACK = '\x01'
+TAG_NACK = '\x02'
+TAG_POLL = '\x03'
+
+
+class FakeClock(object):
+    """ time only goes on when somebody waits for it """
+    def __init__(self):
+        self.t = 0.0
+
+    def monotonic(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += seconds
+
+    def wait(self, event, timeout=None):
+        if not event.is_set() and timeout is not None:
+            self.t += timeout
+        return event.is_set()
+
+
+def ack(sn):
+    return Frame(STA_ID, RC_ID, sn, TAG_ACK, '\x00' * 4)
+
+
+class DispatcherTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_dispatcher """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dispatcher = Dispatcher(late_ttl=lambda src_id: 2.0, clock=self.clock)
+
+    def test_waiter_gets_its_frame(self):
+        pending = self.dispatcher.expect(STA_ID, (TAG_ACK, TAG_NACK), 5)
+        self.assertFalse(self.dispatcher.dispatch(ack(7)))
+        self.assertTrue(self.dispatcher.dispatch(ack(5)))
+        self.assertEqual(pending.wait(0).sn, 5)
+        self.assertFalse(pending.claimed)
+        self.assertEqual(self.dispatcher.stats()['waiting'], 0)
+
+    def test_late_frame_is_claimed_once(self):
+        self.dispatcher.dispatch(ack(5))
+        pending = self.dispatcher.expect(STA_ID, (TAG_ACK, TAG_NACK), 5, since=0.0)
+        self.assertTrue(pending.done())
+        self.assertTrue(pending.claimed)
+        self.assertFalse(self.dispatcher.expect(STA_ID, (TAG_ACK, TAG_NACK), 5).done())
+        self.assertEqual(self.dispatcher.stats()['claimed'], 1)
+
+    def test_late_frame_expires(self):
+        self.dispatcher.dispatch(ack(5))
+        self.clock.t = 2.0
+        self.assertFalse(self.dispatcher.expect(STA_ID, (TAG_ACK, TAG_NACK), 5).done())
+        stats = self.dispatcher.stats()
+        self.assertEqual((stats['expired'], stats['buffered']), (1, 0))
+
+    def test_frame_received_before_the_request_is_not_claimed(self):
+        # the response to an earlier request with the same SN, e.g. one SN wrap-around ago
+        self.dispatcher.dispatch(ack(5))
+        self.clock.t = 0.5
+        self.assertFalse(self.dispatcher.expect(STA_ID, (TAG_ACK, TAG_NACK), 5, since=0.5).done())
+
+
+class TransactionEngineTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_dispatcher """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dispatcher = Dispatcher(clock=self.clock)
+        self.rtt = RttTable(initial_rto=lambda dest_id: 1.0)
+        self.sent = []
+
+    def engine(self, respond):
+        def send(dest_id, mesg):
+            sn = 2 * len(self.sent)
+            self.sent.append(sn)
+            respond(sn)
+            return sn
+        return TransactionEngine(send=send, dispatcher=self.dispatcher, tag_nack=TAG_NACK, rtt=self.rtt,
+                                 clock=self.clock)
+
+    def test_claimed_response_gives_no_rtt_sample(self):
+        # the response is there before the engine waits for it
+        engine = self.engine(lambda sn: self.dispatcher.dispatch(ack(sn + 1)))
+        txn = engine.run([Transaction(STA_ID, TAG_POLL + '\x00' * 4, TAG_ACK, 3)])[0]
+        self.assertTrue(txn.result)
+        self.assertEqual(txn.rtt, None)
+        self.assertEqual(self.rtt.get(STA_ID).samples, 0)
+
+    def test_stale_frame_completes_no_request(self):
+        # a response with the SN of the 1st try came before it was sent, only the 2nd try is answered
+        self.dispatcher.dispatch(ack(1))
+        self.clock.t = 0.5
+        engine = self.engine(lambda sn: sn and self.dispatcher.dispatch(ack(sn + 1)))
+        txn = engine.run([Transaction(STA_ID, TAG_POLL + '\x00' * 4, TAG_ACK, 3)])[0]
+        self.assertTrue(txn.result)
+        self.assertEqual(txn.tries, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
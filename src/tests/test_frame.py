@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldFrame import FRAME_LEN, Encoder, Deframer
+
+SRC_ID = '\x00\x00\x00\x00\x00\x01'
+DEST_ID = '\x00\x00\x00\x00\x00\x02'
+
+
+class DeframerTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_frame """
+    def setUp(self):
+        encoder = Encoder(SRC_ID)
+        self.frames = [encoder.encode(DEST_ID, sn, '\x05\x03\xff\xff\x00') for sn in range(40)]
+
+    def test_chunk_larger_than_buffer(self):
+        deframer = Deframer()
+        self.assertTrue(len(''.join(self.frames)) > 16 * FRAME_LEN)
+        self.assertEqual(deframer.feed(''.join(self.frames)), self.frames)
+        self.assertEqual(deframer.rx_buf.dropped, 0)
+
+    def test_small_pieces(self):
+        deframer = Deframer()
+        stream = ''.join(self.frames)
+        frames = []
+        for offset in range(0, len(stream), 7):
+            frames.extend(deframer.feed(stream[offset:offset + 7]))
+        self.assertEqual(frames, self.frames)
+
+    def test_resync_after_false_header(self):
+        deframer = Deframer()
+        self.assertEqual(deframer.feed('\x55\x55\x00' + ''.join(self.frames[0:2])), self.frames[0:2])
+        self.assertEqual(deframer.resyncs, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
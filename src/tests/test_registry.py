@@ -0,0 +1,25 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import os
+import unittest
+
+from protocol.znldRegistry import config_path
+
+
+class ConfigPathTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_registry """
+    def test_relative_path_is_next_to_the_config(self):
+        self.assertEqual(config_path('/etc/znld/node_config.json', 'groups.json'), '/etc/znld/groups.json')
+        self.assertEqual(config_path('node_config.json', 'telemetry'), os.path.join(os.getcwd(), 'telemetry'))
+
+    def test_absolute_path_or_none_is_kept(self):
+        self.assertEqual(config_path('/etc/znld/node_config.json', '/var/lib/znld/groups.json'),
+                         '/var/lib/znld/groups.json')
+        self.assertEqual(config_path('/etc/znld/node_config.json', None), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
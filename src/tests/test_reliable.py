@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldProtocol import Protocol
+from protocol.znldSim import SimNetwork
+
+MESG_VALUE_LAMP_ALL_ON = Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON
+
+
+class SimReliableTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_reliable """
+    def run_broadcast(self, net):
+        '''
+        :return: (seconds the reliable broadcast took, IDs of the stations reported to have missed it, stats)
+        '''
+        results = []
+
+        def driver(rc):
+            start = net.sim.now
+            acks = rc.RC_reliable_broadcast(MESG_VALUE_LAMP_ALL_ON)
+            results.append((net.sim.now - start, sorted(id for (id, acked) in acks.iteritems() if not acked),
+                            rc.get_reliable_stats()))
+        net.run(driver, until=3600)
+        return results[0]
+
+    def test_beacon_round_ends_when_every_station_acked(self):
+        for hops in (0, 1):
+            net = SimNetwork(stations=16, hops=hops, timeout=1, e32_delay=0.1, seed=1)
+            (took, missed, stats) = self.run_broadcast(net)
+            self.assertEqual((missed, stats['rounds'], stats['repairs']), ([], 1, 0))
+            # the ACK window of the beacon, which isn't waited out
+            self.assertTrue(took < 2 * net.rc.settle_time() + 3 * net.rc._slots.cycle() + 16 * net.rc._slots.slot_len
+                            + net.rc.e32_delay + net.rc._timeout_margin)
+
+    def test_missed_command_is_repaired(self):
+        net = SimNetwork(stations=8, hops=1, timeout=1, e32_delay=0.1, seed=1)
+        port = net.levels[1][-1]
+        dropped = []
+
+        def accepts(frame, accepts=port.accepts):
+            if frame.tag == Protocol.LampControl.TAG_RELIABLE and not dropped:
+                dropped.append(frame)
+                return False
+            return accepts(frame)
+        port.accepts = accepts
+        (took, missed, stats) = self.run_broadcast(net)
+        self.assertEqual((missed, stats['repairs']), ([], 1))
+        self.assertEqual(port.protocol._STA_led_status, MESG_VALUE_LAMP_ALL_ON[0])
+
+    def test_station_which_missed_command_and_beacons_is_reported(self):
+        net = SimNetwork(stations=8, hops=1, timeout=1, e32_delay=0.1, seed=1)
+        port = net.levels[1][-1]
+        # powered off, it hears neither the command nor a beacon
+        port.accepts = lambda frame: False
+        (took, missed, stats) = self.run_broadcast(net)
+        self.assertEqual(missed, [port.protocol._id])
+        self.assertEqual((stats['rounds'], stats['missed']), (3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
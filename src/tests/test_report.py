@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldProtocol import Protocol
+from protocol.znldReport import StatusReporter, report_slot
+from protocol.znldScheduler import TxScheduler
+from protocol.znldSim import SimNetwork
+
+BYTE_ALL_ON = ord(Protocol.LampControl.BYTE_ALL_ON)
+BYTE_ALL_OFF = ord(Protocol.LampControl.BYTE_ALL_OFF)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 0.0
+
+    def monotonic(self):
+        return self.t
+
+
+class ReportSlotTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_report """
+    def test_retries_move_to_another_slot(self):
+        slots = 16
+        for key in range(64):
+            attempts = [report_slot(key, attempt, slots) for attempt in range(3)]
+            self.assertEqual(attempts[0], key % slots)
+            self.assertTrue(attempts[0] != attempts[1] != attempts[2])
+        # two stations sharing an ACK slot part on their retry
+        self.assertNotEqual(report_slot(1, 1, slots), report_slot(17, 1, slots))
+        self.assertEqual(report_slot(5, 2, 1), 0)
+
+
+class StatusReporterTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_report """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = TxScheduler(clock=self.clock)
+        self.sent = []
+        self.reporter = StatusReporter(self.sent.append, self.scheduler, lambda attempt: attempt, interval=5.0,
+                                       retry=3, timeout=2.0, clock=self.clock)
+
+    def run_until(self, t):
+        while True:
+            deadline = self.scheduler.run_due()
+            if deadline is None or deadline > t:
+                break
+            self.clock.t = deadline
+        self.clock.t = t
+        self.scheduler.run_due()
+
+    def test_changes_are_coalesced_and_rate_limited(self):
+        self.reporter.changed()
+        self.reporter.changed()
+        self.run_until(1.0)
+        self.assertEqual(self.sent, [1])
+        self.assertTrue(self.reporter.ack(1))
+        self.assertFalse(self.reporter.ack(1))
+        self.reporter.changed()
+        # not earlier than `interval` after the last one
+        self.run_until(4.9)
+        self.assertEqual(self.sent, [1])
+        self.run_until(5.0)
+        self.assertEqual(self.sent, [1, 2])
+        self.assertEqual(self.reporter.stats()['coalesced'], 1)
+
+    def test_report_is_sent_again_until_acked(self):
+        self.reporter.changed()
+        # timeout 2 s doubled for each retry, and the holdoff of the attempt
+        self.run_until(2.0 + 1 + 4.0 + 2 + 8.0)
+        self.assertEqual(self.sent, [1, 1, 1])
+        stats = self.reporter.stats()
+        self.assertEqual((stats['retries'], stats['failed'], stats['pending']), (2, 1, False))
+        self.assertFalse(self.reporter.ack(1))
+
+
+class SimLampReportTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_report """
+    def setUp(self):
+        self.net = SimNetwork(stations=8, hops=1, timeout=1, e32_delay=0.1, seed=1)
+
+    def run_driver(self, requests):
+        ''' :return: lamp_ctrl_status of every station after the requests and the status reports RC got '''
+        results = []
+
+        def driver(rc):
+            requests(rc)
+            # the reports come in their report slots
+            self.net.sleep(60)
+            results.append(dict((id, rc.stations.station(id)['lamp_ctrl_status']) for id in rc.stations.bin_ids()))
+        self.net.run(driver, until=3600)
+        return results[0]
+
+    def test_group_lamp_ctrl_without_ack_is_reported(self):
+        members = self.net.sta_ids[0:4]
+
+        def requests(rc):
+            for id in members:
+                rc.stations.station(id)['groups'] = [1]
+            rc.RC_send_group_map([rc.stations.hex_of(id) for id in members])
+            rc.RC_lamp_ctrl_group(1, Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON)
+        status = self.run_driver(requests)
+        self.assertEqual([status[id] for id in members], [BYTE_ALL_ON] * 4)
+        self.assertEqual(self.net.rc.get_report_stats()['reports'], 4)
+
+    def test_broadcast_without_ack_is_not_reported(self):
+        self.run_driver(lambda rc: rc.RC_lamp_ctrl(Protocol.LampControl.BROADCAST_ID,
+                                                   Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON))
+        self.assertEqual(self.net.rc.get_report_stats()['reports'], 0)
+
+    def test_lamp_bitmap_sets_the_lamp_status(self):
+        on = self.net.sta_ids[0]
+
+        def requests(rc):
+            # the stations which ACK their address take bitmaps
+            rc.RC_send_address_map()
+            self.assertEqual(rc.RC_lamp_bitmap([rc.stations.station(on)['addr']]), 8)
+        status = self.run_driver(requests)
+        self.assertEqual(status[on], BYTE_ALL_ON)
+        self.assertEqual(set(status[id] for id in self.net.sta_ids[1:]), set([BYTE_ALL_OFF]))
+        self.assertEqual(self.net.rc.RC_out_of_sync(), [])
+        self.assertEqual(self.net.rc.get_report_stats()['reports'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
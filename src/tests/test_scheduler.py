@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import threading
+import unittest
+
+from protocol.znldScheduler import TxScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 0.0
+
+    def monotonic(self):
+        return self.t
+
+
+class TxSchedulerTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_scheduler """
+    def test_deadline_order_and_cancel(self):
+        clock = FakeClock()
+        scheduler = TxScheduler(clock=clock)
+        sent = []
+        scheduler.schedule(0.3, sent.append, ('c',))
+        scheduler.schedule(0.1, sent.append, ('a',))
+        entry = scheduler.schedule(0.2, sent.append, ('b',))
+        scheduler.cancel(entry)
+        self.assertEqual(scheduler.run_due(), 0.1)
+        clock.t = 1.0
+        self.assertEqual(scheduler.run_due(), None)
+        self.assertEqual(sent, ['a', 'c'])
+        self.assertEqual(scheduler.stats()['cancelled'], 1)
+
+    def test_thread_sends(self):
+        scheduler = TxScheduler()
+        scheduler.start()
+        sent = threading.Event()
+        scheduler.schedule(0.01, sent.set)
+        self.assertTrue(sent.wait(2))
+        scheduler.stop()
+
+    def test_stop_while_scheduling(self):
+        # schedule() wakes the thread through its pipe, which stop() closes
+        for n in range(20):
+            scheduler = TxScheduler()
+            scheduler.start()
+            done = threading.Event()
+
+            def hammer():
+                while not done.isSet():
+                    scheduler.schedule(0, lambda: None)
+            thread = threading.Thread(target=hammer)
+            thread.start()
+            scheduler.stop()
+            done.set()
+            thread.join()
+            scheduler.schedule(0, lambda: None)
+            self.assertEqual(scheduler._wake_w, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
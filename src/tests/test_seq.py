@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldProtocol import Protocol
+from protocol.znldSeq import SeqCounter, SeqTracker, sn_add, sn_newer
+from protocol.znldSim import SimNetwork
+
+RC_ID = '\x00\x00\x00\x00\x00\x01'
+BROADCAST_ID = Protocol.LampControl.BROADCAST_ID
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 0.0
+
+    def monotonic(self):
+        return self.t
+
+
+class SerialNumberTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_seq """
+    def test_newer_across_wrap(self):
+        self.assertTrue(sn_newer(2, 0))
+        self.assertTrue(sn_newer(1, 255))
+        self.assertFalse(sn_newer(255, 1))
+        self.assertFalse(sn_newer(7, 7))
+        # half of the space ahead is taken as behind
+        self.assertFalse(sn_newer(128, 0))
+        self.assertEqual(sn_add(254, 4), 2)
+
+    def test_counter_leaves_room_for_the_response_frames(self):
+        counter = SeqCounter(step=2)
+        self.assertEqual(counter.next(BROADCAST_ID), 0)
+        self.assertEqual(counter.next(BROADCAST_ID, frames=3), 2)
+        self.assertEqual(counter.next(BROADCAST_ID), 6)
+        # every destination has its own flow
+        self.assertEqual(counter.next(RC_ID), 0)
+
+
+class SeqTrackerTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_seq """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracker = SeqTracker(ttl=600, resync_after=2.0, clock=self.clock)
+
+    def test_duplicates_are_dropped(self):
+        self.assertTrue(self.tracker.accept(RC_ID, BROADCAST_ID, 10))
+        self.assertFalse(self.tracker.accept(RC_ID, BROADCAST_ID, 10))
+        self.assertFalse(self.tracker.accept(RC_ID, BROADCAST_ID, 8))
+        self.assertTrue(self.tracker.accept(RC_ID, BROADCAST_ID, 12))
+        self.assertEqual(self.tracker.stats()['duplicates'], 2)
+
+    def test_resync_after_missing_half_of_the_space(self):
+        self.assertTrue(self.tracker.accept(RC_ID, BROADCAST_ID, 10))
+        # RC sent 70 frames meanwhile, its SN looks older than the last one
+        self.clock.t = 30.0
+        sn = sn_add(10, 2 * 70)
+        self.assertTrue(self.tracker.accept(RC_ID, BROADCAST_ID, sn))
+        self.assertFalse(self.tracker.accept(RC_ID, BROADCAST_ID, sn))
+        self.assertTrue(self.tracker.accept(RC_ID, BROADCAST_ID, sn_add(sn, 2)))
+        self.assertEqual(self.tracker.stats()['resyncs'], 1)
+
+    def test_no_resync_without_resync_after(self):
+        tracker = SeqTracker(ttl=600, clock=self.clock)
+        tracker.accept(RC_ID, BROADCAST_ID, 10)
+        self.clock.t = 30.0
+        self.assertFalse(tracker.accept(RC_ID, BROADCAST_ID, sn_add(10, 2 * 70)))
+
+
+class SimSeqTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_seq """
+    def test_station_takes_broadcasts_after_missing_many(self):
+        net = SimNetwork(stations=4, hops=0, timeout=1, e32_delay=0.1, seed=1)
+        port = net.levels[0][-1]
+        accepts = port.accepts
+        status = []
+
+        def driver(rc):
+            rc.RC_lamp_ctrl(BROADCAST_ID, Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF)
+            net.sleep(1)
+            # powered off for 70 broadcasts
+            port.accepts = lambda frame: False
+            for i in range(70):
+                rc.RC_lamp_ctrl(BROADCAST_ID, Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF)
+                net.sleep(1)
+            port.accepts = accepts
+            rc.RC_lamp_ctrl(BROADCAST_ID, Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON)
+            net.sleep(1)
+            status.append(port.protocol._STA_led_status)
+        net.run(driver, until=3600)
+        self.assertEqual(status, [Protocol.LampControl.BYTE_ALL_ON])
+
+    def test_lamp_bitmap_has_a_flow_of_its_own(self):
+        net = SimNetwork(stations=4, hops=0, timeout=1, e32_delay=0.1, seed=1)
+        sns = []
+
+        def driver(rc):
+            rc.RC_send_address_map()
+            sns.append(rc._send_message(BROADCAST_ID, Protocol.LampControl.MESG_LAMP_ALL_ON))
+            self.assertEqual(rc.RC_lamp_bitmap([2, 3]), 8)
+            sns.append(rc._send_message(BROADCAST_ID, Protocol.LampControl.MESG_LAMP_ALL_OFF))
+        net.run(driver, until=3600)
+        self.assertEqual(sns[1], sn_add(sns[0], 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import shutil
+import tempfile
+import unittest
+
+from protocol.znldSeries import TelemetryStore
+
+T0 = 1500000000 - 1500000000 % 3600 # start of an hour
+
+
+class TelemetryStoreTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_series """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = TelemetryStore(self.path, metrics=('voltage', 'power'), batch=100)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def record_minutes(self, minutes):
+        ''' samples of 2 stations every 10 s, addr 2 at 220 V and addr 3 at 230 V '''
+        for t in range(T0, T0 + 60 * minutes, 10):
+            self.store.record('voltage', 2, 220.0, t=t)
+            self.store.record('voltage', 3, 230.0, t=t)
+
+    def test_raw_and_rollups(self):
+        self.record_minutes(2)
+        self.assertEqual(self.store.query('voltage', T0, T0 + 20, addr=2, resolution='raw'),
+                         [(T0, 1, 220.0, 220.0, 220.0), (T0 + 10, 1, 220.0, 220.0, 220.0)])
+        self.assertEqual(self.store.query('voltage', T0, T0 + 120, resolution='1m'),
+                         [(T0, 12, 220.0, 230.0, 225.0), (T0 + 60, 12, 220.0, 230.0, 225.0)])
+        self.assertEqual(self.store.summary('voltage', T0, T0 + 3600, addr=3), (12, 230.0, 230.0, 230.0))
+        self.assertEqual(self.store.query('power', T0, T0 + 3600), [])
+
+    def test_samples_are_written_in_batches(self):
+        self.record_minutes(1)
+        self.assertEqual(self.store.stats()['pending'], 12)
+        self.record_minutes(9)
+        # 120 samples, 100 of them are written by the batch
+        self.assertEqual(self.store.stats()['pending'], 20)
+        self.assertEqual(self.store.stats()['records']['voltage'], 100)
+
+    def test_sample_older_than_the_last_one_takes_its_time(self):
+        self.store.record('voltage', 2, 220.0, t=T0 + 60)
+        self.store.flush()
+        self.store.record('voltage', 2, 230.0, t=T0)
+        self.assertEqual(self.store.query('voltage', T0, T0 + 120, addr=2, resolution='raw'),
+                         [(T0 + 60, 2, 220.0, 230.0, 225.0)])
+
+    def test_reopen_and_compact(self):
+        self.record_minutes(2)
+        self.store.close()
+        self.store = TelemetryStore(self.path, metrics=('voltage', 'power'), retention={'raw': 60})
+        self.assertEqual(self.store.summary('voltage', T0, T0 + 120, addr=2)[0], 12)
+        # the raw samples of the 1st minute are dropped, the rollups are kept
+        self.assertEqual(self.store.compact(now=T0 + 120), 12)
+        self.assertEqual(self.store.query('voltage', T0, T0 + 120, addr=2, resolution='raw')[0][0], T0 + 60)
+        self.assertEqual(self.store.summary('voltage', T0, T0 + 120, addr=2)[0], 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
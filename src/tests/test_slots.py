@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldProtocol import Protocol, SlotScheduler
+from protocol.znldRoute import ROUTE_MAX_SLOTS
+
+RELAY_ID = '\x00\x00\x00\x00\x00\x05'
+RC_ID = '\x00\x00\x00\x00\x00\x01'
+
+
+class Radio(object):
+    """ transport which sends nothing """
+    baudrate_air = 1200
+
+    def transmit(self, frame):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class SlotSchedulerTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_slots """
+    def scheduler(self, role='RELAY', slots=8, slot=None, addr=None):
+        return SlotScheduler(frame_len=23, air_baudrate=1200, node_id=RELAY_ID, role=role, slots=slots, slot=slot,
+                             addr=addr)
+
+    def test_slots_fit_the_route_stamp(self):
+        self.assertEqual(self.scheduler(slots=ROUTE_MAX_SLOTS).slots, ROUTE_MAX_SLOTS)
+        self.assertRaises(ValueError, self.scheduler, slots=ROUTE_MAX_SLOTS + 1)
+        self.assertRaises(ValueError, self.scheduler, slots=1)
+        self.assertRaises(ValueError, self.scheduler().set_slot, 1, 16)
+
+    def test_relay_stays_out_of_slot_0(self):
+        self.assertRaises(ValueError, self.scheduler, slot=0)
+        self.assertRaises(ValueError, self.scheduler().set_slot, 0, 8)
+        self.assertEqual(self.scheduler(role='STA').slot, 0)
+        relay = self.scheduler()
+        relay.set_slot(7, 8)
+        self.assertEqual((relay.slot, relay.slots), (7, 8))
+        self.assertRaises(ValueError, relay.set_slot, 8, 8)
+
+    def test_relay_slot_from_addr(self):
+        self.assertEqual(self.scheduler().slot, 1 + 5 % 7)
+        self.assertEqual(self.scheduler(addr=10).slot, 1 + 10 % 7)
+        self.assertEqual(self.scheduler(addr=10, slot=2).slot, 2)
+
+    def test_rc_rejects_shared_relay_slots(self):
+        stations = {'000000000002': {'slot': 1}, '000000000003': {'slot': 2}, '000000000004': {'slot': 0},
+                    '000000000005': {}}
+        rc = Protocol(id=RC_ID, role='RC', stations=stations, transport=Radio())
+        self.assertRaises(ValueError, rc.RC_reload_stations, dict(stations, **{'000000000006': {'slot': 2}}))
+        self.assertRaises(ValueError, rc.RC_reload_stations, dict(stations, **{'000000000006': {'slot': 8}}))
+        self.assertEqual(len(rc.stations), 4)
+        stations['000000000004'] = {'slot': 1}
+        self.assertRaises(ValueError, Protocol, id=RC_ID, role='RC', stations=stations, transport=Radio())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldStore import StationStore
+
+STATIONS = {'000000000002': {'name': 'STA_2', 'addr': 2}, '000000000003': {'name': 'STA_3', 'addr': 3}}
+
+
+class StationStoreTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_store """
+    def setUp(self):
+        self.store = StationStore(STATIONS)
+
+    def test_lookups(self):
+        self.assertEqual(self.store.by_addr(3), '000000000003')
+        self.assertEqual(self.store.by_name('STA_2'), '000000000002')
+        self.assertEqual(self.store.hex_of('\x00\x00\x00\x00\x00\x02'), '000000000002')
+        self.assertEqual(self.store['000000000002']['lamp_ctrl_status'], 0)
+        self.assertEqual(self.store.by_addr(9), None)
+
+    def test_duplicate_addr_or_name_is_rejected(self):
+        self.assertRaises(ValueError, self.store.__setitem__, '000000000004', {'addr': 2})
+        self.assertRaises(ValueError, self.store.__setitem__, '000000000004', {'name': 'STA_3'})
+        self.assertRaises(ValueError, self.store['000000000003'].__setitem__, 'addr', 2)
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.by_addr(2), '000000000002')
+        self.assertEqual(self.store['000000000003']['addr'], 3)
+        # the owner keeps its addr, and may set it again
+        self.store['000000000002'] = {'name': 'STA_2', 'addr': 2}
+        del self.store['000000000003']
+        self.assertEqual(self.store.by_addr(2), '000000000002')
+
+    def test_reload_with_duplicates_changes_nothing(self):
+        stations = dict(STATIONS)
+        stations['000000000004'] = {'addr': 3}
+        self.assertRaises(ValueError, self.store.reload, stations)
+        self.assertEqual(sorted(self.store), sorted(STATIONS))
+        # addrs may move from one station to another in one reload
+        (added, removed, changed) = self.store.reload({'000000000002': {'addr': 3}, '000000000003': {'addr': 2}})
+        self.assertEqual(sorted(changed), sorted(STATIONS))
+        self.assertEqual(self.store.by_addr(2), '000000000003')
+        self.assertEqual(self.store.by_addr(3), '000000000002')
+
+    def test_column_is_a_copy(self):
+        self.store.assign('power', 10.0)
+        column = self.store.column('power')
+        self.store['000000000002']['power'] = 20.0
+        self.assertEqual(list(column), [10.0, 10.0])
+        column[0] = 99.0
+        self.assertEqual(self.store.total('power'), 30.0)
+        self.store['000000000004'] = {'addr': 4}
+        self.assertEqual(len(self.store.column('power')), 3)
+
+    def test_queries(self):
+        self.store['000000000003']['lamp_ctrl'] = 3
+        self.assertEqual(self.store.where('lamp_ctrl_status', '!=', 'lamp_ctrl'), ['000000000003'])
+        self.assertEqual(self.store.where('lamp_ctrl', '>=', 3), ['000000000003'])
+
+    def test_on_change(self):
+        changes = []
+        self.store.on_change = lambda id, field, value: changes.append((id, field, value))
+        self.store['000000000002']['voltage'] = 230.0
+        self.store['000000000002']['voltage'] = 230.0
+        self.store['000000000002']['name'] = 'LAMP_2'
+        self.store.assign('lamp_ctrl', 3)
+        self.assertEqual(changes, [('000000000002', 'voltage', 230.0)]
+                         + [(id, 'lamp_ctrl', 3) for id in self.store.ids()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+__author__ = 'Wei'
+
+import unittest
+
+from protocol.znldProtocol import Protocol
+from protocol.znldSim import SimNetwork
+from protocol.znldTelemetry import TelemetryTransaction, TELEMETRY_NAMES, field_mask, frame_count, pack, unpack
+
+TAG_TELEMETRY = Protocol.LampControl.TAG_TELEMETRY
+TAG_TELEMETRY_DATA = Protocol.LampControl.TAG_TELEMETRY_DATA
+
+
+class TelemetryPackTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_telemetry """
+    def test_round_trip(self):
+        mask = field_mask(('voltage', 'energy', 'board_temperature'))
+        values = {'voltage': 229.9, 'energy': 12345.67, 'board_temperature': -12.5}
+        parts = pack(mask, values)
+        # 2 + 3 + 2 bytes in 3 frames, the last one padded
+        self.assertEqual((len(parts), frame_count(mask)), (3, 3))
+        unpacked = unpack(mask, dict(enumerate(parts)))
+        for name in values:
+            self.assertAlmostEqual(unpacked[name], values[name])
+
+    def test_no_value_and_lost_frames(self):
+        mask = field_mask(('voltage', 'energy', 'board_temperature'))
+        parts = dict(enumerate(pack(mask, {'voltage': 230.0, 'energy': 1.0})))
+        self.assertEqual(sorted(unpack(mask, parts)), ['energy', 'voltage'])
+        # energy spans frames 0 and 1
+        del parts[1]
+        self.assertEqual(sorted(unpack(mask, parts)), ['voltage'])
+
+    def test_values_are_clamped(self):
+        mask = field_mask(('current', 'temperature'))
+        parts = dict(enumerate(pack(mask, {'current': -1.0, 'temperature': 1e6})))
+        unpacked = unpack(mask, parts)
+        self.assertEqual(unpacked['current'], 0.0)
+        self.assertAlmostEqual(unpacked['temperature'], 32767 * 0.1)
+
+
+class SimTelemetryTest(unittest.TestCase):
+    """ run it from src/: python -m unittest tests.test_telemetry """
+    def test_retry_takes_the_frame_gap_of_its_route(self):
+        net = SimNetwork(stations=4, hops=1, timeout=1, e32_delay=0.1, seed=1)
+        port = net.levels[0][1]
+        sta = port.protocol
+        sta.STA_set_telemetry(dict((name, 10) for name in TELEMETRY_NAMES))
+        mask = field_mask(TELEMETRY_NAMES)
+        dropped = []
+
+        def accepts(frame, accepts=port.accepts):
+            if frame.tag == TAG_TELEMETRY and not dropped:
+                dropped.append(frame)
+                return False
+            return accepts(frame)
+        txns = []
+
+        def driver(rc):
+            # RC learns that the STA hears it directly, the 1st try goes with the adjacent route stamp
+            rc.RC_unicast_poll(sta._id, Protocol.LampControl.BYTE_ALL_OFF)
+            port.accepts = accepts
+            txns.append(TelemetryTransaction(sta._id, TAG_TELEMETRY, TAG_TELEMETRY_DATA, mask, 3))
+            rc._engine.run(txns)
+        net.run(driver, until=3600)
+        txn = txns[0]
+        # the retry is flooded, the STA sends a frame per slot cycle so that the RELAYs forward each one
+        self.assertEqual((txn.result, txn.tries), (True, 2))
+        self.assertEqual(txn.frame_gap, net.rc._slots.cycle())
+        self.assertEqual(len(txn.values), len(TELEMETRY_NAMES))
+        self.assertEqual(frame_count(mask), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
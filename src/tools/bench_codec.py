@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+micro-benchmark of the frame codec, frames per second of:
+  before: string concatenation + ctypes.c_uint16 around crc_hqx to encode, slicing to decode (the original code)
+  after:  znldFrame.Encoder with the header prefix of each destination, Frame.decode() with one struct layout
+a frame is encoded to one of `stations` destinations with a running SN, every decoded field is read once.
+decode before slices every field only once, while the original code sliced again at each site (RX, dispatcher,
+response check), so it is the lower bound of the old cost; the Frame object costs about 1 us more per frame.
+run it from src/: python tools/bench_codec.py [frames] [stations]
+'''
+
+import os, sys, time, struct, binascii, ctypes
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from protocol.znldFrame import FRAME_HEADER, Encoder, Frame
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+if str is bytes:
+    byte = chr
+else:
+    def byte(n):
+        return bytes((n,))
+
+SRC_ID = b'\x00\x00\x00\x00\x00\x01'
+MESSAGE = b'\x05\x03\xff\xff\x00'
+
+
+def station_ids(stations):
+    return [b'\x00\x00' + struct.pack('>I', n + 2) for n in range(stations)]
+
+
+def legacy_encode(src_id, dest_id, sn, message):
+    tx_str = FRAME_HEADER + src_id + dest_id + byte(sn) + message
+    crc = struct.pack('>H', ctypes.c_uint16(binascii.crc_hqx(tx_str, 0xFFFF)).value)
+    return tx_str + crc
+
+
+def encode_before(dest_ids, frames):
+    return [legacy_encode(SRC_ID, dest_ids[i % len(dest_ids)], i & 0xFF, MESSAGE) for i in range(frames)]
+
+
+def encode_after(dest_ids, frames):
+    encoder = Encoder(SRC_ID)
+    encode = encoder.encode
+    return [encode(dest_ids[i % len(dest_ids)], i & 0xFF, MESSAGE) for i in range(frames)]
+
+
+def legacy_decode(rx_frame):
+    return (rx_frame[2:8], rx_frame[8:14], ord(rx_frame[14:15]), rx_frame[15:16], rx_frame[16:20])
+
+
+def decode_before(frames):
+    for rx_frame in frames:
+        (src_id, dest_id, sn, tag, value) = legacy_decode(rx_frame)
+        data = rx_frame[15:20]
+
+
+def decode_after(frames):
+    decode = Frame.decode
+    for rx_frame in frames:
+        frame = decode(rx_frame)
+        src_id = frame.src_id
+        dest_id = frame.dest_id
+        sn = frame.sn
+        tag = frame.tag
+        value = frame.value
+        data = frame.message()
+
+
+def rate(func, *args):
+    ''' :return: (seconds, result) of the best of 5 runs '''
+    best = None
+    for run in range(5):
+        start = clock()
+        result = func(*args)
+        seconds = clock() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, result)
+    return best
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    stations = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    dest_ids = station_ids(stations)
+    (seconds_before, encoded) = rate(encode_before, dest_ids, frames)
+    (seconds_after, encoded_after) = rate(encode_after, dest_ids, frames)
+    assert encoded == encoded_after, 'encoders disagree'
+    print('encode  before: %9.0f frames/s   after: %9.0f frames/s   x%.2f' %
+          (frames / seconds_before, frames / seconds_after, seconds_before / seconds_after))
+    (seconds_before, result) = rate(decode_before, encoded)
+    (seconds_after, result) = rate(decode_after, encoded)
+    print('decode  before: %9.0f frames/s   after: %9.0f frames/s   x%.2f' %
+          (frames / seconds_before, frames / seconds_after, seconds_before / seconds_after))
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+protocol benchmark on the simulated radio (protocol/znldSim.py), no E32 is needed.
+for every combination of station count, hop count and loss rate the RC broadcasts all on / all off and
+polls every STA after each, like the non-GUI loop of startup.py, and reports:
+  sweep_time     seconds from the broadcast to the last poll done
+  latency        p50 / p90 / p99 / max seconds from the 1st try of a poll to its response
+  tries_per_ok   tries per successful poll
+  air_bytes      bytes on air per sweep, and air_time seconds on air per sweep
+with --compact the RC assigns the short addresses first (not counted), so that the sweeps use compact frames.
+results are written as JSON, --compare prints the change against an earlier result file.
+all times are simulated seconds, the same seed gives the same result.
+run it from src/: python tools/bench_protocol.py [--stations 8,32] [--hops 0,1,2] [--loss 0,0.05] [-o out.json]
+'''
+
+import os, sys, time, math, json, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protocol'))
+
+from protocol.znldProtocol import Protocol
+from protocol.znldTransaction import Transaction
+from protocol.znldSim import SimNetwork
+
+METRICS = ['sweep_time', 'latency_p50', 'latency_p99', 'tries_per_ok', 'air_bytes', 'success']
+
+
+def percentile(values, p):
+    ''' nearest-rank percentile, None for no value '''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1))]
+
+
+def run_case(stations, hops, loss, args):
+    net = SimNetwork(stations=stations, hops=hops, relays=args.relays, loss=loss, seed=args.seed,
+                     retry=args.retry, window=args.window, timeout=args.timeout, e32_delay=args.e32_delay)
+    sweeps = []
+    txns = []
+    joined = {}
+
+    def driver(rc):
+        if args.compact:
+            rc.RC_send_address_map()
+        joined.update(net.medium.stats())
+        for index in range(args.sweeps):
+            for value in (Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON, Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF):
+                started = net.sim.now
+                rc.RC_lamp_ctrl(Protocol.LampControl.BROADCAST_ID, value)
+                net.sleep(rc.settle_time())
+                polls = [Transaction(dest_id, Protocol.LampControl.MESG_POLL, Protocol.LampControl.TAG_POLL_ACK,
+                                     args.retry, expected=value[0]) for dest_id in net.sta_ids]
+                rc.RC_run_transactions(polls)
+                sweeps.append(net.sim.now - started)
+                txns.extend(polls)
+
+    wall = time.time()
+    net.run(driver, until=args.max_time)
+    wall = time.time() - wall
+
+    done = [txn for txn in txns if txn.done()]
+    ok = [txn for txn in done if txn.result]
+    latency = [txn.latency() for txn in ok]
+    medium = net.medium.stats()
+    for key in ('bytes', 'airtime', 'collisions', 'lost'):
+        medium[key] -= joined.get(key, 0)
+    return dict(stations=stations, hops=hops, loss=loss, relays=args.relays, window=args.window, retry=args.retry,
+                compact=args.compact, compact_frames=net.rc.get_address_stats()['compact_frames'],
+                sweeps=len(sweeps),
+                sweep_time=sum(sweeps) / len(sweeps) if sweeps else None,
+                polls=len(done), success=float(len(ok)) / len(done) if done else None,
+                timeouts=sum(1 for txn in done if txn.error.__class__.__name__ == 'RxTimeOut'),
+                latency_p50=percentile(latency, 50), latency_p90=percentile(latency, 90),
+                latency_p99=percentile(latency, 99), latency_max=max(latency) if latency else None,
+                tries_per_ok=float(sum(txn.tries for txn in done)) / len(ok) if ok else None,
+                air_bytes=medium['bytes'] / max(1, len(sweeps)), air_time=medium['airtime'] / max(1, len(sweeps)),
+                collisions=medium['collisions'], lost=medium['lost'],
+                sim_time=net.sim.now, wall_time=wall)
+
+
+def case_key(result):
+    return (result['stations'], result['hops'], result['loss'])
+
+
+def compare(old_results, new_results):
+    old = dict((case_key(result), result) for result in old_results)
+    print('%-20s %s' % ('stations/hops/loss', ' '.join('%14s' % metric for metric in METRICS)))
+    for result in new_results:
+        base = old.get(case_key(result))
+        if base is None:
+            continue
+        cells = []
+        for metric in METRICS:
+            if result[metric] is None or not base.get(metric):
+                cells.append('%14s' % '-')
+            else:
+                cells.append('%+13.1f%%' % ((result[metric] - base[metric]) * 100.0 / base[metric]))
+        print('%-20s %s' % ('%d/%d/%g' % case_key(result), ' '.join(cells)))
+
+
+def int_list(text):
+    return [int(item) for item in text.split(',')]
+
+
+def float_list(text):
+    return [float(item) for item in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='protocol benchmark on the simulated radio')
+    parser.add_argument('--stations', type=int_list, default=[8, 32, 128])
+    parser.add_argument('--hops', type=int_list, default=[0, 1, 2])
+    parser.add_argument('--loss', type=float_list, default=[0.0, 0.05])
+    parser.add_argument('--relays', type=int, default=1, help='RELAYs per hop')
+    parser.add_argument('--sweeps', type=int, default=2, help='all on + all off sweeps per case')
+    parser.add_argument('--window', type=int, default=1)
+    parser.add_argument('--retry', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=1, help='RC timeout margin in seconds')
+    parser.add_argument('--e32-delay', type=float, default=0.1)
+    parser.add_argument('--max-time', type=float, default=None, help='simulated seconds per case at most')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--compact', action='store_true', help='assign short addresses for compact frames')
+    parser.add_argument('-o', '--output', help='JSON result file, stdout by default')
+    parser.add_argument('--compare', help='JSON result file of an earlier run')
+    args = parser.parse_args()
+
+    results = []
+    for stations in args.stations:
+        for hops in args.hops:
+            for loss in args.loss:
+                result = run_case(stations, hops, loss, args)
+                sys.stderr.write('%d STAs, %d hops, loss %g: sweep %s s, p99 %s s, %s tries/ok (%.1f s)\n' %
+                                 (stations, hops, loss, result['sweep_time'], result['latency_p99'],
+                                  result['tries_per_ok'], result['wall_time']))
+                results.append(result)
+
+    report = dict(benchmark='protocol', seed=args.seed, created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f)['results'], results)
+
+if __name__ == "__main__":
+    main()
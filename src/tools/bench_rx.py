@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+micro-benchmark of the serial RX frame extraction:
+  before: string concatenation in aSerial.receive() + re-slicing in Protocol._recv_frame() (the original code)
+  after:  RxBuffer filled by readinto() + znldFrame.Deframer memoryview slices
+over a noisy stream of 1M bytes which is delivered in random sized reads.
+allocations are counted on the data path: every new string (before) or buffer move / frame copy (after).
+note the original code loses sync on noise (it keeps reading 2 bytes at a time after a CRC failure), so
+it finds far fewer frames; the per KiB figures compare the two on the same input.
+run it from src/: python tools/bench_rx.py [stream_bytes]
+'''
+
+import os, sys, random, struct, binascii, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.rxBuffer import RxBuffer
+from protocol.znldFrame import FRAME_HEADER, FRAME_LEN, crc16, Deframer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    cpu_time = time.clock
+
+
+def make_stream(size, seed=1):
+    ''' valid frames mixed with random noise and false headers, return (stream, number of valid frames) '''
+    rnd = random.Random(seed)
+    parts = []
+    length = 0
+    frames = 0
+    while length < size:
+        choice = rnd.random()
+        if choice < 0.6:
+            payload = FRAME_HEADER + bytes(bytearray(rnd.randrange(256) for _ in range(FRAME_LEN - 4)))
+            part = payload + crc16(payload)
+            frames += 1
+        elif choice < 0.8:
+            part = FRAME_HEADER + bytes(bytearray(rnd.randrange(256) for _ in range(rnd.randrange(1, 30))))
+        else:
+            part = bytes(bytearray(rnd.randrange(256) for _ in range(rnd.randrange(1, 40))))
+        parts.append(part)
+        length += len(part)
+    return b''.join(parts), frames
+
+
+class FakePort(object):
+    ''' serial port which makes another random sized chunk available on every inWaiting() '''
+    def __init__(self, stream, seed=2):
+        self._stream = stream
+        self._rnd = random.Random(seed)
+        self._pos = 0
+        self._avail = 0
+
+    def eof(self):
+        return self._pos >= len(self._stream)
+
+    def inWaiting(self):
+        self._avail = min(self._avail + self._rnd.randrange(1, 64), len(self._stream) - self._pos)
+        return self._avail
+
+    def read(self, n):
+        n = min(n, self._avail)
+        data = self._stream[self._pos:self._pos + n]
+        self._pos += n
+        self._avail -= n
+        return data
+
+    def readinto(self, b):
+        n = min(len(b), self._avail)
+        b[0:n] = self._stream[self._pos:self._pos + n]
+        self._pos += n
+        self._avail -= n
+        return n
+
+
+class Counter(object):
+    def __init__(self):
+        self.allocs = 0
+        self.bytes = 0
+
+    def add(self, obj):
+        self.allocs += 1
+        self.bytes += len(obj)
+        return obj
+
+
+def run_before(stream, counter):
+    ''' the original aSerial.receive(n) + Protocol._recv_frame() logic, without the sleep(1) '''
+    port = FakePort(stream)
+    frames = 0
+
+    def receive(n):
+        rxStr = b''
+        rx_cnt = 0
+        while rx_cnt < n and not port.eof():
+            rxn = port.inWaiting()
+            left = n - rxn - rx_cnt
+            if left >= 0:
+                rxStr = counter.add(rxStr + counter.add(port.read(rxn)))
+                rx_cnt = rx_cnt + rxn
+            else:
+                rxStr = counter.add(rxStr + counter.add(port.read(n - rx_cnt)))
+                rx_cnt = n
+        return rxStr
+
+    while not port.eof():
+        done = False
+        got_header = False
+        rx_str = b''
+        rx_len = FRAME_LEN
+        while not done and not port.eof():
+            rx_str = counter.add(rx_str + receive(rx_len))
+            if not got_header:
+                index = rx_str.find(FRAME_HEADER)
+                if index == -1:
+                    rx_str = b''
+                else:
+                    got_header = True
+                    rx_str = counter.add(rx_str[index:])
+                    rx_len = index
+            else:
+                rx_crc = counter.add(rx_str[-2:])
+                str_payload = counter.add(rx_str[0:FRAME_LEN - 2])
+                if crc16(str_payload) == rx_crc:
+                    done = True
+                else:
+                    got_header = False
+                    rx_str = counter.add(rx_str[2:])
+                    rx_len = 2
+        if done:
+            frames += 1
+    return frames
+
+
+class CountingRxBuffer(RxBuffer):
+    counter = None
+
+    def _compact(self):
+        self.counter.bytes += len(self)
+        super(CountingRxBuffer, self)._compact()
+
+
+def run_after(stream, counter):
+    port = FakePort(stream)
+    rx_buf = CountingRxBuffer(size=16 * FRAME_LEN)
+    rx_buf.counter = counter
+    deframer = Deframer(FRAME_LEN, rx_buf)
+    frames = 0
+    while True:
+        frame = deframer.next_frame()
+        if frame is not None:
+            counter.add(frame.tobytes())
+            frames += 1
+            continue
+        if port.eof():
+            break
+        rxn = port.inWaiting()
+        free = rx_buf.writable()
+        rx_buf.commit(port.readinto(free[0:min(rxn, len(free))]))
+    return frames
+
+
+def measure(name, func, stream):
+    counter = Counter()
+    if tracemalloc:
+        tracemalloc.start()
+    t0 = cpu_time()
+    frames = func(stream, counter)
+    cpu = cpu_time() - t0
+    peak = None
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    kbytes = len(stream) / 1024.0
+    print('%-7s frames=%-6d cpu/frame=%10.2f us  allocs/frame=%10.2f  alloc bytes/frame=%12.1f  peak traced=%s' %
+          (name, frames, cpu * 1e6 / max(frames, 1), float(counter.allocs) / max(frames, 1),
+           float(counter.bytes) / max(frames, 1), 'n/a' if peak is None else '%d bytes' % peak))
+    print('%-7s per KiB of stream: cpu=%.2f us  allocs=%.2f  alloc bytes=%.1f' %
+          ('', cpu * 1e6 / kbytes, counter.allocs / kbytes, counter.bytes / kbytes))
+    return frames
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    stream, expected = make_stream(size)
+    print('stream: %d bytes, %d valid frames' % (len(stream), expected))
+    measure('before', run_before, stream)
+    measure('after', run_after, stream)
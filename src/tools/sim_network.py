@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+simulate a network of RC, RELAYs and STAs running the real Protocol code on virtual time:
+the RC broadcasts all on / all off and polls every STA after each, like the non-GUI loop of startup.py,
+until the simulated duration is over.
+run it from src/: python tools/sim_network.py [-h] [--stations 512] [--hops 2] [--duration 3600] ...
+'''
+
+import os, sys, time, argparse, binascii
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'protocol'))
+
+from protocol.znldProtocol import Protocol
+from protocol.znldSim import SimNetwork
+from libs.myException import *
+
+CHUNK = 32
+
+
+def main():
+    parser = argparse.ArgumentParser(description='wireless UART network simulation')
+    parser.add_argument('--stations', type=int, default=512)
+    parser.add_argument('--hops', type=int, default=1)
+    parser.add_argument('--relays', type=int, default=1, help='RELAYs per hop')
+    parser.add_argument('--loss', type=float, default=0.01, help='loss probability of every link')
+    parser.add_argument('--duration', type=float, default=3600, help='simulated seconds')
+    parser.add_argument('--window', type=int, default=1)
+    parser.add_argument('--retry', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=1, help='RC timeout margin in seconds')
+    parser.add_argument('--e32-delay', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    net = SimNetwork(stations=args.stations, hops=args.hops, relays=args.relays, loss=args.loss, seed=args.seed,
+                     retry=args.retry, window=args.window, timeout=args.timeout, e32_delay=args.e32_delay)
+    results = dict(OK=0, ERR_TAG=0, ERR_TO=0, ERR_NACK=0)
+    sweeps = []
+
+    def driver(rc):
+        while True:
+            for value in (Protocol.LampControl.MESG_VALUE_LAMP_ALL_ON, Protocol.LampControl.MESG_VALUE_LAMP_ALL_OFF):
+                started = net.sim.now
+                rc.RC_lamp_ctrl(Protocol.LampControl.BROADCAST_ID, value)
+                net.sleep(rc.settle_time())
+                # poll in chunks so that a sweep cut by the end of simulation is counted as well
+                for index in range(0, len(net.sta_ids), CHUNK):
+                    for error in rc.RC_unicast_poll_multi(net.sta_ids[index:index+CHUNK], value[0]).itervalues():
+                        if error is None:
+                            results['OK'] += 1
+                        elif isinstance(error, RxUnexpectedTag):
+                            results['ERR_TAG'] += 1
+                        elif isinstance(error, RxNack):
+                            results['ERR_NACK'] += 1
+                        else:
+                            results['ERR_TO'] += 1
+                sweeps.append(net.sim.now - started)
+
+    wall = time.time()
+    net.run(driver, until=args.duration)
+    wall = time.time() - wall
+
+    print('%d STAs, %d hops, %d RELAYs per hop, loss %.3f' % (args.stations, args.hops, args.relays, args.loss))
+    print('simulated %.1f s in %.2f s (%.0fx), %d events' % (net.sim.now, wall, net.sim.now / wall, net.sim.events))
+    if sweeps:
+        print('sweeps: %d, %.1f s on average' % (len(sweeps), sum(sweeps) / len(sweeps)))
+    print('polls: %s' % results)
+    print('medium: %s' % net.medium.stats())
+    print('RC dispatcher: %s' % net.rc.get_dispatch_stats())
+
+if __name__ == "__main__":
+    main()